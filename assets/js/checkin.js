@@ -0,0 +1,126 @@
+// Check-in submission for flaky mobile networks.
+// Every attempt of one submission carries the same Idempotency-Key, so when a
+// response is lost the retry gets the original answer back from the server
+// instead of being checked (and possibly recorded) again. Network errors, 409
+// (first attempt still running) and 503 (server busy) are retried with backoff.
+(function () {
+  'use strict';
+
+  const RETRY_STATUSES = [409, 503];
+  const MAX_ATTEMPTS = 4;
+  const MAX_WAIT_MS = 10000;
+
+  function newKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    const bytes = new Uint8Array(16);
+    crypto.getRandomValues(bytes);
+    return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+  }
+
+  function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+  }
+
+  function retryDelay(res, attempt) {
+    const after = res ? parseFloat(res.headers.get('Retry-After')) : NaN;
+    const base = Number.isFinite(after) ? after * 1000 : 500 * 2 ** (attempt - 1);
+    // Jitter keeps a room full of phones from retrying in step.
+    return Math.min(base * (0.8 + Math.random() * 0.4), MAX_WAIT_MS);
+  }
+
+  // POST `body` (a FormData, or a JSON string with a CSRF header in `headers`)
+  // and resolve with the parsed JSON answer.
+  // `key` identifies the submission: pass the same one when the user retries
+  // after an error was thrown, and a new one after any answer was received.
+  async function post(url, body, key, headers) {
+    for (let attempt = 1; ; attempt++) {
+      let res = null;
+      try {
+        res = await fetch(url, {
+          method: 'POST',
+          body: body,
+          headers: Object.assign({'Idempotency-Key': key}, headers),
+          credentials: 'same-origin',
+        });
+        if (!RETRY_STATUSES.includes(res.status)) return await res.json();
+      } catch (err) {
+        if (attempt >= MAX_ATTEMPTS) throw err;
+      }
+      if (attempt >= MAX_ATTEMPTS) return res.json();
+      await sleep(retryDelay(res, attempt));
+    }
+  }
+
+  // Offline queue. A check-in that cannot reach the server is kept in
+  // localStorage with the ticket the page was rendered with and the time it
+  // was made; sync() posts the queue once the connection is back and the
+  // server checks every attempt at its recorded time (checkin/offline.py).
+  const QUEUE_KEY = 'neosign.checkin.queue';
+  const SYNC_JITTER_MS = 15000;
+  let syncing = false;
+
+  function pending() {
+    try {
+      return JSON.parse(localStorage.getItem(QUEUE_KEY)) || [];
+    } catch (err) {
+      return [];
+    }
+  }
+
+  function save(queue) {
+    if (queue.length) localStorage.setItem(QUEUE_KEY, JSON.stringify(queue));
+    else localStorage.removeItem(QUEUE_KEY);
+  }
+
+  // `attempt` is {ticket, time?, qr_token?, lat?, lng?}; time defaults to now.
+  function enqueue(attempt) {
+    const queue = pending();
+    queue.push(Object.assign({time: new Date().toISOString()}, attempt));
+    save(queue);
+  }
+
+  function csrfToken() {
+    const m = document.cookie.match(/csrftoken=([^;]+)/);
+    return m ? m[1] : '';
+  }
+
+  // Resolve with the server's answer, or null when there was nothing to send
+  // or the server could not be reached (the queue is then kept).
+  async function sync(url) {
+    const queue = pending();
+    if (syncing || !queue.length) return null;
+    syncing = true;
+    try {
+      const data = await post(
+        url,
+        JSON.stringify({sent_at: new Date().toISOString(), attempts: queue}),
+        newKey(),
+        {'Content-Type': 'application/json', 'X-CSRFToken': csrfToken()}
+      );
+      // Every attempt sent got a final answer; keep only what was queued meanwhile.
+      if (data.success) save(pending().slice(queue.length));
+      return data;
+    } catch (err) {
+      return null;
+    } finally {
+      syncing = false;
+    }
+  }
+
+  // Sync now, and again whenever the browser comes back online. The delay
+  // after reconnecting spreads a hall full of phones over a few seconds.
+  function autoSync(url, onResult) {
+    const run = () => sync(url).then(data => { if (data && onResult) onResult(data); });
+    window.addEventListener('online', () => setTimeout(run, Math.random() * SYNC_JITTER_MS));
+    run();
+  }
+
+  window.NeoSignCheckIn = {
+    newKey: newKey,
+    post: post,
+    pending: pending,
+    enqueue: enqueue,
+    sync: sync,
+    autoSync: autoSync,
+  };
+})();
@@ -0,0 +1,48 @@
+// QR decoding for the camera pages (scan and collect).
+// Uses the native BarcodeDetector where the browser has one; jsQR is only
+// fetched when it is needed, from the URL the page passes in.
+(function () {
+  'use strict';
+
+  function loadScript(src) {
+    return new Promise((resolve, reject) => {
+      const el = document.createElement('script');
+      el.src = src; el.onload = resolve; el.onerror = reject;
+      document.head.appendChild(el);
+    });
+  }
+
+  async function nativeDecoder(video) {
+    if (!('BarcodeDetector' in window)) return null;
+    try {
+      const formats = await BarcodeDetector.getSupportedFormats();
+      if (!formats.includes('qr_code')) return null;
+      const detector = new BarcodeDetector({formats: ['qr_code']});
+      return async () => {
+        const codes = await detector.detect(video);
+        return codes.map(code => code.rawValue);
+      };
+    } catch (err) {
+      return null;
+    }
+  }
+
+  // Resolve with a function that reads the current frame of `video` and
+  // resolves with the decoded QR strings (jsQR finds at most one per frame).
+  async function decoder(video, jsqrUrl) {
+    const native = await nativeDecoder(video);
+    if (native) return native;
+    if (!window.jsQR) await loadScript(jsqrUrl);
+    const canvas = document.createElement('canvas');
+    const ctx = canvas.getContext('2d', {willReadFrequently: true});
+    return async () => {
+      canvas.width = video.videoWidth; canvas.height = video.videoHeight;
+      ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
+      const imgData = ctx.getImageData(0, 0, canvas.width, canvas.height);
+      const code = jsQR(imgData.data, canvas.width, canvas.height);
+      return code && code.data ? [code.data] : [];
+    };
+  }
+
+  window.NeoSignQR = {decoder: decoder};
+})();
@@ -0,0 +1,101 @@
+import tempfile
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.testing import FIXTURE_PASSWORD, LARGE, SMALL, QueryBudgetMixin, seed
+
+User = get_user_model()
+
+
+class AuthenticationViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Query budgets for every view in authentication.urls; they must not grow with the data."""
+
+    size = SMALL
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(cls.size)
+
+    def setUp(self):
+        # Keep generated login keys out of the source tree.
+        key_dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(LOGIN_KEY_DIR=key_dir))
+
+    def test_login_form(self):
+        response = self.assertQueryBudget(3, 'get', reverse('authentication:login'))
+        self.assertContains(response, 'BEGIN PUBLIC KEY')
+
+    def test_login(self):
+        data = {'username': self.data.member.username, 'password': FIXTURE_PASSWORD}
+        response = self.assertQueryBudget(12, 'post', reverse('authentication:login'), data, status=302)
+        self.assertRedirects(response, reverse('checkin:dashboard'), fetch_redirect_response=False)
+
+    def test_logout(self):
+        self.client.force_login(self.data.member)
+        response = self.assertQueryBudget(6, 'get', reverse('authentication:logout'), status=302)
+        self.assertRedirects(response, reverse('authentication:login'), fetch_redirect_response=False)
+
+    def test_password_change_form(self):
+        User.objects.filter(pk=self.data.member.pk).update(first_login=True)
+        self.client.force_login(self.data.member)
+        self.assertQueryBudget(5, 'get', reverse('authentication:password_change_required'))
+
+    def test_password_change(self):
+        User.objects.filter(pk=self.data.member.pk).update(first_login=True)
+        self.client.force_login(self.data.member)
+        data = {
+            'old_password': FIXTURE_PASSWORD,
+            'new_password1': 'Another-Passw0rd!',
+            'new_password2': 'Another-Passw0rd!',
+        }
+        response = self.assertQueryBudget(
+            15, 'post', reverse('authentication:password_change_required'), data, status=302
+        )
+        self.assertRedirects(response, reverse('checkin:dashboard'), fetch_redirect_response=False)
+
+
+class AuthenticationViewQueryBudgetLargeTests(AuthenticationViewQueryBudgetTests):
+    size = LARGE
+
+    @tag('timing')
+    def test_login_render_time(self):
+        with self.assertFasterThan(1.0, 'login page'):
+            self.client.get(reverse('authentication:login'))
+
+
+class LoginRateLimitTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        key_dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(LOGIN_KEY_DIR=key_dir))
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    @override_settings(RATELIMITS={'login:ip': '', 'login:username': '3/m'})
+    def test_username_is_limited_before_authenticating(self):
+        url = reverse('authentication:login')
+        wrong = {'username': self.data.member.username, 'password': 'wrong'}
+        for _ in range(3):
+            self.assertEqual(self.client.post(url, wrong).status_code, 200)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'username': self.data.member.username, 'password': FIXTURE_PASSWORD})
+        # Turned away without looking up (or hashing the password of) the account.
+        self.assertFalse([q for q in queries if 'core_customuser' in q['sql']])
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertContains(response, '登录尝试过于频繁', status_code=429)
+        self.assertContains(response, f'value="{self.data.member.username}"', status_code=429)
+
+        # Another account from the same address is not affected.
+        other = {'username': self.data.members[1].username, 'password': FIXTURE_PASSWORD}
+        self.assertEqual(self.client.post(url, other).status_code, 302)
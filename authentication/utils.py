@@ -1,32 +1,45 @@
 from __future__ import annotations
 
 import base64
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, NamedTuple, Optional
 
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding, rsa
-from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
-from cryptography.hazmat.backends import default_backend
 from django.conf import settings
 
-# Default key locations (relative to project root)
-DEFAULT_LOGIN_KEY_DIR = Path(getattr(settings, 'LOGIN_KEY_DIR', settings.BASE_DIR / 'secrets' / 'keys'))
-DEFAULT_LOGIN_PRIVATE_KEY = Path(getattr(settings, 'LOGIN_PRIVATE_KEY_PATH', DEFAULT_LOGIN_KEY_DIR / 'login_private.pem'))
-DEFAULT_LOGIN_PUBLIC_KEY = Path(getattr(settings, 'LOGIN_PUBLIC_KEY_PATH', DEFAULT_LOGIN_KEY_DIR / 'login_public.pem'))
+if TYPE_CHECKING:
+    from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
 
+# cryptography is imported inside the functions that need it: only the login
+# page and login POST use it, so other workers and requests skip the import.
+
+
+class LoginKeyPaths(NamedTuple):
+    directory: Path
+    private: Path
+    public: Path
+
+
+def login_key_paths() -> LoginKeyPaths:
+    """Key locations from settings (LOGIN_KEY_DIR, LOGIN_PRIVATE_KEY_PATH, LOGIN_PUBLIC_KEY_PATH)."""
+    key_dir = Path(getattr(settings, 'LOGIN_KEY_DIR', settings.BASE_DIR / 'secrets' / 'keys'))
+    return LoginKeyPaths(
+        key_dir,
+        Path(getattr(settings, 'LOGIN_PRIVATE_KEY_PATH', key_dir / 'login_private.pem')),
+        Path(getattr(settings, 'LOGIN_PUBLIC_KEY_PATH', key_dir / 'login_public.pem')),
+    )
 
-def _ensure_keys_exist():
-    """Generate RSA keypair if missing (no terminal commands needed)."""
-    key_dir = Path(DEFAULT_LOGIN_KEY_DIR)
-    priv_path = Path(DEFAULT_LOGIN_PRIVATE_KEY)
-    pub_path = Path(DEFAULT_LOGIN_PUBLIC_KEY)
 
-    if priv_path.exists() and pub_path.exists():
+def _ensure_keys_exist(paths: LoginKeyPaths) -> None:
+    """Generate RSA keypair if missing (no terminal commands needed)."""
+    if paths.private.exists() and paths.public.exists():
         return
 
-    key_dir.mkdir(parents=True, exist_ok=True)
-    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    paths.directory.mkdir(parents=True, exist_ok=True)
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
     public_key = private_key.public_key()
 
     priv_bytes = private_key.private_bytes(
@@ -39,32 +52,40 @@ def _ensure_keys_exist():
         format=serialization.PublicFormat.SubjectPublicKeyInfo,
     )
 
-    priv_path.write_bytes(priv_bytes)
-    pub_path.write_bytes(pub_bytes)
+    paths.private.write_bytes(priv_bytes)
+    paths.public.write_bytes(pub_bytes)
+
 
+@lru_cache(maxsize=4)
+def _load_private_key(path: Path, mtime_ns: int) -> RSAPrivateKey:
+    """Parse the PEM once per file version (the mtime is part of the cache key)."""
+    from cryptography.hazmat.primitives import serialization
 
-def _load_private_key(path: Path) -> RSAPrivateKey:
     with path.open('rb') as f:
-        return serialization.load_pem_private_key(f.read(), password=None, backend=default_backend())
+        return serialization.load_pem_private_key(f.read(), password=None)
 
 
 def get_login_public_key_pem() -> Optional[str]:
     """Return public key PEM as string if available, else None."""
-    _ensure_keys_exist()
-    path = Path(DEFAULT_LOGIN_PUBLIC_KEY)
-    if not path.exists():
+    paths = login_key_paths()
+    _ensure_keys_exist(paths)
+    if not paths.public.exists():
         return None
-    return path.read_text(encoding='utf-8')
+    return paths.public.read_text(encoding='utf-8')
 
 
 def decrypt_login_password(ciphertext_b64: str) -> str:
     """Decrypt base64 ciphertext with private key using RSA-OAEP SHA-256."""
-    _ensure_keys_exist()
-    path = Path(DEFAULT_LOGIN_PRIVATE_KEY)
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    paths = login_key_paths()
+    _ensure_keys_exist(paths)
+    path = paths.private
     if not path.exists():
         raise FileNotFoundError(f"Login private key not found at {path}")
 
-    private_key = _load_private_key(path)
+    private_key = _load_private_key(path, path.stat().st_mtime_ns)
     ciphertext = base64.b64decode(ciphertext_b64)
     plaintext = private_key.decrypt(
         ciphertext,
@@ -74,4 +95,4 @@ def decrypt_login_password(ciphertext_b64: str) -> str:
             label=None,
         ),
     )
-    return plaintext.decode('utf-8')
\ No newline at end of file
+    return plaintext.decode('utf-8')
@@ -1,3 +1,5 @@
+import math
+
 from django.contrib import messages
 from django.contrib.auth import login
 from django.contrib.auth.views import LoginView, LogoutView, PasswordChangeView
@@ -7,19 +9,30 @@ from django.utils import timezone
 from django.utils.translation import gettext as _
 from django.contrib.auth import logout
 
+from core.ratelimit import RateLimitMixin
+
 from .forms import CustomAuthenticationForm, RequiredPasswordChangeForm
 from .utils import get_login_public_key_pem
 
 
-class CustomLoginView(LoginView):
+class CustomLoginView(RateLimitMixin, LoginView):
     template_name = 'authentication/login.html'
     form_class = CustomAuthenticationForm
+    rate_limits = (('login:ip', 'ip'), ('login:username', 'username'))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['login_public_key'] = get_login_public_key_pem()
         return context
 
+    def rate_limited(self, request, retry_after):
+        # An unbound form: validating the posted one would authenticate, which is what is being limited.
+        form = self.form_class(request, initial={'username': request.POST.get('username', '')})
+        context = self.get_context_data(form=form, rate_limit_error=_('登录尝试过于频繁，请稍后再试'))
+        response = self.render_to_response(context, status=429)
+        response['Retry-After'] = str(math.ceil(retry_after))
+        return response
+
     def form_valid(self, form):
         response = super().form_valid(form)
         user = self.request.user
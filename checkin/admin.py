@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from . import membership, qrtoken
 from .models import Activity, ActivityParticipation, CheckInRecord
 
 
@@ -9,12 +10,27 @@ class ActivityAdmin(admin.ModelAdmin):
 	list_filter = ('is_active',)
 	search_fields = ('name',)
 
+	def save_model(self, request, obj, form, change):
+		super().save_model(request, obj, form, change)
+		if change and 'qr_secret' in form.changed_data:
+			qrtoken.forget(obj.pk)
+
 
 @admin.register(ActivityParticipation)
 class ActivityParticipationAdmin(admin.ModelAdmin):
 	list_display = ('activity', 'user', 'can_participate')
 	list_filter = ('can_participate',)
 
+	def delete_model(self, request, obj):
+		super().delete_model(request, obj)
+		membership.touch(obj.activity_id)
+
+	def delete_queryset(self, request, queryset):
+		activity_ids = set(queryset.values_list('activity_id', flat=True))
+		super().delete_queryset(request, queryset)
+		for activity_id in activity_ids:
+			membership.touch(activity_id)
+
 
 @admin.register(CheckInRecord)
 class CheckInRecordAdmin(admin.ModelAdmin):
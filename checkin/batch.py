@@ -0,0 +1,173 @@
+"""Check in many users to one activity with a fixed number of queries.
+
+Used by the kiosk batch API: eligibility comes from the in-memory membership
+set (``checkin/membership.py``), and ``write_checkins()`` stores a whole batch
+with one query for the users already checked in plus one ``bulk_create``.
+PostgreSQL cannot use ``ON CONFLICT`` here: on the partitioned check-in table
+(``0006_partition_checkinrecord``) uniqueness is enforced by a trigger. So a
+batch that loses a race against a concurrent check-in of the same user is
+rolled back and its records are written one at a time, each in its own
+transaction; a record that still conflicts counts as already checked in.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import gettext as _
+
+from . import membership, sharding
+from .models import CheckInRecord
+
+CREATED = 'created'
+EXISTS = 'exists'
+ERROR = 'error'
+
+MAX_USER_ID = 2**63 - 1
+
+
+def max_entries() -> int:
+    return getattr(settings, 'CHECKIN_BATCH_MAX_ENTRIES', 1000)
+
+
+def _fresh_records(activity, alias, by_user: dict[int, CheckInRecord]) -> list[CheckInRecord]:
+    existing = set(
+        activity.checkin_records(until=timezone.now()).using(alias)
+        .filter(user_id__in=by_user).values_list('user_id', flat=True)
+    )
+    return [record for user_id, record in by_user.items() if user_id not in existing]
+
+
+def write_checkins(activity, records: list[CheckInRecord]) -> set[int]:
+    """Insert the records of users without a check-in yet; returns their user ids.
+    ``records`` must hold at most one record per user. A record the database
+    refuses (a concurrent check-in of the same user, or a user deleted in the
+    meantime) is left out instead of failing the others."""
+    alias = sharding.shard_for_activity(activity.pk)
+    by_user = {record.user_id: record for record in records}
+    try:
+        with transaction.atomic(using=alias):
+            fresh = _fresh_records(activity, alias, by_user)
+            CheckInRecord.objects.using(alias).bulk_create(fresh)
+        return {record.user_id for record in fresh}
+    except IntegrityError:
+        pass
+    created = set()
+    for record in _fresh_records(activity, alias, by_user):
+        try:
+            # Outside a caller's transaction this commits, so deferred foreign keys are checked here too.
+            with transaction.atomic(using=alias):
+                CheckInRecord.objects.using(alias).bulk_create([record])
+        except IntegrityError:
+            continue
+        created.add(record.user_id)
+    return created
+
+
+def entry_time(value, now):
+    """The ISO 8601 ``value`` as an aware datetime, ``now`` when it is empty, None when it is not a date."""
+    if value in (None, ''):
+        return now
+    try:
+        parsed = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:  # well formed but not a date, e.g. month 13
+        return None
+    if parsed is None:
+        return None
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def valid_user_id(value) -> bool:
+    """Whether ``value`` can be a user's primary key (a positive bigint)."""
+    return isinstance(value, int) and not isinstance(value, bool) and 0 < value <= MAX_USER_ID
+
+
+def _entry_key(entry) -> str | None:
+    """``'#<id>'`` for a ``user_id`` entry, the username for a ``username`` entry."""
+    if 'user_id' in entry:
+        user_id = entry['user_id']
+        return f'#{user_id}' if valid_user_id(user_id) else None
+    username = entry.get('username')
+    return str(username) if username else None
+
+
+def _resolve_users(entries) -> dict[str, int]:
+    """One query for every user the entries name, keyed like ``_entry_key()``."""
+    ids, usernames = set(), set()
+    for entry in entries:
+        key = _entry_key(entry)
+        if key is None:
+            continue
+        if 'user_id' in entry:
+            ids.add(entry['user_id'])
+        else:
+            usernames.add(key)
+    if not (ids or usernames):
+        return {}
+    found = {}
+    for pk, username in get_user_model().objects.filter(Q(pk__in=ids) | Q(username__in=usernames)).values_list('pk', 'username'):
+        found[f'#{pk}'] = pk
+        found[username] = pk
+    return found
+
+
+def check_in_entries(activity, entries: list, ip_address=None, user_agent='', now: datetime | None = None) -> list[dict]:
+    """Validate and store entries ``{"username" | "user_id", "time"?}``; returns one result per entry, in order.
+
+    An entry is accepted when the user is on the participant list and the
+    activity was open at ``time`` (default: now). Times more than
+    ``CHECKIN_BATCH_FUTURE_SECONDS`` ahead of the server clock, or before
+    ``Activity.checkin_time_floor()``, are rejected.
+    """
+    now = now or timezone.now()
+    future_limit = now + timedelta(seconds=getattr(settings, 'CHECKIN_BATCH_FUTURE_SECONDS', 60))
+    floor = activity.checkin_time_floor()
+    user_ids = _resolve_users(entry for entry in entries if isinstance(entry, dict))
+
+    results: list[dict] = []
+    pending: dict[int, CheckInRecord] = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            results.append({'result': ERROR, 'error': _('无效的条目')})
+            continue
+        result = {key: entry[key] for key in ('username', 'user_id') if key in entry}
+        results.append(result)
+        user_id = user_ids.get(_entry_key(entry))
+        when = entry_time(entry.get('time'), now)
+        if 'user_id' in entry and not valid_user_id(entry['user_id']):
+            error = _('无效的条目')
+        elif user_id is None:
+            error = _('用户不存在')
+        elif not membership.is_member(activity, user_id):
+            error = _('该用户不在活动参与名单中')
+        elif when is None or when > future_limit or (floor is not None and when < floor):
+            error = _('无效的签到时间')
+        elif not activity.is_open_for(when):
+            error = _('活动不在开放时间')
+        else:
+            error = None
+        if error:
+            result.update(result=ERROR, error=error)
+            continue
+        result['user_id'] = user_id
+        # The first entry for a user wins; later ones in the batch report EXISTS.
+        pending.setdefault(user_id, CheckInRecord(
+            activity=activity,
+            user_id=user_id,
+            checkin_time=when,
+            ip_address=ip_address,
+            user_agent=user_agent,
+            status=CheckInRecord.CheckInStatus.PRESENT,
+        ))
+
+    created = write_checkins(activity, list(pending.values())) if pending else set()
+    for result in results:
+        if 'result' not in result:
+            result['result'] = CREATED if result['user_id'] in created else EXISTS
+            created.discard(result['user_id'])
+    return results
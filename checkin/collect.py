@@ -0,0 +1,99 @@
+"""Reverse QR check-in: the presenter scans the attendees' personal codes.
+
+Each attendee shows a rotating code from ``qrtoken.issue_personal()``; the
+presenter's collect page decodes them continuously and posts them in small
+batches. ``check_in_codes()`` verifies every code from its HMAC alone and
+stores the new check-ins through ``checkin.batch``.
+
+The scanner sees the same phone many times while it is held up, so each
+worker remembers ``(activity, user)`` pairs it already answered for
+``CHECKIN_COLLECT_SEEN_SECONDS`` in a bounded LRU; those codes are answered
+``exists`` without a query. A miss (another worker, an evicted entry) costs a
+query, never a wrong answer: ``batch.write_checkins()`` still skips users who
+are checked in.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from . import batch, qrtoken
+
+# (activity_id, user_id) -> (expires at, display name)
+_seen: OrderedDict[tuple[int, int], tuple[float, str]] = OrderedDict()
+_lock = threading.Lock()
+
+
+def _seen_name(activity_id: int, user_id: int) -> str | None:
+    key = (activity_id, user_id)
+    with _lock:
+        entry = _seen.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _seen[key]
+            return None
+        _seen.move_to_end(key)
+        return entry[1]
+
+
+def _remember(activity_id: int, names: dict[int, str]) -> None:
+    expires = time.monotonic() + getattr(settings, 'CHECKIN_COLLECT_SEEN_SECONDS', 600)
+    limit = getattr(settings, 'CHECKIN_COLLECT_SEEN_SIZE', 10000)
+    with _lock:
+        for user_id, name in names.items():
+            _seen[(activity_id, user_id)] = (expires, name)
+            _seen.move_to_end((activity_id, user_id))
+        while len(_seen) > limit:
+            _seen.popitem(last=False)
+
+
+def clear() -> None:
+    with _lock:
+        _seen.clear()
+
+
+def check_in_codes(activity, codes: list, ip_address=None, user_agent='', now: datetime | None = None) -> list[dict]:
+    """Verify and store personal codes; returns one ``{"result", "user_id"?, "name"?, "error"?}`` per code, in order."""
+    now = now or timezone.now()
+    results: list[dict] = []
+    fresh: dict[int, list[dict]] = {}
+    for code in codes:
+        user_id = qrtoken.verify_personal(code, now)
+        if user_id is None:
+            results.append({'result': batch.ERROR, 'error': _('签到码已过期或无效')})
+            continue
+        result = {'user_id': user_id}
+        results.append(result)
+        name = _seen_name(activity.pk, user_id)
+        if name is None:
+            fresh.setdefault(user_id, []).append(result)
+        else:
+            result.update(result=batch.EXISTS, name=name)
+    if not fresh:
+        return results
+
+    names = {
+        pk: first_name or username
+        for pk, username, first_name in get_user_model().objects.filter(pk__in=fresh).values_list('pk', 'username', 'first_name')
+    }
+    stored = batch.check_in_entries(
+        activity, [{'user_id': user_id} for user_id in fresh], ip_address, user_agent, now=now
+    )
+    answered = {}
+    for user_id, outcome in zip(fresh, stored):
+        for index, result in enumerate(fresh[user_id]):
+            result['result'] = batch.EXISTS if index and outcome['result'] == batch.CREATED else outcome['result']
+            if 'error' in outcome:
+                result['error'] = outcome['error']
+            elif user_id in names:
+                result['name'] = names[user_id]
+        if outcome['result'] != batch.ERROR:
+            answered[user_id] = names.get(user_id, '')
+    _remember(activity.pk, answered)
+    return results
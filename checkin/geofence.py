@@ -0,0 +1,216 @@
+"""Where a location check-in may be made.
+
+An activity's fence is its classic circle (``location_lat``/``location_lng``/
+``location_radius_m``) plus any shapes in ``location_fences``. That field holds
+a JSON list of circles ``{"lat": .., "lng": .., "radius_m": ..}`` and polygons
+``{"polygon": [[lat, lng], ...]}``, and a point inside any shape is inside the
+fence.
+
+``fence_for(activity)`` compiles the shapes once per distinct definition:
+
+- a bounding box in degrees, so most far-away points are rejected with four
+  comparisons;
+- an equirectangular projection around the fence's centre, so the remaining
+  tests are plain arithmetic in metres (squared distance for circles, ray
+  casting for polygons) instead of haversine. Over a campus the error is far
+  below GPS accuracy.
+
+``contains_many()`` tests many points at once, vectorized with NumPy when it is
+installed. ``outside_checkins()`` uses it to re-check an activity's recorded
+check-ins after its fence was edited. ``manage.py bench_geofence`` times both
+paths.
+"""
+import json
+import math
+from dataclasses import dataclass
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:  # optional
+    np = None
+
+EARTH_RADIUS_M = 6371000.0
+METRES_PER_DEGREE = EARTH_RADIUS_M * math.pi / 180
+MAX_SHAPES = 32
+MAX_VERTICES = 500
+
+
+@dataclass(frozen=True, slots=True)
+class Fence:
+    # Bounding box in degrees
+    min_lat: float
+    max_lat: float
+    min_lng: float
+    max_lng: float
+    # Projection origin and metres per degree of longitude there
+    lat0: float
+    lng0: float
+    kx: float
+    # (x, y, radius²) in projected metres
+    circles: tuple[tuple[float, float, float], ...]
+    # (xs, ys, (min_x, max_x, min_y, max_y)) in projected metres
+    polygons: tuple[tuple[tuple[float, ...], tuple[float, ...], tuple[float, float, float, float]], ...]
+
+    def project(self, lat: float, lng: float) -> tuple[float, float]:
+        return (lng - self.lng0) * self.kx, (lat - self.lat0) * METRES_PER_DEGREE
+
+    def contains(self, lat: float, lng: float) -> bool:
+        if not (self.min_lat <= lat <= self.max_lat and self.min_lng <= lng <= self.max_lng):
+            return False
+        x, y = self.project(lat, lng)
+        for cx, cy, r2 in self.circles:
+            if (x - cx) ** 2 + (y - cy) ** 2 <= r2:
+                return True
+        for xs, ys, (min_x, max_x, min_y, max_y) in self.polygons:
+            if min_x <= x <= max_x and min_y <= y <= max_y and _in_polygon(x, y, xs, ys):
+                return True
+        return False
+
+
+def _in_polygon(x: float, y: float, xs, ys) -> bool:
+    """Even-odd ray casting."""
+    inside = False
+    j = len(xs) - 1
+    for i in range(len(xs)):
+        if (ys[i] > y) != (ys[j] > y) and x < (xs[j] - xs[i]) * (y - ys[i]) / (ys[j] - ys[i]) + xs[i]:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _number(value, name: str) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f'{name} must be a number')
+    return float(value)
+
+
+def _point(lat, lng) -> tuple[float, float]:
+    lat, lng = _number(lat, 'lat'), _number(lng, 'lng')
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError(f'({lat}, {lng}) is not a valid coordinate')
+    return lat, lng
+
+
+def parse_shapes(data) -> list[dict]:
+    """Validate and normalize a ``location_fences`` value; raises ValueError."""
+    if data in (None, ''):
+        return []
+    if not isinstance(data, list):
+        raise ValueError('expected a list of shapes')
+    if len(data) > MAX_SHAPES:
+        raise ValueError(f'at most {MAX_SHAPES} shapes')
+    shapes = []
+    for shape in data:
+        if isinstance(shape, dict) and 'polygon' in shape:
+            points = shape['polygon']
+            if not isinstance(points, list) or not 3 <= len(points) <= MAX_VERTICES:
+                raise ValueError(f'a polygon needs 3 to {MAX_VERTICES} points')
+            if not all(isinstance(p, (list, tuple)) and len(p) == 2 for p in points):
+                raise ValueError('polygon points are [lat, lng] pairs')
+            shapes.append({'polygon': [list(_point(*p)) for p in points]})
+        elif isinstance(shape, dict) and {'lat', 'lng', 'radius_m'} <= shape.keys():
+            lat, lng = _point(shape['lat'], shape['lng'])
+            radius = _number(shape['radius_m'], 'radius_m')
+            if radius <= 0:
+                raise ValueError('radius_m must be positive')
+            shapes.append({'lat': lat, 'lng': lng, 'radius_m': radius})
+        else:
+            raise ValueError('each shape is {"lat", "lng", "radius_m"} or {"polygon": [[lat, lng], ...]}')
+    return shapes
+
+
+def _shapes_of(activity) -> list[dict]:
+    shapes = []
+    if activity.location_lat and activity.location_lng and activity.location_radius_m:
+        shapes.append({'lat': activity.location_lat, 'lng': activity.location_lng, 'radius_m': activity.location_radius_m})
+    return shapes + list(activity.location_fences or [])
+
+
+def compile_shapes(shapes: list[dict]) -> Fence | None:
+    """The fence of already validated shapes (None when there are none)."""
+    if not shapes:
+        return None
+    boxes = []
+    for shape in shapes:
+        if 'polygon' in shape:
+            lats = [p[0] for p in shape['polygon']]
+            lngs = [p[1] for p in shape['polygon']]
+            boxes.append((min(lats), max(lats), min(lngs), max(lngs)))
+        else:
+            dlat = shape['radius_m'] / METRES_PER_DEGREE
+            dlng = dlat / max(math.cos(math.radians(shape['lat'])), 1e-6)
+            boxes.append((shape['lat'] - dlat, shape['lat'] + dlat, shape['lng'] - dlng, shape['lng'] + dlng))
+    min_lat, max_lat = min(b[0] for b in boxes), max(b[1] for b in boxes)
+    min_lng, max_lng = min(b[2] for b in boxes), max(b[3] for b in boxes)
+    lat0, lng0 = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+    kx = METRES_PER_DEGREE * math.cos(math.radians(lat0))
+
+    def project(lat, lng):
+        return (lng - lng0) * kx, (lat - lat0) * METRES_PER_DEGREE
+
+    circles, polygons = [], []
+    for shape in shapes:
+        if 'polygon' in shape:
+            xs, ys = zip(*(project(lat, lng) for lat, lng in shape['polygon']))
+            polygons.append((xs, ys, (min(xs), max(xs), min(ys), max(ys))))
+        else:
+            x, y = project(shape['lat'], shape['lng'])
+            circles.append((x, y, float(shape['radius_m']) ** 2))
+    return Fence(min_lat, max_lat, min_lng, max_lng, lat0, lng0, kx, tuple(circles), tuple(polygons))
+
+
+@lru_cache(maxsize=256)
+def _compiled(definition: str) -> Fence | None:
+    return compile_shapes(json.loads(definition))
+
+
+def fence_for(activity) -> Fence | None:
+    """The activity's compiled fence, or None if it defines no area."""
+    return _compiled(json.dumps(_shapes_of(activity)))
+
+
+def contains_many(fence: Fence, lats, lngs):
+    """``fence.contains`` for every point: a NumPy bool array, or a list without NumPy."""
+    if np is None:
+        return [fence.contains(lat, lng) for lat, lng in zip(lats, lngs)]
+    lat = np.asarray(lats, dtype=float)
+    lng = np.asarray(lngs, dtype=float)
+    inside = np.zeros(lat.shape, dtype=bool)
+    candidates = np.flatnonzero(
+        (lat >= fence.min_lat) & (lat <= fence.max_lat) & (lng >= fence.min_lng) & (lng <= fence.max_lng)
+    )
+    if not candidates.size:
+        return inside
+    x = (lng[candidates] - fence.lng0) * fence.kx
+    y = (lat[candidates] - fence.lat0) * METRES_PER_DEGREE
+    hit = np.zeros(candidates.shape, dtype=bool)
+    for cx, cy, r2 in fence.circles:
+        hit |= (x - cx) ** 2 + (y - cy) ** 2 <= r2
+    for xs, ys, _box in fence.polygons:
+        crossings = np.zeros(candidates.shape, dtype=bool)
+        j = len(xs) - 1
+        for i in range(len(xs)):
+            if ys[i] != ys[j]:
+                straddles = (ys[i] > y) != (ys[j] > y)
+                crossings ^= straddles & (x < (xs[j] - xs[i]) * (y - ys[i]) / (ys[j] - ys[i]) + xs[i])
+            j = i
+        hit |= crossings
+    inside[candidates] = hit
+    return inside
+
+
+def outside_checkins(activity) -> list[int]:
+    """Ids of the activity's check-ins with a recorded position outside its current fence."""
+    fence = fence_for(activity) if activity.location_enabled else None
+    if fence is None:
+        return []
+    rows = list(
+        activity.checkin_records()
+        .filter(latitude__isnull=False, longitude__isnull=False)
+        .values_list('id', 'latitude', 'longitude')
+    )
+    if not rows:
+        return []
+    ids, lats, lngs = zip(*rows)
+    return [pk for pk, inside in zip(ids, contains_many(fence, lats, lngs)) if not inside]
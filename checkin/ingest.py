@@ -0,0 +1,292 @@
+"""Write-behind ingestion of check-ins (``CHECKIN_WRITE_BEHIND``).
+
+During a flash crowd every check-in would otherwise be its own INSERT and
+commit. With write-behind, the view validates as usual, then ``submit()``:
+
+1. claims ``(activity, user)`` in the dedupe set, a ``cache.add`` on the
+   default cache, shared between workers when that is Redis;
+2. appends the record to this process's journal segment in
+   ``CHECKIN_JOURNAL_DIR`` (one JSON line, fsynced when
+   ``CHECKIN_JOURNAL_FSYNC``) and acknowledges.
+
+A flusher thread rotates the segment every ``CHECKIN_FLUSH_INTERVAL_MS`` and
+writes its records with one ``bulk_create`` per shard in a single transaction.
+It skips pairs that are already in the database and deletes the segment only
+after the commit. Segments left behind by a crashed process (the owner PID is
+gone) are replayed by the next buffer that starts, or by
+``manage.py replay_checkin_journal``. A replay is idempotent because of that
+skip.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from . import sharding
+from .models import Activity, CheckInRecord
+
+logger = logging.getLogger('neosign.ingest')
+
+SEGMENT_SUFFIX = '.jsonl'
+FIELDS = ('activity_id', 'user_id', 'ip_address', 'user_agent', 'latitude', 'longitude', 'status')
+
+
+def enabled() -> bool:
+    return getattr(settings, 'CHECKIN_WRITE_BEHIND', False)
+
+
+def dedupe_key(activity_id: int, user_id: int) -> str:
+    return f'checkin:pending:{activity_id}:{user_id}'
+
+
+def to_line(record: CheckInRecord) -> str:
+    data = {name: getattr(record, name) for name in FIELDS}
+    data['checkin_time'] = record.checkin_time.isoformat()
+    return json.dumps(data, ensure_ascii=False) + '\n'
+
+
+def from_line(line: str) -> CheckInRecord:
+    data = json.loads(line)
+    data['checkin_time'] = datetime.fromisoformat(data['checkin_time'])
+    return CheckInRecord(**data)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        # A killed worker stays a zombie until it is reaped (containers without an init).
+        with open(f'/proc/{pid}/stat', encoding='ascii', errors='replace') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
+
+
+def _drop_orphans(records: list[CheckInRecord]) -> list[CheckInRecord]:
+    """Records whose user and activity still exist. The primary enforces the foreign keys
+    (migration 0010), so one check-in deleted along with its user between journaling and
+    flushing must not fail the whole segment on every retry."""
+    users = set(get_user_model().objects.filter(pk__in={r.user_id for r in records}).values_list('pk', flat=True))
+    activities = set(Activity.objects.filter(pk__in={r.activity_id for r in records}).values_list('pk', flat=True))
+    kept = [r for r in records if r.user_id in users and r.activity_id in activities]
+    if len(kept) < len(records):
+        logger.warning('Dropped %d journaled check-ins of deleted users or activities', len(records) - len(kept))
+    return kept
+
+
+def write_records(records: list[CheckInRecord]) -> int:
+    """Insert the records that are not in the database yet; one transaction per shard.
+    Returns the number of rows inserted."""
+    by_alias = defaultdict(dict)
+    for record in records:
+        # Last one wins for duplicates within the batch (they are identical check-ins).
+        by_alias[sharding.shard_for_activity(record.activity_id)][(record.activity_id, record.user_id)] = record
+    inserted = 0
+    for alias, pairs in by_alias.items():
+        with transaction.atomic(using=alias):
+            existing = set(
+                CheckInRecord.objects.using(alias).filter(
+                    activity_id__in={a for a, _ in pairs}, user_id__in={u for _, u in pairs}
+                ).values_list('activity_id', 'user_id')
+            )
+            fresh = [record for pair, record in pairs.items() if pair not in existing]
+            if alias == DEFAULT_DB_ALIAS and fresh:
+                fresh = _drop_orphans(fresh)
+            CheckInRecord.objects.using(alias).bulk_create(fresh)
+            inserted += len(fresh)
+    return inserted
+
+
+@dataclass
+class _Segment:
+    path: Path
+    records: list
+
+
+class WriteBehindBuffer:
+    def __init__(self, directory: Path, interval: float = 0.2, fsync: bool = True, dedupe_ttl: int = 3600):
+        self.directory = Path(directory)
+        self.interval = interval
+        self.fsync = fsync
+        self.dedupe_ttl = dedupe_ttl
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._sequence = 0
+        self._file = None
+        self._current: _Segment | None = None
+        # Rotated segments waiting for (or retrying) their database write.
+        self._sealed: list[_Segment] = []
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    # -- writing --------------------------------------------------------------
+
+    def _open_segment(self) -> None:
+        self._sequence += 1
+        path = self.directory / f'{self.pid}-{self._sequence:08d}{SEGMENT_SUFFIX}'
+        self._file = path.open('a', encoding='utf-8')
+        self._current = _Segment(path, [])
+
+    def submit(self, record: CheckInRecord) -> bool:
+        """Journal the check-in; False if the same (activity, user) is already pending."""
+        if not cache.add(dedupe_key(record.activity_id, record.user_id), 1, self.dedupe_ttl):
+            return False
+        line = to_line(record)
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._current.records.append(record)
+        return True
+
+    def _rotate(self) -> None:
+        with self._lock:
+            if self._current is None or not self._current.records:
+                return
+            self._file.close()
+            self._sealed.append(self._current)
+            self._file = None
+            self._current = None
+
+    # -- flushing -------------------------------------------------------------
+
+    def flush(self) -> int:
+        """Write every journaled record to the database; returns the rows inserted."""
+        with self._flush_lock:
+            self._rotate()
+            inserted = 0
+            while self._sealed:
+                segment = self._sealed[0]
+                inserted += write_records(segment.records)
+                segment.path.unlink(missing_ok=True)
+                self._sealed.pop(0)
+                # The database answers "already checked in" from now on; releasing the
+                # claims lets a check-in deleted by an admin be made again.
+                cache.delete_many([dedupe_key(r.activity_id, r.user_id) for r in segment.records])
+            return inserted
+
+    def pending(self) -> int:
+        with self._lock:
+            current = len(self._current.records) if self._current else 0
+            return current + sum(len(segment.records) for segment in self._sealed)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                # Keep the segment and retry on the next tick; the journal still has it.
+                logger.exception('Check-in flush failed; %d records pending', self.pending())
+            finally:
+                from django.db import connections
+
+                for connection in connections.all(initialized_only=True):
+                    connection.close_if_unusable_or_obsolete()
+
+    def start(self) -> None:
+        replay_orphans(self.directory)
+        self._thread = threading.Thread(target=self._run, name='checkin-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Final check-in flush failed; the journal in %s will be replayed', self.directory)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._current is not None and not self._current.records:
+                self._current.path.unlink(missing_ok=True)
+                self._current = None
+
+
+def replay_orphans(directory: Path, include_live: bool = False) -> int:
+    """Insert the records of journal segments whose process is gone; returns rows inserted.
+    Segments named after the calling process are orphans too: a new process only
+    calls this before writing, so they come from a crashed process with the same PID.
+    Each segment is claimed by renaming it, so concurrent replays do not overlap."""
+    directory = Path(directory)
+    if not directory.is_dir():
+        return 0
+    # Release the claims of replays that crashed themselves.
+    for claimed in directory.glob(f'*{SEGMENT_SUFFIX}.replay-*'):
+        pid = claimed.name.rsplit('-', 1)[1]
+        if pid.isdigit() and not _pid_alive(int(pid)):
+            claimed.rename(claimed.with_name(claimed.name.split('.replay-')[0]))
+
+    inserted = 0
+    for path in sorted(directory.glob(f'*{SEGMENT_SUFFIX}')):
+        owner = path.name.split('-', 1)[0]
+        if not include_live and owner.isdigit() and int(owner) != os.getpid() and _pid_alive(int(owner)):
+            continue
+        claimed = path.with_name(f'{path.name}.replay-{os.getpid()}')
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue  # another process claimed it
+        records = []
+        for line in claimed.read_text(encoding='utf-8').splitlines():
+            try:
+                records.append(from_line(line))
+            except (ValueError, TypeError):
+                # A torn last line (crash mid-write) was never acknowledged.
+                logger.warning('Skipping unreadable journal line in %s', path.name)
+        count = write_records(records)
+        claimed.unlink()
+        logger.info('Replayed %s: %d records, %d inserted', path.name, len(records), count)
+        inserted += count
+    return inserted
+
+
+_buffer: WriteBehindBuffer | None = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer() -> WriteBehindBuffer:
+    """The process's buffer, started on first use (after a fork, workers start their own)."""
+    global _buffer
+    if _buffer is None or _buffer.pid != os.getpid():
+        with _buffer_lock:
+            if _buffer is None or _buffer.pid != os.getpid():
+                _buffer = WriteBehindBuffer(
+                    journal_dir(),
+                    interval=getattr(settings, 'CHECKIN_FLUSH_INTERVAL_MS', 200) / 1000,
+                    fsync=getattr(settings, 'CHECKIN_JOURNAL_FSYNC', True),
+                )
+                _buffer.start()
+    return _buffer
+
+
+def shutdown() -> None:
+    """Flush and stop this process's buffer, if it started one (gunicorn ``worker_exit``)."""
+    if _buffer is not None and _buffer.pid == os.getpid():
+        _buffer.stop()
+
+
+def journal_dir() -> Path:
+    return Path(getattr(settings, 'CHECKIN_JOURNAL_DIR', Path(settings.BASE_DIR) / 'var' / 'checkin-journal'))
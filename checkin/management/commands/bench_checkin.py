@@ -0,0 +1,185 @@
+import asyncio
+import statistics
+import time
+from collections import Counter
+from datetime import timedelta
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from checkin import sharding
+from checkin.models import Activity
+from core.models import SystemConfig
+
+# Usernames are 4-23 digits; fifteen nines keep benchmark users apart from real ones.
+USER_PREFIX = '9' * 15
+ACTIVITY_NAME = 'bench-checkin'
+
+
+class Command(BaseCommand):
+    help = (
+        'Check-in throughput benchmark against a running server (gunicorn, uvicorn, ...). '
+        'Creates a benchmark activity with --users participants, logs them in through the '
+        'session store and has --concurrency keep-alive clients each POST one check-in per user.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the server under test.')
+        parser.add_argument('--users', type=int, default=1000, help='Check-ins per run (one per user).')
+        parser.add_argument('--concurrency', type=int, default=100, help='Concurrent connections.')
+        parser.add_argument('--cleanup', action='store_true', help='Delete the benchmark users and activity, then exit.')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        if options['cleanup']:
+            Activity.objects.filter(name=ACTIVITY_NAME).delete()
+            deleted, _ = User.objects.filter(username__startswith=USER_PREFIX).delete()
+            self.stdout.write(f'Deleted {deleted} rows.')
+            return
+        if not SystemConfig.objects.filter(installed=True).exists():
+            raise CommandError('The site is not installed; run the installer first.')
+
+        activity, users = self._prepare(options['users'])
+        jobs = self._sessions(users)
+        split = urlsplit(options['url'])
+        if split.scheme != 'http':
+            raise CommandError('Only plain http:// URLs are supported.')
+        path = reverse('checkin:checkin_api', args=[activity.id])
+        self.stdout.write(f'{len(jobs)} check-ins, {options["concurrency"]} connections -> {options["url"]}{path}')
+
+        results, elapsed = asyncio.run(
+            run(split.hostname, split.port or 80, path, jobs, options['concurrency'])
+        )
+        self._report(results, elapsed)
+
+    def _prepare(self, count):
+        User = get_user_model()
+        now = timezone.now()
+        admin = User.objects.filter(is_superuser=True).first() or User.objects.filter(is_admin=True).first()
+        if admin is None:
+            raise CommandError('No admin user to own the benchmark activity.')
+        activity, _ = Activity.objects.update_or_create(
+            name=ACTIVITY_NAME,
+            defaults={
+                'start_time': now - timedelta(hours=1),
+                'end_time': now + timedelta(days=1),
+                'is_active': True,
+                'qr_enabled': False,
+                'location_enabled': False,
+                'created_by': admin,
+            },
+        )
+        usernames = [f'{USER_PREFIX}{i:08d}' for i in range(count)]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        User.objects.bulk_create(
+            User(username=name, first_name=f'Bench {name[-8:]}', first_login=False, password='!') for name in usernames
+            if name not in existing
+        )
+        users = list(User.objects.filter(username__in=usernames).order_by('username'))
+        sharding.add_participants(activity, [user.pk for user in users])
+        # Every run starts from "nobody checked in", so each POST takes the full write path.
+        activity.checkin_records().delete()
+        return activity, users
+
+    def _sessions(self, users):
+        jobs = []
+        backend = settings.AUTHENTICATION_BACKENDS[0]
+        SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
+        for user in users:
+            session = SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = backend
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.create()
+            jobs.append(session.session_key)
+        return jobs
+
+    def _report(self, results, elapsed):
+        latencies = sorted(latency for _, _, latency in results)
+        statuses = Counter(status for status, _, _ in results)
+        ok = sum(1 for status, success, _ in results if status == 200 and success)
+        if not latencies:
+            raise CommandError('No requests completed.')
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        self.stdout.write(f'Completed:   {len(results)} in {elapsed:.2f} s ({len(results) / elapsed:.0f} req/s)')
+        self.stdout.write(f'Checked in:  {ok}')
+        self.stdout.write(f'Status:      {dict(statuses)}')
+        self.stdout.write(
+            'Latency ms:  p50 {:.1f}  p95 {:.1f}  p99 {:.1f}  max {:.1f}'.format(
+                quantiles[49] * 1000, quantiles[94] * 1000, quantiles[98] * 1000, latencies[-1] * 1000
+            )
+        )
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = b''
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            chunk = await reader.readexactly(size + 2)
+            if size == 0:
+                break
+            body += chunk[:-2]
+    else:
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers, body
+
+
+async def run(host, port, path, session_keys, concurrency):
+    """POST one check-in per session over ``concurrency`` keep-alive connections.
+    Returns ([(status, success, latency)], elapsed seconds)."""
+    queue = asyncio.Queue()
+    for key in session_keys:
+        queue.put_nowait(key)
+    results = []
+    csrf = get_random_string(32)
+
+    async def client():
+        reader = writer = None
+        while not queue.empty():
+            key = queue.get_nowait()
+            request = (
+                f'POST {path} HTTP/1.1\r\nHost: {host}:{port}\r\n'
+                f'Cookie: {settings.SESSION_COOKIE_NAME}={key}; {settings.CSRF_COOKIE_NAME}={csrf}\r\n'
+                f'X-CSRFToken: {csrf}\r\nContent-Type: application/x-www-form-urlencoded\r\n'
+                'User-Agent: bench_checkin\r\nContent-Length: 0\r\n\r\n'
+            ).encode()
+            start = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                writer.write(request)
+                status, headers, body = await _read_response(reader)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+                results.append((0, False, time.perf_counter() - start))
+                if writer is not None:
+                    writer.close()
+                reader = writer = None
+                continue
+            results.append((status, b'"success": true' in body, time.perf_counter() - start))
+            if headers.get('connection', '').lower() == 'close':
+                writer.close()
+                reader = writer = None
+        if writer is not None:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return results, time.perf_counter() - start
@@ -0,0 +1,73 @@
+import math
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from checkin import geofence
+
+# A campus: the classic circle, a second building and a long hall as a polygon.
+SHAPES = [
+    {'lat': 31.2300, 'lng': 121.4700, 'radius_m': 150},
+    {'lat': 31.2335, 'lng': 121.4752, 'radius_m': 60},
+    {'polygon': [[31.2310, 121.4720], [31.2314, 121.4760], [31.2309, 121.4761], [31.2305, 121.4721]]},
+]
+
+
+def haversine_within(lat, lng, center_lat=31.23, center_lng=121.47, radius=150.0):
+    """The single-circle check the check-in view used before checkin.geofence."""
+    from math import asin, cos, radians, sin, sqrt
+
+    dlat = radians(lat - center_lat)
+    dlng = radians(lng - center_lng)
+    a = sin(dlat / 2) ** 2 + cos(radians(center_lat)) * cos(radians(lat)) * sin(dlng / 2) ** 2
+    return 6371000.0 * 2 * asin(sqrt(a)) <= radius
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmarks for checkin.geofence: single point tests and bulk re-validation.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=100_000, help='Points for the bulk test.')
+        parser.add_argument('--repeat', type=int, default=5, help='Best of this many runs.')
+
+    def handle(self, *args, **options):
+        fence = geofence.compile_shapes(geofence.parse_shapes(SHAPES))
+        repeat = options['repeat']
+
+        def per_call(stmt, number=200_000):
+            best = min(timeit.repeat(stmt, number=number, repeat=repeat))
+            return best / number * 1e9
+
+        self.stdout.write('Single point (ns per call, best of %d):' % repeat)
+        rows = [
+            ('haversine, one circle', lambda: haversine_within(31.2301, 121.4702)),
+            ('fence, inside first circle', lambda: fence.contains(31.2301, 121.4702)),
+            ('fence, inside polygon', lambda: fence.contains(31.2310, 121.4740)),
+            ('fence, inside box but outside', lambda: fence.contains(31.2330, 121.4690)),
+            ('fence, rejected by box', lambda: fence.contains(39.9, 116.4)),
+        ]
+        for label, stmt in rows:
+            self.stdout.write(f'  {label:<32} {per_call(stmt):8.0f}')
+
+        count = options['points']
+        rng = random.Random(0)
+        # Half near the venue, half spread over the city.
+        lats = [31.232 + rng.gauss(0, 0.002 if i % 2 else 0.05) for i in range(count)]
+        lngs = [121.473 + rng.gauss(0, 0.002 if i % 2 else 0.05) for i in range(count)]
+
+        def bulk_python():
+            return [fence.contains(lat, lng) for lat, lng in zip(lats, lngs)]
+
+        python_s = min(timeit.repeat(bulk_python, number=1, repeat=repeat))
+        self.stdout.write(f'Bulk, {count} points:')
+        self.stdout.write(f'  {"python loop":<32} {python_s * 1000:8.1f} ms')
+        if geofence.np is None:
+            self.stdout.write('  numpy is not installed; contains_many() uses the python loop.')
+            return
+        numpy_s = min(timeit.repeat(lambda: geofence.contains_many(fence, lats, lngs), number=1, repeat=repeat))
+        inside = geofence.contains_many(fence, lats, lngs)
+        if list(inside) != bulk_python():
+            self.stderr.write('numpy and python results differ')
+        self.stdout.write(f'  {"numpy":<32} {numpy_s * 1000:8.1f} ms ({python_s / numpy_s:.0f}x)')
+        self.stdout.write(f'  {int(sum(inside))} inside ({math.fsum(inside) / count:.1%})')
@@ -0,0 +1,94 @@
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from checkin import partitions, sharding
+
+
+class Command(BaseCommand):
+    help = (
+        'Maintain the monthly partitions of the check-in table (PostgreSQL): create upcoming '
+        'partitions and archive old ones to compressed CSV files. Run it daily from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--list', action='store_true', help='List partitions and row counts, then exit.')
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=getattr(settings, 'CHECKIN_PARTITION_MONTHS_AHEAD', 3),
+            help='Create partitions up to this many months after the current one.',
+        )
+        parser.add_argument(
+            '--retain-months',
+            type=int,
+            help='Archive partitions that ended more than this many months before the current month.',
+        )
+        parser.add_argument('--archive-dir', help='Directory for archived partitions (default: CHECKIN_ARCHIVE_DIR).')
+        parser.add_argument(
+            '--keep-detached',
+            action='store_true',
+            help='Keep archived partitions as detached tables instead of dropping them.',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be done.')
+        parser.add_argument('--database', help='Only process this database alias.')
+
+    def handle(self, *args, **options):
+        if options['database']:
+            aliases = [options['database']]
+        else:
+            aliases = list(dict.fromkeys([DEFAULT_DB_ALIAS, *sharding.shard_aliases()]))
+
+        for alias in aliases:
+            connection = connections[alias]
+            if not partitions.is_partitioned(connection):
+                self.stdout.write(f'{alias}: check-in table is not partitioned, skipping.')
+                continue
+            if options['list']:
+                self._list(alias, connection)
+                continue
+            self._ensure(alias, connection, options)
+            if options['retain_months'] is not None:
+                self._archive(alias, connection, options)
+
+    def _list(self, alias, connection):
+        with connection.cursor() as cursor:
+            for partition in partitions.list_partitions(connection):
+                cursor.execute(f'SELECT count(*) FROM {connection.ops.quote_name(partition.name)}')
+                span = 'DEFAULT' if partition.is_default else f'{partition.start:%Y-%m-%d} .. {partition.end:%Y-%m-%d}'
+                self.stdout.write(f'{alias}: {partition.name} [{span}] rows={cursor.fetchone()[0]}')
+
+    def _ensure(self, alias, connection, options):
+        if options['dry_run']:
+            existing = {p.name for p in partitions.list_partitions(connection)}
+            current = partitions.month_start(datetime.now(dt_timezone.utc).date())
+            for offset in range(options['months_ahead'] + 1):
+                name = partitions.partition_name(partitions.add_months(current, offset))
+                if name not in existing:
+                    self.stdout.write(f'{alias}: would create {name}')
+            return
+        with transaction.atomic(using=alias):
+            created = partitions.ensure_partitions(connection, options['months_ahead'])
+        for name in created:
+            self.stdout.write(self.style.SUCCESS(f'{alias}: created {name}'))
+
+    def _archive(self, alias, connection, options):
+        if options['retain_months'] < 1:
+            raise CommandError('--retain-months must be at least 1.')
+        archive_dir = Path(options['archive_dir'] or settings.CHECKIN_ARCHIVE_DIR) / alias
+        current = partitions.month_start(datetime.now(dt_timezone.utc).date())
+        cutoff = partitions.month_start_utc(partitions.add_months(current, -options['retain_months']))
+        for partition in partitions.list_partitions(connection):
+            if partition.is_default or partition.end > cutoff:
+                continue
+            if options['dry_run']:
+                self.stdout.write(f'{alias}: would archive {partition.name}')
+                continue
+            with transaction.atomic(using=alias):
+                path = partitions.archive_partition(
+                    connection, partition, archive_dir, drop=not options['keep_detached']
+                )
+            self.stdout.write(self.style.SUCCESS(f'{alias}: archived {partition.name} to {path}'))
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from checkin import sharding
+
+
+class Command(BaseCommand):
+    help = 'Move check-in records and participation rows to the shard their activity hashes to.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be moved.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows copied per transaction.')
+        parser.add_argument('--status', action='store_true', help='Print row counts per database and exit.')
+
+    def handle(self, *args, **options):
+        sources = list(dict.fromkeys([DEFAULT_DB_ALIAS, *sharding.shard_aliases()]))
+
+        if options['status']:
+            for alias in sources:
+                counts = ', '.join(
+                    f'{model.__name__}={model.objects.using(alias).count()}' for model in sharding.SHARDED_MODELS
+                )
+                self.stdout.write(f'{alias}: {counts}')
+            return
+
+        moved = 0
+        for source in sources:
+            for model in sharding.SHARDED_MODELS:
+                activity_ids = (
+                    model.objects.using(source).order_by().values_list('activity_id', flat=True).distinct()
+                )
+                for activity_id in list(activity_ids):
+                    target = sharding.shard_for_activity(activity_id)
+                    if target == source:
+                        continue
+                    count = model.objects.using(source).filter(activity_id=activity_id).count()
+                    self.stdout.write(
+                        f'{model.__name__} activity={activity_id}: {count} rows {source} -> {target}'
+                    )
+                    if not options['dry_run']:
+                        self._move(model, activity_id, source, target, options['batch_size'])
+                    moved += count
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {moved} rows.'))
+
+    def _move(self, model, activity_id, source, target, batch_size):
+        fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+        while True:
+            # The target commits before the source, so an interrupted run leaves
+            # duplicates (skipped on the next run) rather than lost rows. Existing
+            # pairs are filtered out up front: on PostgreSQL the check-in table is
+            # partitioned and its uniqueness is enforced by a trigger, which
+            # ignore_conflicts cannot swallow.
+            with transaction.atomic(using=source), transaction.atomic(using=target):
+                rows = list(
+                    model.objects.using(source).filter(activity_id=activity_id).order_by('pk')[:batch_size]
+                )
+                if not rows:
+                    return
+                present = set(
+                    model.objects.using(target)
+                    .filter(activity_id=activity_id, user_id__in=[row.user_id for row in rows])
+                    .values_list('user_id', flat=True)
+                )
+                copies = [
+                    model(**{f.attname: getattr(row, f.attname) for f in fields})
+                    for row in rows
+                    if row.user_id not in present
+                ]
+                model.objects.using(target).bulk_create(copies)
+                model.objects.using(source).filter(pk__in=[row.pk for row in rows]).delete()
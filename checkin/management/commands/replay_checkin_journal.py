@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from checkin import ingest
+
+
+class Command(BaseCommand):
+    help = (
+        'Insert the check-ins of write-behind journal segments left by crashed processes '
+        '(CHECKIN_WRITE_BEHIND). Workers do this when they start; run it when no worker will.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--journal-dir', help='Journal directory (default: CHECKIN_JOURNAL_DIR).')
+        parser.add_argument(
+            '--include-live',
+            action='store_true',
+            help='Also replay segments whose process still appears to run (only when the server is stopped, '
+            'or the PID was reused by an unrelated process).',
+        )
+
+    def handle(self, *args, **options):
+        directory = options['journal_dir'] or ingest.journal_dir()
+        inserted = ingest.replay_orphans(directory, include_live=options['include_live'])
+        self.stdout.write(f'Inserted {inserted} check-ins from {directory}.')
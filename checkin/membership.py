@@ -0,0 +1,111 @@
+"""Per-process cache of who may check in to an activity.
+
+Each activity's allowed participants are kept as a sorted ``array('q')`` of
+user ids (8 bytes per participant), so a check-in answers "may this user take
+part?" with a binary search instead of a query. An entry belongs to the
+``updated_at`` of the activity it was loaded for. The check-in views load the
+activity anyway, so every worker notices a change without a cache round trip.
+
+Changes to the participant list must therefore bump ``updated_at``, which
+``touch()`` does. It runs from the ``ActivityParticipation`` ``post_save``
+signal, from ``sharding.add_participants`` (a bulk insert, so no signals) and
+from the places that delete participations.
+"""
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.singleflight import SingleFlight
+
+from .models import Activity
+
+_members: OrderedDict[int, tuple[object, array]] = OrderedDict()
+_lock = threading.Lock()
+_flight = SingleFlight()
+
+
+def _max_entries() -> int:
+    return getattr(settings, 'CHECKIN_MEMBERSHIP_CACHE_ACTIVITIES', 256)
+
+
+def _query(activity):
+    return (
+        activity.activityparticipation_set.filter(can_participate=True)
+        .order_by('user_id')
+        .values_list('user_id', flat=True)
+    )
+
+
+def _lookup(activity) -> array | None:
+    with _lock:
+        entry = _members.get(activity.pk)
+        if entry is None or entry[0] != activity.updated_at:
+            return None
+        _members.move_to_end(activity.pk)
+        return entry[1]
+
+
+def _store(activity, ids) -> array:
+    members = array('q', ids)
+    with _lock:
+        _members[activity.pk] = (activity.updated_at, members)
+        _members.move_to_end(activity.pk)
+        while len(_members) > _max_entries():
+            _members.popitem(last=False)
+    return members
+
+
+def _contains(members: array, user_id: int) -> bool:
+    index = bisect_left(members, user_id)
+    return index < len(members) and members[index] == user_id
+
+
+def load(activity) -> array:
+    """The activity's members, loaded by one query however many threads miss at once."""
+    members = _lookup(activity)
+    if members is None:
+        members = _flight.do(
+            (activity.pk, activity.updated_at),
+            lambda: _lookup(activity) or _store(activity, _query(activity)),
+        )
+    return members
+
+
+def is_member(activity, user_id: int) -> bool:
+    """Whether the user is on the activity's participant list with ``can_participate``."""
+    return _contains(load(activity), user_id)
+
+
+async def ais_member(activity, user_id: int) -> bool:
+    members = _lookup(activity)
+    if members is None:
+        members = await sync_to_async(load)(activity)
+    return _contains(members, user_id)
+
+
+def touch(activity_id: int) -> None:
+    """Mark the activity's participant list as changed in every process."""
+    Activity.objects.filter(pk=activity_id).update(updated_at=timezone.now())
+    forget(activity_id)
+
+
+def touch_on_commit(activity_id: int, using: str) -> None:
+    """``touch()`` after the transaction on ``using`` commits; a process that loads the
+    list between the bump and the commit would otherwise keep the old one."""
+    transaction.on_commit(lambda: touch(activity_id), using=using)
+
+
+def forget(activity_id: int) -> None:
+    with _lock:
+        _members.pop(activity_id, None)
+
+
+def clear() -> None:
+    with _lock:
+        _members.clear()
@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-10-19 13:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkin', '0004_update_checkin_status_choices'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activityparticipation',
+            name='activity',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='checkin.activity', verbose_name='活动'),
+        ),
+        migrations.AlterField(
+            model_name='activityparticipation',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='用户'),
+        ),
+        migrations.AlterField(
+            model_name='checkinrecord',
+            name='activity',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='checkins', to='checkin.activity', verbose_name='活动'),
+        ),
+        migrations.AlterField(
+            model_name='checkinrecord',
+            name='checkin_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='签到时间'),
+        ),
+        migrations.AlterField(
+            model_name='checkinrecord',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='checkins', to=settings.AUTH_USER_MODEL, verbose_name='用户'),
+        ),
+    ]
@@ -0,0 +1,143 @@
+"""Partition checkin_checkinrecord by month of checkin_time on PostgreSQL.
+
+Other databases keep the plain table. A partitioned table can only carry
+unique constraints that include the partition key, so the primary key becomes
+(id, checkin_time) and the one-check-in-per-user-and-activity rule is enforced
+by a trigger instead of a unique constraint. checkin.partitions maintains the
+partitions afterwards (``checkin_partitions`` command); the helpers below are
+copies so that this migration keeps working whatever happens to that module.
+"""
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.db import migrations
+
+PARENT_TABLE = 'checkin_checkinrecord'
+DEFAULT_PARTITION = f'{PARENT_TABLE}_default'
+OLD_TABLE = f'{PARENT_TABLE}_unpartitioned'
+MONTHS_AHEAD = 3
+
+UNIQUE_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION {PARENT_TABLE}_unique_activity_user() RETURNS trigger AS $$
+BEGIN
+    -- Serialise writers of the same (activity, user) pair across partitions.
+    PERFORM pg_advisory_xact_lock(hashtextextended(NEW.activity_id::text || ':' || NEW.user_id::text, 0));
+    IF EXISTS (
+        SELECT 1 FROM {PARENT_TABLE}
+        WHERE activity_id = NEW.activity_id AND user_id = NEW.user_id AND id <> NEW.id
+    ) THEN
+        RAISE EXCEPTION 'duplicate check-in for activity % and user %', NEW.activity_id, NEW.user_id
+            USING ERRCODE = 'unique_violation';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+UNIQUE_TRIGGER_SQL = f"""
+CREATE TRIGGER {PARENT_TABLE}_unique_activity_user
+BEFORE INSERT OR UPDATE OF activity_id, user_id ON {PARENT_TABLE}
+FOR EACH ROW EXECUTE FUNCTION {PARENT_TABLE}_unique_activity_user()
+"""
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f'{PARENT_TABLE}_y{month.year}m{month.month:02d}'
+
+
+def month_start_utc(month: date) -> datetime:
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+
+
+def is_partitioned(connection) -> bool:
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [PARENT_TABLE])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def partition_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql' or is_partitioned(connection):
+        return
+    execute = schema_editor.execute
+    execute(f'ALTER TABLE {PARENT_TABLE} RENAME TO {OLD_TABLE}')
+    execute(f'ALTER SEQUENCE {PARENT_TABLE}_id_seq RENAME TO {OLD_TABLE}_id_seq')
+    execute(
+        f'CREATE TABLE {PARENT_TABLE} (LIKE {OLD_TABLE} INCLUDING DEFAULTS INCLUDING IDENTITY) '
+        f'PARTITION BY RANGE (checkin_time)'
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT min(checkin_time) FROM {OLD_TABLE}')
+        oldest = cursor.fetchone()[0]
+    current = month_start(datetime.now(dt_timezone.utc).date())
+    month = month_start(oldest.astimezone(dt_timezone.utc).date()) if oldest else current
+    month = min(month, current)
+    last = add_months(current, MONTHS_AHEAD)
+    while month <= last:
+        execute(
+            f'CREATE TABLE {partition_name(month)} PARTITION OF {PARENT_TABLE} FOR VALUES FROM (%s) TO (%s)',
+            [month_start_utc(month), month_start_utc(add_months(month, 1))],
+        )
+        month = add_months(month, 1)
+    execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT')
+
+    execute(f'INSERT INTO {PARENT_TABLE} SELECT * FROM {OLD_TABLE}')
+    execute(
+        f"SELECT setval(pg_get_serial_sequence('{PARENT_TABLE}', 'id'), "
+        f"COALESCE((SELECT max(id) FROM {PARENT_TABLE}), 0) + 1, false)"
+    )
+    execute(f'DROP TABLE {OLD_TABLE}')
+
+    execute(f'ALTER TABLE {PARENT_TABLE} ADD CONSTRAINT {PARENT_TABLE}_pkey PRIMARY KEY (id, checkin_time)')
+    execute(f'CREATE INDEX {PARENT_TABLE}_activity_id_user_id ON {PARENT_TABLE} (activity_id, user_id)')
+    execute(f'CREATE INDEX {PARENT_TABLE}_user_id ON {PARENT_TABLE} (user_id)')
+    execute(UNIQUE_FUNCTION_SQL, None)
+    execute(UNIQUE_TRIGGER_SQL)
+
+
+def unpartition_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if not is_partitioned(connection):
+        return
+    execute = schema_editor.execute
+    execute(f'ALTER TABLE {PARENT_TABLE} RENAME TO {OLD_TABLE}')
+    execute(f'ALTER SEQUENCE {PARENT_TABLE}_id_seq RENAME TO {OLD_TABLE}_id_seq')
+    execute(f'CREATE TABLE {PARENT_TABLE} (LIKE {OLD_TABLE} INCLUDING DEFAULTS INCLUDING IDENTITY)')
+    execute(f'INSERT INTO {PARENT_TABLE} SELECT * FROM {OLD_TABLE}')
+    execute(
+        f"SELECT setval(pg_get_serial_sequence('{PARENT_TABLE}', 'id'), "
+        f"COALESCE((SELECT max(id) FROM {PARENT_TABLE}), 0) + 1, false)"
+    )
+    execute(f'DROP TABLE {OLD_TABLE} CASCADE')
+    execute(f'DROP FUNCTION IF EXISTS {PARENT_TABLE}_unique_activity_user()')
+
+    execute(f'ALTER TABLE {PARENT_TABLE} ADD CONSTRAINT {PARENT_TABLE}_pkey PRIMARY KEY (id)')
+    execute(
+        f'ALTER TABLE {PARENT_TABLE} ADD CONSTRAINT {PARENT_TABLE}_activity_id_user_id_1a98c7e1_uniq '
+        f'UNIQUE (activity_id, user_id)'
+    )
+    execute(f'CREATE INDEX {PARENT_TABLE}_activity_id_d7243b26 ON {PARENT_TABLE} (activity_id)')
+    execute(f'CREATE INDEX {PARENT_TABLE}_user_id_d1044fbf ON {PARENT_TABLE} (user_id)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkin', '0005_shard_ready_checkin_tables'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_table, unpartition_table),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-19 13:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkin', '0006_partition_checkinrecord'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['-start_time'], name='checkin_act_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['repeat_type', 'end_time'], name='checkin_act_open_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='checkinrecord',
+            index=models.Index(fields=['activity', 'status'], name='checkin_rec_act_status_idx'),
+        ),
+    ]
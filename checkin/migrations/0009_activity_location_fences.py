@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 15:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkin', '0008_activity_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='location_fences',
+            field=models.JSONField(blank=True, default=list, verbose_name='附加签到区域'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+"""Restore the check-in foreign key constraints on the primary database.
+
+0005 dropped the constraints of ActivityParticipation and CheckInRecord for
+every database, because a check-in shard holds these rows without the users
+and activities they point to. On the primary both sides always live
+together, sharded or not, so its tables get their constraints back here.
+Shards (any other alias) keep the unconstrained schema of the models.
+"""
+import copy
+
+from django.db import DEFAULT_DB_ALIAS, migrations
+
+FOREIGN_KEYS = (
+    ('activityparticipation', 'activity'),
+    ('activityparticipation', 'user'),
+    ('checkinrecord', 'activity'),
+    ('checkinrecord', 'user'),
+)
+
+
+def _fields(apps):
+    for model_name, field_name in FOREIGN_KEYS:
+        model = apps.get_model('checkin', model_name)
+        unconstrained = model._meta.get_field(field_name)
+        constrained = copy.copy(unconstrained)
+        constrained.db_constraint = True
+        yield model, unconstrained, constrained
+
+
+def add_constraints(apps, schema_editor):
+    if schema_editor.connection.alias != DEFAULT_DB_ALIAS:
+        return
+    for model, unconstrained, constrained in _fields(apps):
+        schema_editor.alter_field(model, unconstrained, constrained)
+
+
+def drop_constraints(apps, schema_editor):
+    if schema_editor.connection.alias != DEFAULT_DB_ALIAS:
+        return
+    for model, unconstrained, constrained in _fields(apps):
+        schema_editor.alter_field(model, constrained, unconstrained)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkin', '0009_activity_location_fences'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_constraints, drop_constraints),
+    ]
@@ -3,11 +3,15 @@ from django.db import models
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
-from datetime import time as dt_time
+from datetime import time as dt_time, timedelta
 import hashlib
 import os
 
 
+# Margin around the bounds of Activity.checkin_records() for clock differences.
+CHECKIN_TIME_SLACK = timedelta(days=1)
+
+
 def generate_qr_secret() -> str:
 	return hashlib.sha256(os.urandom(16)).hexdigest()[:32]
 
@@ -22,6 +26,8 @@ class Activity(models.Model):
 	location_lat = models.FloatField(null=True, blank=True, verbose_name='纬度')
 	location_lng = models.FloatField(null=True, blank=True, verbose_name='经度')
 	location_radius_m = models.PositiveIntegerField(default=0, verbose_name='范围(米)')
+	# Extra circles and polygons, see checkin/geofence.py
+	location_fences = models.JSONField(default=list, blank=True, verbose_name='附加签到区域')
 	# 重复签到
 	repeat_type = models.CharField(
 		max_length=10,
@@ -46,6 +52,8 @@ class Activity(models.Model):
 	)
 	created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
 	is_active = models.BooleanField(default=True, verbose_name='是否启用')
+	# Bumped on every save; part of the dashboard fragment cache key
+	updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
 	participants = models.ManyToManyField(
 		settings.AUTH_USER_MODEL,
@@ -58,13 +66,24 @@ class Activity(models.Model):
 		verbose_name = '活动'
 		verbose_name_plural = '活动'
 		ordering = ['-start_time']
+		indexes = [
+			models.Index(fields=['-start_time'], name='checkin_act_start_idx'),
+			# Auto-close scans only still-active activities by end time
+			models.Index(
+				fields=['repeat_type', 'end_time'],
+				name='checkin_act_open_end_idx',
+				condition=models.Q(is_active=True),
+			),
+		]
 
 	def __str__(self) -> str:  # pragma: no cover - simple display
 		return self.name
 
 	def is_open_for(self, dt):
-		if not self.is_active:
-			return False
+		return self.is_active and self.is_scheduled_for(dt)
+
+	def is_scheduled_for(self, dt):
+		"""Whether `dt` falls in the activity's schedule, whether or not it is active now."""
 		if self.repeat_type == 'none':
 			return self.start_time <= dt <= self.end_time
 		# 总体有效期：使用日期边界
@@ -93,16 +112,38 @@ class Activity(models.Model):
 		return True
 
 	def current_qr_token(self, dt=None):
-		dt = dt or timezone.now()
-		interval = max(self.qr_refresh_interval_s or 30, 10)
-		slot = int(dt.timestamp() // interval)
-		payload = f"{self.qr_secret}:{slot}"
-		return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:24]
+		from . import qrtoken
+
+		return qrtoken.issue(self, dt)
 
 	def is_valid_qr_token(self, token, dt=None):
-		if not (self.qr_enabled and token):
-			return False
-		return token == self.current_qr_token(dt)
+		"""Current or up to CHECKIN_QR_PREVIOUS_SLOTS slots old (see checkin/qrtoken.py)."""
+		from . import qrtoken
+
+		return qrtoken.verify(self, token, dt)
+
+	def checkin_time_floor(self):
+		"""Earliest time a check-in of this activity can be stored at.
+		Online check-ins happen after the activity is created, but batch and offline
+		check-ins carry their own time, which may fall in a window that opened
+		before that; so the earlier of the two, less a day of slack.
+		"""
+		starts = [value for value in (self.created_at, self.start_time) if value]
+		return min(starts) - CHECKIN_TIME_SLACK if starts else None
+
+	def checkin_records(self, until=None):
+		"""This activity's check-ins, bounded below by `checkin_time_floor()` and,
+		when the caller knows one (usually now), above by `until`.
+		The bounds let PostgreSQL skip the other partitions of the check-in table;
+		a day of slack above covers clock differences between servers.
+		"""
+		qs = self.checkins.all()
+		floor = self.checkin_time_floor()
+		if floor is not None:
+			qs = qs.filter(checkin_time__gte=floor)
+		if until is not None:
+			qs = qs.filter(checkin_time__lte=until + CHECKIN_TIME_SLACK)
+		return qs
 
 	@property
 	def is_ongoing(self) -> bool:
@@ -112,9 +153,14 @@ class Activity(models.Model):
 		return self.is_open_for(timezone.now())
 
 
+# ActivityParticipation and CheckInRecord may live on a check-in shard (see
+# checkin.sharding), so their foreign keys carry no database-level constraint
+# there; migration 0010 restores the constraints on the primary database.
 class ActivityParticipation(models.Model):
-	activity = models.ForeignKey(Activity, on_delete=models.CASCADE, verbose_name='活动')
-	user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='用户')
+	activity = models.ForeignKey(Activity, on_delete=models.CASCADE, db_constraint=False, verbose_name='活动')
+	user = models.ForeignKey(
+		settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False, verbose_name='用户'
+	)
 	can_participate = models.BooleanField(default=True, verbose_name='允许参与')
 
 	class Meta:
@@ -134,12 +180,17 @@ class CheckInRecord(models.Model):
 		ABSENT = ('absent', _('未签'))
 
 	activity = models.ForeignKey(
-		Activity, on_delete=models.CASCADE, related_name='checkins', verbose_name='活动'
+		Activity, on_delete=models.CASCADE, related_name='checkins', db_constraint=False, verbose_name='活动'
 	)
 	user = models.ForeignKey(
-		settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='checkins', verbose_name='用户'
+		settings.AUTH_USER_MODEL,
+		on_delete=models.CASCADE,
+		related_name='checkins',
+		db_constraint=False,
+		verbose_name='用户',
 	)
-	checkin_time = models.DateTimeField(auto_now_add=True, verbose_name='签到时间')
+	# default instead of auto_now_add so copied or batched rows keep their original time
+	checkin_time = models.DateTimeField(default=timezone.now, editable=False, verbose_name='签到时间')
 	ip_address = models.GenericIPAddressField(null=True, blank=True, verbose_name='IP地址')
 	user_agent = models.TextField(blank=True, verbose_name='UserAgent')
 	# 位置数据（若启用）
@@ -156,6 +207,9 @@ class CheckInRecord(models.Model):
 	class Meta:
 		unique_together = ('activity', 'user')
 		ordering = ['-checkin_time']
+		indexes = [
+			models.Index(fields=['activity', 'status'], name='checkin_rec_act_status_idx'),
+		]
 		verbose_name = '签到记录'
 		verbose_name_plural = '签到记录'
 
@@ -0,0 +1,168 @@
+"""Check-ins made without a network connection and submitted later.
+
+While online, the check-in pages get a ticket per activity from
+``issue_ticket()``: the user, the activity and the issue time, signed with
+``SECRET_KEY``. When a check-in cannot reach the server, ``assets/js/checkin.js``
+keeps the attempt in ``localStorage`` with its ticket, the device time and,
+for QR activities, the scanned token. Once the connection is back it posts
+the whole queue to the sync API.
+
+``sync()`` validates every attempt at the time it was made, not at arrival:
+
+- the device clock is corrected by the difference between the server time
+  and the ``sent_at`` time of the sync request;
+- the time must lie between the ticket's issue time and
+  ``CHECKIN_OFFLINE_TICKET_SECONDS`` later (at most the length of one
+  opening of the activity), and not in the future;
+- the activity must have been open then, and the QR token current then,
+  both within ``CHECKIN_OFFLINE_TOLERANCE_SECONDS``; an activity that was
+  deactivated after its end (``ActivityAutoCloseMiddleware`` does that) still
+  takes the attempts made while it ran;
+- location and participant rules are those of an online check-in.
+
+Accepted attempts are written with ``batch.write_checkins()``, one bulk
+insert per activity.
+"""
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from . import batch, geofence, membership, qrtoken
+from .models import Activity, CheckInRecord
+
+SALT = 'checkin.offline.ticket'
+
+
+def ticket_seconds() -> int:
+    return getattr(settings, 'CHECKIN_OFFLINE_TICKET_SECONDS', 30 * 60)
+
+
+def window_length(activity) -> timedelta:
+    """Length of one opening: the whole span of a single activity, the daily window of a repeating one."""
+    if activity.repeat_type == 'none':
+        return activity.end_time - activity.start_time
+    start = datetime.combine(date.min, activity.window_start_time or dt_time(0, 0))
+    end = datetime.combine(date.min, activity.window_end_time or dt_time(23, 59, 59))
+    # A window across midnight, e.g. 23:00-01:00
+    return end - start if end >= start else end - start + timedelta(days=1)
+
+
+def ticket_lifetime(activity) -> timedelta:
+    """How long after its issue a ticket covers check-ins: a leaked or kept ticket
+    cannot stretch a check-in past one opening of the activity."""
+    return min(timedelta(seconds=ticket_seconds()), window_length(activity))
+
+
+def tolerance() -> timedelta:
+    return timedelta(seconds=getattr(settings, 'CHECKIN_OFFLINE_TOLERANCE_SECONDS', 120))
+
+
+def issue_ticket(user_id: int, activity_id: int, now: datetime | None = None) -> str:
+    issued = int((now or timezone.now()).timestamp())
+    return signing.dumps([user_id, activity_id, issued], salt=SALT)
+
+
+def read_ticket(ticket, user_id: int) -> tuple[int, datetime] | None:
+    """``(activity_id, issued at)`` of a ticket issued to ``user_id``, or None."""
+    if not isinstance(ticket, str):
+        return None
+    try:
+        owner, activity_id, issued = signing.loads(ticket, salt=SALT)
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+    if owner != user_id:
+        return None
+    return activity_id, datetime.fromtimestamp(issued, tz=dt_timezone.utc)
+
+
+def _open_time(activity, when: datetime, slack: timedelta) -> datetime | None:
+    """``when``, or the nearest time within ``slack`` at which the activity was open."""
+    for candidate in (when, when - slack, when + slack):
+        if activity.is_scheduled_for(candidate):
+            return candidate
+    return None
+
+
+def _closed_early(activity, now: datetime) -> bool:
+    """Deactivated before its end, i.e. by hand rather than by ``ActivityAutoCloseMiddleware``."""
+    return not activity.is_active and not (activity.end_time and activity.end_time < now)
+
+
+def _rule_error(activity, attempt: dict, when: datetime, slack: timedelta):
+    lat = lng = None
+    if activity.location_enabled:
+        try:
+            lat, lng = float(attempt.get('lat')), float(attempt.get('lng'))
+        except (TypeError, ValueError):
+            return _('缺少或无效的位置参数'), None, None
+        fence = geofence.fence_for(activity)
+        if fence is not None and not fence.contains(lat, lng):
+            return _('不在签到范围内'), None, None
+    if activity.qr_enabled and not qrtoken.verify_near(activity, attempt.get('qr_token'), when, slack.total_seconds()):
+        return _('二维码已过期或无效'), None, None
+    return None, lat, lng
+
+
+def sync(user, attempts: list, sent_at=None, ip_address=None, user_agent='', now: datetime | None = None) -> list[dict]:
+    """Validate and store ``user``'s queued attempts ``{"ticket", "time", "qr_token"?, "lat"?, "lng"?}``.
+    Returns one ``{"activity_id"?, "result", "error"?}`` per attempt, in order."""
+    now = now or timezone.now()
+    slack = tolerance()
+    skew = now - (batch.entry_time(sent_at, now) or now)
+    tickets = [read_ticket(attempt.get('ticket'), user.pk) if isinstance(attempt, dict) else None for attempt in attempts]
+    activities = Activity.objects.filter(pk__in={ticket[0] for ticket in tickets if ticket}).in_bulk()
+
+    results: list[dict] = []
+    pending: dict[int, CheckInRecord] = {}
+    for attempt, ticket in zip(attempts, tickets):
+        if ticket is None:
+            results.append({'result': batch.ERROR, 'error': _('无效的离线签到凭证')})
+            continue
+        activity_id, issued = ticket
+        result = {'activity_id': activity_id}
+        results.append(result)
+        activity = activities.get(activity_id)
+        when = batch.entry_time(attempt.get('time'), None) if attempt.get('time') else None
+        if when is not None:
+            when += skew
+        error = lat = lng = None
+        if activity is None or _closed_early(activity, now):
+            error = _('活动不存在或已停用')
+        elif when is None or not issued - slack <= when <= min(issued + ticket_lifetime(activity), now + slack):
+            error = _('无效的签到时间')
+        elif not user.is_test and not membership.is_member(activity, user.pk):
+            error = _('您无权参与此活动')
+        else:
+            recorded = _open_time(activity, when, slack)
+            if recorded is None:
+                error = _('活动不在开放时间')
+            else:
+                error, lat, lng = _rule_error(activity, attempt, when, slack)
+        if error:
+            result.update(result=batch.ERROR, error=error)
+            continue
+        # The first attempt for an activity wins; later ones report EXISTS.
+        pending.setdefault(activity_id, CheckInRecord(
+            activity=activity,
+            user=user,
+            checkin_time=recorded,
+            ip_address=ip_address,
+            user_agent=user_agent,
+            latitude=lat,
+            longitude=lng,
+            status=CheckInRecord.CheckInStatus.PRESENT,
+        ))
+
+    # One bulk insert per activity; ``user`` has at most one check-in in each.
+    created = set()
+    for activity_id, record in pending.items():
+        if batch.write_checkins(activities[activity_id], [record]):
+            created.add(activity_id)
+    for result in results:
+        if 'result' not in result:
+            result['result'] = batch.CREATED if result['activity_id'] in created else batch.EXISTS
+            created.discard(result['activity_id'])
+    return results
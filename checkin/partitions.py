@@ -0,0 +1,144 @@
+"""Maintenance of the monthly range partitions of ``checkin_checkinrecord`` (PostgreSQL only).
+
+The table is converted by migration ``0006_partition_checkinrecord``. Partitions
+cover one UTC month each and are named ``checkin_checkinrecord_y2026m09``; rows
+outside every range land in ``checkin_checkinrecord_default``.
+"""
+import gzip
+from dataclasses import dataclass
+from datetime import date, datetime, timezone as dt_timezone
+from pathlib import Path
+
+PARENT_TABLE = 'checkin_checkinrecord'
+DEFAULT_PARTITION = f'{PARENT_TABLE}_default'
+
+
+@dataclass
+class Partition:
+    name: str
+    start: datetime | None
+    end: datetime | None
+
+    @property
+    def is_default(self) -> bool:
+        return self.start is None
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f'{PARENT_TABLE}_y{month.year}m{month.month:02d}'
+
+
+def month_start_utc(month: date) -> datetime:
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+
+
+def is_partitioned(connection) -> bool:
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [PARENT_TABLE])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def list_partitions(connection) -> list[Partition]:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            ORDER BY child.relname
+            """,
+            [PARENT_TABLE],
+        )
+        rows = cursor.fetchall()
+    partitions = []
+    for name, bound in rows:
+        if bound == 'DEFAULT':
+            partitions.append(Partition(name, None, None))
+            continue
+        # FOR VALUES FROM ('2026-09-01 08:00:00+08') TO ('2026-10-01 08:00:00+08')
+        start, end = [part.split("'")[1] for part in bound.split('FROM', 1)[1].split('TO')]
+        partitions.append(Partition(name, _parse_bound(start), _parse_bound(end)))
+    return partitions
+
+
+def _parse_bound(value: str) -> datetime:
+    if value[-3] in '+-':
+        value += ':00'
+    return datetime.fromisoformat(value).astimezone(dt_timezone.utc)
+
+
+def create_month_partition(connection, month: date) -> bool:
+    """Create the partition for `month`, moving matching rows out of the default partition.
+
+    Returns False when it already exists.
+    """
+    name = partition_name(month)
+    existing = {p.name for p in list_partitions(connection)}
+    if name in existing:
+        return False
+    start, end = month_start_utc(month), month_start_utc(add_months(month, 1))
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        has_default = DEFAULT_PARTITION in existing
+        if has_default:
+            # A new range may not overlap rows already sitting in the default partition.
+            cursor.execute(f'ALTER TABLE {qn(PARENT_TABLE)} DETACH PARTITION {qn(DEFAULT_PARTITION)}')
+        cursor.execute(
+            f'CREATE TABLE {qn(name)} PARTITION OF {qn(PARENT_TABLE)} FOR VALUES FROM (%s) TO (%s)',
+            [start, end],
+        )
+        if has_default:
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM {qn(DEFAULT_PARTITION)} '
+                f'WHERE checkin_time >= %s AND checkin_time < %s RETURNING *) '
+                f'INSERT INTO {qn(PARENT_TABLE)} SELECT * FROM moved',
+                [start, end],
+            )
+            cursor.execute(f'ALTER TABLE {qn(PARENT_TABLE)} ATTACH PARTITION {qn(DEFAULT_PARTITION)} DEFAULT')
+    return True
+
+
+def ensure_partitions(connection, months_ahead: int = 3, today: date | None = None) -> list[str]:
+    """Create partitions from the current month up to `months_ahead` months in the future."""
+    current = month_start(today or datetime.now(dt_timezone.utc).date())
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if create_month_partition(connection, month):
+            created.append(partition_name(month))
+    return created
+
+
+def archive_partition(connection, partition: Partition, archive_dir: Path, drop: bool = True) -> Path:
+    """Detach `partition`, dump it to a gzip-compressed CSV file and (by default) drop it."""
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    path = archive_dir / f'{partition.name}.csv.gz'
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {qn(PARENT_TABLE)} DETACH PARTITION {qn(partition.name)}')
+        copy_sql = f'COPY {qn(partition.name)} TO STDOUT WITH (FORMAT csv, HEADER)'
+        with gzip.open(path, 'wb') as fh:
+            raw = cursor.cursor
+            if hasattr(raw, 'copy_expert'):  # psycopg2
+                raw.copy_expert(copy_sql, fh)
+            else:  # psycopg 3
+                with raw.copy(copy_sql) as copy:
+                    for chunk in copy:
+                        fh.write(chunk)
+        if drop:
+            cursor.execute(f'DROP TABLE {qn(partition.name)}')
+    return path
@@ -0,0 +1,105 @@
+"""Load check-in data into a worker before an activity's window opens.
+
+When a window opens, every worker would otherwise miss its caches at the
+same moment. A background thread in each worker (started by gunicorn's
+``post_worker_init`` hook, see ``gunicorn.conf.py``) wakes up every
+``CHECKIN_PREWARM_INTERVAL_SECONDS``. For every activity that is open now or
+opens within ``CHECKIN_PREWARM_LEAD_SECONDS`` it loads the membership set and,
+with QR check-in, the token macs of the current and next slot, so the first
+check-ins find them in memory. Activities that are already open are included
+because recycled workers (``max_requests``) start cold in the middle of a
+window.
+"""
+import logging
+import os
+import random
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from . import membership, qrtoken
+from .models import Activity
+
+logger = logging.getLogger('neosign.prewarm')
+
+# Points in the lead time at which a window must be open to count as upcoming.
+SAMPLE_STEP = timedelta(seconds=15)
+
+
+def enabled() -> bool:
+    return getattr(settings, 'CHECKIN_PREWARM', True)
+
+
+def upcoming(now=None, lead: timedelta | None = None) -> list[Activity]:
+    """Active activities open at some point between now and now + lead."""
+    now = now or timezone.now()
+    if lead is None:
+        lead = timedelta(seconds=getattr(settings, 'CHECKIN_PREWARM_LEAD_SECONDS', 120))
+    horizon = now + lead
+    # Repeating activities compare dates only, so is_open_for() decides for them.
+    candidates = Activity.objects.filter(is_active=True).filter(
+        Q(repeat_type='none', start_time__lte=horizon, end_time__gte=now) | ~Q(repeat_type='none')
+    )
+    samples = [now + SAMPLE_STEP * i for i in range(int(lead / SAMPLE_STEP) + 1)] + [horizon]
+    return [activity for activity in candidates if any(activity.is_open_for(t) for t in samples)]
+
+
+def warm(now=None) -> int:
+    """Load the caches of upcoming activities; returns how many were warmed."""
+    now = now or timezone.now()
+    activities = upcoming(now)
+    for activity in activities:
+        membership.load(activity)
+        if activity.qr_enabled:
+            # The current and the next slot, whichever the window opens in.
+            for dt in (now, now + timedelta(seconds=qrtoken.interval_of(activity))):
+                qrtoken.issue(activity, dt)
+    return len(activities)
+
+
+class Prewarmer:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.pid = os.getpid()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='checkin-prewarm', daemon=True)
+
+    def _run(self) -> None:
+        # Workers start together; spread their queries over the first interval.
+        wait = random.uniform(0, min(self.interval, 5))
+        while not self._stop.wait(wait):
+            try:
+                warm()
+            except Exception:
+                logger.exception('Check-in pre-warming failed')
+            finally:
+                # The thread sleeps most of the time; do not hold a connection meanwhile.
+                for connection in connections.all(initialized_only=True):
+                    connection.close()
+            wait = self.interval * random.uniform(0.9, 1.1)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+_prewarmer: Prewarmer | None = None
+_prewarmer_lock = threading.Lock()
+
+
+def start() -> Prewarmer | None:
+    """Start this process's pre-warming thread once (None when ``CHECKIN_PREWARM`` is off)."""
+    global _prewarmer
+    if not enabled():
+        return None
+    with _prewarmer_lock:
+        if _prewarmer is None or _prewarmer.pid != os.getpid():
+            _prewarmer = Prewarmer(getattr(settings, 'CHECKIN_PREWARM_INTERVAL_SECONDS', 30))
+            _prewarmer.start()
+    return _prewarmer
@@ -0,0 +1,202 @@
+"""Rotating QR check-in tokens.
+
+A token is ``<activity id>.<interval>.<slot>.<mac>``: the slot is the number
+of ``interval``-second periods since the epoch, and the mac is an HMAC-SHA256
+of the rest keyed with the activity's ``qr_secret`` (24 hex digits). A token
+is accepted for its own slot and ``CHECKIN_QR_PREVIOUS_SLOTS`` more, so a code
+scanned just before it rotates still works when the request arrives.
+
+Macs are memoized per ``(activity, interval, slot)`` in a small LRU shared by
+the presenter image and the check-in views. While a slot is current, the
+check-ins compare against the memo instead of hashing again.
+``verify_token()`` checks a token with nothing but the token. It reads
+``qr_secret`` only on a memo miss.
+
+Each memo entry keeps the secret it was made with, so ``issue()`` and
+``verify()`` use a changed ``qr_secret`` at once, in every worker.
+``verify_token()`` does not know the secret without a query; a changed secret,
+or QR check-in turned off, reaches it with the next slot that is not memoized,
+at most ``interval * (previous slots + 1)`` seconds later. ``forget()`` drops
+an activity's entries in this process; the admin calls it when the secret is
+edited.
+
+Personal codes (reverse QR, shown by the attendee and scanned by the
+presenter) are ``u.<user id>.<slot>.<mac>`` with slots of
+``CHECKIN_PERSONAL_CODE_INTERVAL`` seconds. Their mac is keyed with a key
+derived from ``SECRET_KEY``, so ``verify_personal()`` needs neither the
+database nor the memo.
+"""
+import hashlib
+import hmac
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+from .models import Activity
+
+MAC_LENGTH = 24
+TOKEN_RE = re.compile(rf'(\d{{1,18}})\.(\d{{1,6}})\.(\d{{1,18}})\.([0-9a-f]{{{MAC_LENGTH}}})', re.ASCII)
+MIN_INTERVAL = 10
+PERSONAL_RE = re.compile(rf'u\.(\d{{1,18}})\.(\d{{1,18}})\.([0-9a-f]{{{MAC_LENGTH}}})', re.ASCII)
+PERSONAL_SALT = 'checkin.qrtoken.personal'
+
+# (activity, interval, slot) -> (secret, mac)
+_macs: OrderedDict[tuple[int, int, int], tuple[str, str]] = OrderedDict()
+_lock = threading.Lock()
+
+
+def _max_entries() -> int:
+    return getattr(settings, 'CHECKIN_QR_TOKEN_CACHE_SIZE', 1024)
+
+
+def previous_slots() -> int:
+    return getattr(settings, 'CHECKIN_QR_PREVIOUS_SLOTS', 1)
+
+
+def interval_of(activity) -> int:
+    return max(activity.qr_refresh_interval_s or 30, MIN_INTERVAL)
+
+
+def slot_at(interval: int, dt=None) -> int:
+    return int((dt or timezone.now()).timestamp() // interval)
+
+
+def _sign(secret: str, activity_id: int, interval: int, slot: int) -> str:
+    message = f'{activity_id}.{interval}.{slot}'.encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()[:MAC_LENGTH]
+
+
+def _mac(activity_id: int, interval: int, slot: int, secret) -> str | None:
+    """The memoized mac; ``secret`` is the secret or a callable that loads it (None: unknown activity).
+    A memoized mac is only used for the same secret, or for any secret when it has to be loaded."""
+    key = (activity_id, interval, slot)
+    with _lock:
+        entry = _macs.get(key)
+        if entry is not None and (callable(secret) or entry[0] == secret):
+            _macs.move_to_end(key)
+            return entry[1]
+    if callable(secret):
+        secret = secret()
+        if secret is None:
+            return None
+    mac = _sign(secret, activity_id, interval, slot)
+    with _lock:
+        _macs[key] = (secret, mac)
+        _macs.move_to_end(key)
+        while len(_macs) > _max_entries():
+            _macs.popitem(last=False)
+    return mac
+
+
+def issue(activity, dt=None) -> str:
+    """The token for the slot that is current at ``dt``."""
+    interval = interval_of(activity)
+    slot = slot_at(interval, dt)
+    return f'{activity.pk}.{interval}.{slot}.{_mac(activity.pk, interval, slot, activity.qr_secret)}'
+
+
+def parse(token) -> tuple[int, int, int, str] | None:
+    """``(activity_id, interval, slot, mac)``, or None when the token is malformed."""
+    match = TOKEN_RE.fullmatch(token) if isinstance(token, str) else None
+    if match is None:
+        return None
+    activity_id, interval, slot, mac = match.groups()
+    return int(activity_id), int(interval), int(slot), mac
+
+
+def _fresh(interval: int, slot: int, dt) -> bool:
+    age = slot_at(interval, dt) - slot
+    return interval >= MIN_INTERVAL and 0 <= age <= previous_slots()
+
+
+def verify(activity, token, dt=None) -> bool:
+    """Whether ``token`` is a current token of ``activity`` (which must have QR check-in on)."""
+    parsed = parse(token)
+    if not activity.qr_enabled or parsed is None:
+        return False
+    activity_id, interval, slot, mac = parsed
+    if activity_id != activity.pk or interval != interval_of(activity) or not _fresh(interval, slot, dt):
+        return False
+    return hmac.compare_digest(mac, _mac(activity_id, interval, slot, activity.qr_secret))
+
+
+def verify_near(activity, token, dt, tolerance: float) -> bool:
+    """Whether ``token`` was a current token of ``activity`` within ``tolerance`` seconds of ``dt``.
+    For check-ins queued offline, which are verified long after the scan."""
+    parsed = parse(token)
+    if not activity.qr_enabled or parsed is None:
+        return False
+    activity_id, interval, slot, mac = parsed
+    if activity_id != activity.pk or interval != interval_of(activity):
+        return False
+    valid_from, valid_until = slot * interval, (slot + 1 + previous_slots()) * interval
+    if not valid_from - tolerance <= dt.timestamp() < valid_until + tolerance:
+        return False
+    return hmac.compare_digest(mac, _mac(activity_id, interval, slot, activity.qr_secret))
+
+
+def verify_token(token, dt=None) -> int | None:
+    """The activity id a current token belongs to, or None; no query while the slot is memoized."""
+    parsed = parse(token)
+    if parsed is None:
+        return None
+    activity_id, interval, slot, mac = parsed
+    if not _fresh(interval, slot, dt):
+        return None
+
+    def load_secret():
+        activity = (
+            Activity.objects.filter(pk=activity_id, qr_enabled=True)
+            .only('qr_secret', 'qr_refresh_interval_s')
+            .first()
+        )
+        if activity is None or interval_of(activity) != interval:
+            return None
+        return activity.qr_secret
+
+    expected = _mac(activity_id, interval, slot, load_secret)
+    if expected is None or not hmac.compare_digest(mac, expected):
+        return None
+    return activity_id
+
+
+def personal_interval() -> int:
+    return max(getattr(settings, 'CHECKIN_PERSONAL_CODE_INTERVAL', 20), MIN_INTERVAL)
+
+
+def _sign_personal(user_id: int, slot: int) -> str:
+    return salted_hmac(PERSONAL_SALT, f'{user_id}.{slot}', algorithm='sha256').hexdigest()[:MAC_LENGTH]
+
+
+def issue_personal(user_id: int, dt=None) -> str:
+    """The personal code of ``user_id`` for the slot that is current at ``dt``."""
+    slot = slot_at(personal_interval(), dt)
+    return f'u.{user_id}.{slot}.{_sign_personal(user_id, slot)}'
+
+
+def verify_personal(code, dt=None) -> int | None:
+    """The user id a current personal code belongs to, or None."""
+    match = PERSONAL_RE.fullmatch(code) if isinstance(code, str) else None
+    if match is None:
+        return None
+    user_id, slot, mac = int(match[1]), int(match[2]), match[3]
+    if not 0 <= slot_at(personal_interval(), dt) - slot <= previous_slots():
+        return None
+    if not hmac.compare_digest(mac, _sign_personal(user_id, slot)):
+        return None
+    return user_id
+
+
+def forget(activity_id: int) -> None:
+    with _lock:
+        for key in [key for key in _macs if key[0] == activity_id]:
+            del _macs[key]
+
+
+def clear() -> None:
+    with _lock:
+        _macs.clear()
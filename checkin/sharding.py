@@ -0,0 +1,182 @@
+"""Optional horizontal sharding of check-in data by activity.
+
+When ``CHECKIN_SHARDS`` is configured, every ``CheckInRecord`` and
+``ActivityParticipation`` row lives on the shard chosen by a jump consistent
+hash of its ``activity_id``; users and activities stay on the default
+database. Queries that start from an activity (``activity.checkins``,
+``activity.activityparticipation_set``, ``Model(activity=...).save()``) are
+routed by ``CheckInShardRouter``. Queries that span activities or join users
+must go through the helpers below. Without shards every helper degrades to
+the plain single-database query.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+
+from . import membership
+from .models import Activity, ActivityParticipation, CheckInRecord
+
+SHARDED_MODELS = (CheckInRecord, ActivityParticipation)
+
+
+def shard_aliases() -> list[str]:
+    return list(getattr(settings, 'CHECKIN_SHARD_ALIASES', [])) or [DEFAULT_DB_ALIAS]
+
+
+def is_sharded() -> bool:
+    return bool(getattr(settings, 'CHECKIN_SHARD_ALIASES', []))
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping & Veach): growing from n to n+1 shards moves ~1/(n+1) of the keys."""
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for_activity(activity_id: int) -> str:
+    aliases = shard_aliases()
+    if len(aliases) == 1:
+        return aliases[0]
+    return aliases[jump_hash(int(activity_id), len(aliases))]
+
+
+class CheckInShardRouter:
+    """Route check-in tables to the shard of their activity.
+
+    Shards carry the full schema so historic migrations apply unchanged, but
+    only the check-in tables hold data there; lookups of users or activities
+    that originate from a sharded row are sent back to the default database.
+    """
+
+    def _route(self, model, hints):
+        if not is_sharded():
+            return None
+        instance = hints.get('instance')
+        if issubclass(model, SHARDED_MODELS):
+            if isinstance(instance, Activity):
+                return shard_for_activity(instance.pk)
+            activity_id = getattr(instance, 'activity_id', None)
+            if activity_id is not None:
+                return shard_for_activity(activity_id)
+            return None
+        if isinstance(instance, SHARDED_MODELS):
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if isinstance(obj1, SHARDED_MODELS) or isinstance(obj2, SHARDED_MODELS):
+            return True
+        return None
+
+
+def participant_ids(activity, allowed_only: bool = False):
+    """User ids on the activity's participant list, usable in ``id__in`` against users."""
+    qs = activity.activityparticipation_set.all()
+    if allowed_only:
+        qs = qs.filter(can_participate=True)
+    ids = qs.values_list('user_id', flat=True)
+    return list(ids) if is_sharded() else ids
+
+
+def add_participants(activity, user_ids) -> None:
+    """Put users on the activity's participant list with a single insert; existing rows are kept."""
+    manager = ActivityParticipation.objects
+    if is_sharded():
+        manager = manager.db_manager(shard_for_activity(activity.pk))
+    manager.bulk_create(
+        [ActivityParticipation(activity=activity, user_id=user_id, can_participate=True) for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+    # bulk_create sends no signals
+    membership.touch_on_commit(activity.pk, manager.db)
+
+
+def participants(activity):
+    """The activity's participants as a user queryset (replaces ``activity.participants``)."""
+    return get_user_model().objects.filter(id__in=participant_ids(activity))
+
+
+def user_activity_ids(user):
+    """Ids of the activities the user participates in, across all shards."""
+    if not is_sharded():
+        return ActivityParticipation.objects.filter(user=user).values_list('activity_id', flat=True)
+    ids = []
+    for alias in shard_aliases():
+        ids.extend(
+            ActivityParticipation.objects.using(alias).filter(user_id=user.pk).values_list('activity_id', flat=True)
+        )
+    return ids
+
+
+def checkins_with_users(activity, exclude_test_users: bool = True):
+    """The activity's check-ins with their users loaded, optionally without test accounts."""
+    qs = activity.checkin_records()
+    if not is_sharded():
+        qs = qs.select_related('user')
+        return qs.exclude(user__is_test=True) if exclude_test_users else qs
+    if exclude_test_users:
+        test_ids = list(get_user_model().objects.filter(is_test=True).values_list('id', flat=True))
+        qs = qs.exclude(user_id__in=test_ids)
+    return qs.prefetch_related('user')
+
+
+def user_checkins(user, activity_ids=None) -> list:
+    """The user's check-in history across shards, newest first.
+
+    Pass ``activity_ids`` to only visit the shards that can hold those activities.
+    """
+    if activity_ids is not None:
+        by_alias = defaultdict(list)
+        for activity_id in activity_ids:
+            by_alias[shard_for_activity(activity_id)].append(activity_id)
+    else:
+        by_alias = {alias: None for alias in shard_aliases()}
+
+    records = []
+    for alias, ids in by_alias.items():
+        qs = CheckInRecord.objects.filter(user_id=user.pk)
+        if is_sharded():
+            qs = qs.using(alias)
+        if ids is not None:
+            qs = qs.filter(activity_id__in=ids)
+        records.extend(qs)
+    records.sort(key=lambda record: record.checkin_time, reverse=True)
+    return records
+
+
+def count_checkins(**filters) -> int:
+    """Number of check-in records matching ``filters`` across all shards."""
+    if not is_sharded():
+        return CheckInRecord.objects.filter(**filters).count()
+    return sum(CheckInRecord.objects.using(alias).filter(**filters).count() for alias in shard_aliases())
+
+
+def delete_activity_rows(activity_id: int) -> None:
+    """Remove an activity's check-in data from its shard (the default database cascades itself)."""
+    alias = shard_for_activity(activity_id)
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    for model in SHARDED_MODELS:
+        model.objects.using(alias).filter(activity_id=activity_id).delete()
+
+
+def delete_user_rows(user_id: int) -> None:
+    """Remove a user's check-in data from every shard other than the default database."""
+    for alias in shard_aliases():
+        if alias == DEFAULT_DB_ALIAS:
+            continue
+        for model in SHARDED_MODELS:
+            model.objects.using(alias).filter(user_id=user_id).delete()
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import membership, sharding
+from .models import Activity, ActivityParticipation
+
+
+@receiver(post_delete, sender=Activity)
+def delete_sharded_activity_rows(sender, instance, **kwargs):
+    if sharding.is_sharded():
+        sharding.delete_activity_rows(instance.pk)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def delete_sharded_user_rows(sender, instance, **kwargs):
+    if sharding.is_sharded():
+        sharding.delete_user_rows(instance.pk)
+
+
+# Deliberately no post_delete receiver: it would turn every cascade delete of
+# participations into a fetch plus a per-row signal. Paths that remove rows call
+# membership.touch() themselves (activity edit view, admin).
+@receiver(post_save, sender=ActivityParticipation)
+def participation_changed(sender, instance, using, **kwargs):
+    membership.touch_on_commit(instance.activity_id, using)
@@ -1,3 +1,1261 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import math
+import os
+import random
+import re
+import tempfile
+import unittest
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.test import Client, TestCase, TransactionTestCase, override_settings, tag
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from core.testing import LARGE, SMALL, QueryBudgetMixin, database_aliases, seed
+
+from . import batch, collect, geofence, ingest, membership, offline, partitions, prewarm, qrtoken, sharding
+from .admin import ActivityAdmin
+from .models import Activity, ActivityParticipation, CheckInRecord, generate_qr_secret
+from .views import AsyncCheckInAPIView
+
+# The project URLs plus the async check-in view, whatever CHECKIN_API_ASYNC says.
+urlpatterns = [
+    path('async/checkin/<int:activity_id>/', AsyncCheckInAPIView.as_view(), name='async_checkin_api'),
+    path('', include('NeoSign.urls')),
+]
+
+User = get_user_model()
+
+
+def _full_scans(plan):
+    """Relations read in full anywhere in an EXPLAIN (FORMAT JSON) plan.
+
+    Besides sequential scans this catches index scans that walk a whole index
+    and filter rows afterwards (no ``Index Cond``), which is what the planner
+    picks when sequential scans are disabled but no suitable index exists.
+    """
+    found = []
+    node = plan.get('Node Type', '')
+    if node == 'Seq Scan' or (node.startswith('Index') and 'Filter' in plan and 'Index Cond' not in plan):
+        found.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        found.extend(_full_scans(child))
+    return found
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'EXPLAIN plan checks need PostgreSQL')
+def _foreign_key_columns(alias, table):
+    with connections[alias].cursor() as cursor:
+        constraints = connections[alias].introspection.get_constraints(cursor, table)
+    return {column for c in constraints.values() if c['foreign_key'] for column in c['columns']}
+
+
+class ShardingTests(TransactionTestCase):
+    """Two SQLite check-in shards next to the default database."""
+    # The shard aliases only exist from setUpClass on.
+    databases = '__all__'
+    shards = ['shard_a', 'shard_b']
+
+    @classmethod
+    def setUpClass(cls):
+        directory = cls.enterClassContext(tempfile.TemporaryDirectory())
+        cls.enterClassContext(database_aliases(**{
+            alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory, f'{alias}.sqlite3')}
+            for alias in cls.shards
+        }))
+        super().setUpClass()
+
+    def setUp(self):
+        membership.clear()
+        self.addCleanup(membership.clear)
+
+    def test_jump_hash_is_stable(self):
+        # Pinned: a change would silently strand every activity on the wrong shard.
+        self.assertEqual([sharding.jump_hash(key, 10) for key in range(1, 11)], [6, 6, 8, 1, 4, 9, 0, 4, 7, 7])
+        keys = range(10000)
+        for buckets in (1, 2, 3, 8):
+            before = [sharding.jump_hash(key, buckets) for key in keys]
+            after = [sharding.jump_hash(key, buckets + 1) for key in keys]
+            moved = [new for old, new in zip(before, after) if old != new]
+            # Growing the pool only moves keys onto the new shard, about 1/(n+1) of them.
+            self.assertEqual(set(moved), {buckets})
+            self.assertAlmostEqual(len(moved) / len(keys), 1 / (buckets + 1), delta=0.02)
+
+    def test_routing_by_activity(self):
+        data = seed(SMALL)
+        router = sharding.CheckInShardRouter()
+        self.assertIsNone(router.db_for_read(CheckInRecord, instance=data.activity))
+        with override_settings(CHECKIN_SHARD_ALIASES=self.shards):
+            for activity in data.activities:
+                shard = sharding.shard_for_activity(activity.pk)
+                self.assertIn(shard, self.shards)
+                self.assertEqual(activity.checkins.all().db, shard)
+                self.assertEqual(activity.activityparticipation_set.all().db, shard)
+                self.assertEqual(router.db_for_write(CheckInRecord, instance=CheckInRecord(activity_id=activity.pk)), shard)
+            # Users and activities of a sharded row stay on the default database.
+            record = CheckInRecord(activity=data.activity, user=data.member)
+            self.assertEqual(router.db_for_read(get_user_model(), instance=record), DEFAULT_DB_ALIAS)
+            self.assertIsNone(router.db_for_read(Activity))
+
+    def test_rebalance_is_idempotent(self):
+        data = seed(SMALL)
+        counts = {
+            activity.pk: (activity.checkins.count(), activity.activityparticipation_set.count())
+            for activity in data.activities
+        }
+        with override_settings(CHECKIN_SHARD_ALIASES=self.shards):
+            call_command('rebalance_checkin_shards', stdout=io.StringIO())
+            for model in sharding.SHARDED_MODELS:
+                self.assertFalse(model.objects.using(DEFAULT_DB_ALIAS).exists())
+            for activity in data.activities:
+                shard = sharding.shard_for_activity(activity.pk)
+                self.assertEqual(
+                    (CheckInRecord.objects.using(shard).filter(activity_id=activity.pk).count(),
+                     ActivityParticipation.objects.using(shard).filter(activity_id=activity.pk).count()),
+                    counts[activity.pk],
+                )
+            out = io.StringIO()
+            call_command('rebalance_checkin_shards', stdout=out)
+            self.assertIn('Moved 0 rows.', out.getvalue())
+            self.assertEqual(sharding.count_checkins(), sum(checkins for checkins, _ in counts.values()))
+
+    def test_foreign_keys_only_on_the_primary(self):
+        for table in (CheckInRecord._meta.db_table, ActivityParticipation._meta.db_table):
+            self.assertEqual(_foreign_key_columns(DEFAULT_DB_ALIAS, table), {'activity_id', 'user_id'})
+            for alias in self.shards:
+                self.assertEqual(_foreign_key_columns(alias, table), set())
+
+
+class PartitionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def add_record(self, checkin_time):
+        CheckInRecord.objects.create(activity=self.data.activity, user=self.data.tester, checkin_time=checkin_time)
+        # Check the deferred foreign keys now, as a commit would: a partition with
+        # pending trigger events cannot be dropped.
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    def partition_rows(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {connection.ops.quote_name(name)}')
+            return cursor.fetchone()[0]
+
+    def test_month_math(self):
+        self.assertEqual(partitions.month_start(date(2026, 3, 31)), date(2026, 3, 1))
+        self.assertEqual(partitions.add_months(date(2026, 11, 1), 2), date(2027, 1, 1))
+        self.assertEqual(partitions.add_months(date(2026, 1, 1), -1), date(2025, 12, 1))
+        self.assertEqual(partitions.add_months(date(2026, 12, 1), -24), date(2024, 12, 1))
+        self.assertEqual(partitions.partition_name(date(2026, 9, 1)), 'checkin_checkinrecord_y2026m09')
+        self.assertEqual(partitions.month_start_utc(date(2026, 12, 1)), datetime(2026, 12, 1, tzinfo=dt_timezone.utc))
+
+    def test_parse_bound(self):
+        september = datetime(2026, 9, 1, tzinfo=dt_timezone.utc)
+        for bound in ('2026-09-01 00:00:00+00', '2026-09-01 08:00:00+08', '2026-08-31 20:00:00-04', '2026-09-01 05:30:00+05:30'):
+            with self.subTest(bound=bound):
+                self.assertEqual(partitions._parse_bound(bound), september)
+
+    def test_listed_bounds_are_utc_months(self):
+        for partition in partitions.list_partitions(connection):
+            if partition.is_default:
+                continue
+            month = partition.start.date()
+            self.assertEqual(partition.name, partitions.partition_name(month))
+            self.assertEqual(partition.end, partitions.month_start_utc(partitions.add_months(month, 1)))
+
+    def test_create_moves_rows_out_of_the_default_partition(self):
+        self.add_record(datetime(2040, 5, 31, 23, 59, tzinfo=dt_timezone.utc))
+        self.assertEqual(self.partition_rows(partitions.DEFAULT_PARTITION), 1)
+
+        self.assertTrue(partitions.create_month_partition(connection, date(2040, 5, 1)))
+        self.assertFalse(partitions.create_month_partition(connection, date(2040, 5, 1)))
+        self.assertEqual(self.partition_rows(partitions.DEFAULT_PARTITION), 0)
+        self.assertEqual(self.partition_rows('checkin_checkinrecord_y2040m05'), 1)
+
+    def test_command_creates_upcoming_partitions(self):
+        current = partitions.month_start(timezone.now().astimezone(dt_timezone.utc).date())
+        out = io.StringIO()
+        call_command('checkin_partitions', months_ahead=5, stdout=out)
+        names = {partition.name for partition in partitions.list_partitions(connection)}
+        for offset in range(6):
+            self.assertIn(partitions.partition_name(partitions.add_months(current, offset)), names)
+
+        out = io.StringIO()
+        call_command('checkin_partitions', months_ahead=5, stdout=out)
+        self.assertNotIn('created', out.getvalue())
+
+    def test_command_archives_old_partitions(self):
+        partitions.create_month_partition(connection, date(2001, 1, 1))
+        self.add_record(datetime(2001, 1, 15, tzinfo=dt_timezone.utc))
+        with tempfile.TemporaryDirectory() as archive_dir:
+            out = io.StringIO()
+            call_command('checkin_partitions', retain_months=1, archive_dir=archive_dir, dry_run=True, stdout=out)
+            self.assertIn('would archive checkin_checkinrecord_y2001m01', out.getvalue())
+
+            call_command('checkin_partitions', retain_months=1, archive_dir=archive_dir, stdout=io.StringIO())
+            path = Path(archive_dir) / DEFAULT_DB_ALIAS / 'checkin_checkinrecord_y2001m01.csv.gz'
+            with gzip.open(path, 'rt') as fh:
+                self.assertEqual(len(fh.read().splitlines()), 2)
+        names = {partition.name for partition in partitions.list_partitions(connection)}
+        self.assertNotIn('checkin_checkinrecord_y2001m01', names)
+        self.assertIn(partitions.DEFAULT_PARTITION, names)
+        self.assertIn(partitions.partition_name(partitions.month_start(timezone.now().date())), names)
+
+    def test_back_dated_checkins_are_visible(self):
+        # Created now for a window that opened three days ago, checked in at a kiosk two days ago
+        now = timezone.now()
+        activity = Activity.objects.create(
+            name='Back-dated', start_time=now - timedelta(days=3), end_time=now + timedelta(hours=1),
+            created_by=self.data.admin,
+        )
+        CheckInRecord.objects.create(activity=activity, user=self.data.tester, checkin_time=now - timedelta(days=2))
+        self.assertEqual(activity.checkin_records(until=now).filter(user=self.data.tester).count(), 1)
+
+    def test_checkin_records_prunes_both_sides(self):
+        partitions.create_month_partition(connection, date(2001, 1, 1))
+        partitions.create_month_partition(connection, date(2040, 5, 1))
+        bounded = self.data.activity.checkin_records(until=timezone.now()).filter(user=self.data.tester).explain()
+        self.assertNotIn('y2001m01', bounded)
+        self.assertNotIn('y2040m05', bounded)
+        self.assertIn('y2040m05', self.data.activity.checkin_records().filter(user=self.data.tester).explain())
+
+
+class HotQueryPlanTests(TestCase):
+    """The hot lookups must be answerable from an index.
+
+    Sequential scans, hash joins and merge joins are disabled for each test, so
+    every relation has to be reached through an index condition and the planner
+    only falls back to a full scan when no usable index exists. The seeded tables
+    are too small for the planner's own cost-based choices to be meaningful.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        User.objects.bulk_create(
+            User(username=f'{20000000 + i}', is_test=(i % 50 == 0)) for i in range(20000)
+        )
+        cls.admin = User.objects.create_user('10000001', 'x', is_admin=True)
+        users = list(User.objects.exclude(pk=cls.admin.pk).order_by('pk'))
+        cls.user = users[1]
+        Activity.objects.bulk_create(
+            Activity(
+                name=f'activity {i}',
+                start_time=now - timedelta(days=i),
+                end_time=now - timedelta(days=i) + timedelta(hours=2),
+                repeat_type=('none', 'daily', 'weekly')[i % 3],
+                is_active=(i % 4 == 0),
+                created_by=cls.admin,
+            )
+            for i in range(200)
+        )
+        activities = list(Activity.objects.order_by('pk'))
+        cls.activity = activities[0]
+        participations, checkins = [], []
+        for index, activity in enumerate(activities[:20]):
+            for user in users[index * 500:(index + 1) * 500 + 500]:
+                participations.append(ActivityParticipation(activity=activity, user=user))
+                if user.pk % 2:
+                    checkins.append(CheckInRecord(activity=activity, user=user, checkin_time=now))
+        ActivityParticipation.objects.bulk_create(participations)
+        CheckInRecord.objects.bulk_create(checkins)
+        with connection.cursor() as cursor:
+            for model in (User, Activity, ActivityParticipation, CheckInRecord):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            for setting in ('enable_seqscan', 'enable_hashjoin', 'enable_mergejoin'):
+                cursor.execute(f'SET LOCAL {setting} = off')
+
+    def assertIndexed(self, queryset):
+        plans = json.loads(queryset.explain(format='json'))
+        scans = [name for plan in plans for name in _full_scans(plan['Plan'])]
+        if scans:
+            # Empty partitions cost nothing to scan, whichever index the planner picks.
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT relname FROM pg_class WHERE relname = ANY(%s) AND relpages > 0', [scans])
+                scans = sorted(row[0] for row in cursor.fetchall())
+        self.assertEqual(scans, [], f'full scan in plan for: {queryset.query}')
+
+    def test_auto_close_single_activities(self):
+        self.assertIndexed(
+            Activity.objects.filter(repeat_type='none', is_active=True, end_time__lt=timezone.now())
+        )
+
+    def test_auto_close_repeating_activities(self):
+        start_of_today = timezone.make_aware(datetime.combine(timezone.localdate(), dt_time.min))
+        self.assertIndexed(
+            Activity.objects.filter(is_active=True)
+            .exclude(repeat_type='none')
+            .filter(end_time__isnull=False, end_time__lt=start_of_today)
+        )
+
+    def test_activity_list_page(self):
+        self.assertIndexed(Activity.objects.order_by('-start_time').select_related('created_by')[:10])
+
+    def test_user_list_page(self):
+        self.assertIndexed(User.objects.order_by('-created_at')[:10])
+
+    def test_stats_checkins_without_test_users(self):
+        self.assertIndexed(sharding.checkins_with_users(self.activity))
+
+    def test_stats_status_breakdown(self):
+        self.assertIndexed(self.activity.checkin_records().filter(status=CheckInRecord.CheckInStatus.PRESENT))
+
+    def test_stats_participants_without_test_users(self):
+        self.assertIndexed(sharding.participants(self.activity).exclude(is_test=True))
+
+    def test_test_account_ids(self):
+        self.assertIndexed(User.objects.filter(is_test=True).values_list('id', flat=True))
+
+    def test_dashboard_activities(self):
+        self.assertIndexed(
+            Activity.objects.filter(id__in=sharding.user_activity_ids(self.user), is_active=True)
+        )
+
+    def test_user_checkin_lookup(self):
+        self.assertIndexed(self.activity.checkin_records().filter(user=self.user))
+
+
+class CheckInViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Query budgets for every view in checkin.urls; they must not grow with the data."""
+
+    size = SMALL
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(cls.size)
+
+    def setUp(self):
+        self.client.force_login(self.data.member)
+
+    def test_dashboard(self):
+        response = self.assertQueryBudget(7, 'get', reverse('checkin:dashboard'))
+        self.assertEqual(len(response.context['activities']), self.size.activities)
+
+    def test_dashboard_test_user(self):
+        self.client.force_login(self.data.tester)
+        self.assertQueryBudget(7, 'get', reverse('checkin:dashboard'))
+
+    def test_checkin(self):
+        response = self.assertQueryBudget(8, 'post', reverse('checkin:checkin_api', args=[self.data.activity.id]))
+        self.assertTrue(response.json()['success'])
+
+    def test_checkin_repeated(self):
+        self.client.force_login(self.data.members[1])
+        response = self.assertQueryBudget(7, 'post', reverse('checkin:checkin_api', args=[self.data.activity.id]))
+        self.assertFalse(response.json()['success'])
+
+    def test_reset(self):
+        self.client.force_login(self.data.tester)
+        response = self.assertQueryBudget(6, 'post', reverse('checkin:reset_api', args=[self.data.activity.id]))
+        self.assertTrue(response.json()['success'])
+
+    def test_qr_presenter(self):
+        self.client.force_login(self.data.admin)
+        self.assertQueryBudget(7, 'get', reverse('checkin:qr_presenter', args=[self.data.qr_activity.id]))
+
+    def test_qr_image(self):
+        self.client.force_login(self.data.admin)
+        response = self.assertQueryBudget(6, 'get', reverse('checkin:qr_image', args=[self.data.qr_activity.id]))
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+    def test_qr_scan(self):
+        self.assertQueryBudget(6, 'get', reverse('checkin:qr_scan', args=[self.data.qr_activity.id]))
+
+
+class CheckInViewQueryBudgetLargeTests(CheckInViewQueryBudgetTests):
+    size = LARGE
+
+    @tag('timing')
+    def test_dashboard_render_time(self):
+        with self.assertFasterThan(1.0, 'checkin dashboard'):
+            self.client.get(reverse('checkin:dashboard'))
+
+    def test_dashboard_fragments_are_cache_hits(self):
+        """A warm dashboard serves every card and the script from the fragment cache."""
+        self.client.force_login(self.data.tester)  # sees every activity
+        url = reverse('checkin:dashboard')
+        backend = caches['default']
+
+        def stored_fragments():
+            with mock.patch.object(backend, 'set', wraps=backend.set) as spy:
+                self.client.get(url)
+            return [call.args[0] for call in spy.call_args_list if call.args[0].startswith('template.cache.')]
+
+        cache.clear()
+        self.assertEqual(len(stored_fragments()), len(self.data.activities) + 1)
+        self.assertEqual(stored_fragments(), [])
+
+
+class DashboardFragmentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client.force_login(self.data.member)
+        self.url = reverse('checkin:dashboard')
+
+    def test_cards_follow_activity_version(self):
+        activity = self.data.activity
+        self.assertContains(self.client.get(self.url), activity.name)
+
+        # A queryset update does not bump the version, so the cached card is served
+        Activity.objects.filter(pk=activity.pk).update(name='Renamed activity')
+        self.assertNotContains(self.client.get(self.url), 'Renamed activity')
+
+        activity.refresh_from_db()
+        activity.save()
+        self.assertContains(self.client.get(self.url), 'Renamed activity')
+
+    def test_cards_follow_checkin_state(self):
+        def badges():
+            return self.client.get(self.url).content.decode().count('badge bg-success')
+
+        activity = self.data.activities[-1]
+        activity.checkins.filter(user=self.data.member).delete()
+        before = badges()
+        activity.checkins.create(user=self.data.member)
+        self.assertEqual(badges(), before + 1)
+
+    def test_forms_are_not_cached(self):
+        def tokens(client):
+            html = client.get(self.url).content.decode()
+            return set(re.findall(r'name="csrfmiddlewaretoken" value="([^"]+)"', html))
+
+        first = tokens(self.client)
+        other = Client()
+        other.force_login(self.data.member)
+        second = tokens(other)
+        self.assertTrue(first and second)
+        self.assertFalse(first & second)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncCheckInAPITests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def url(self, activity):
+        return reverse('async_checkin_api', args=[activity.id])
+
+    async def test_checkin_once(self):
+        member = self.data.members[0]
+        await self.async_client.aforce_login(member)
+        response = await self.async_client.post(self.url(self.data.activity), headers={'User-Agent': 'bench'})
+        self.assertEqual(response.json(), {'success': True, 'message': '签到成功'})
+        record = await CheckInRecord.objects.aget(activity=self.data.activity, user=member)
+        self.assertEqual(record.user_agent, 'bench')
+
+        response = await self.async_client.post(self.url(self.data.activity))
+        self.assertFalse(response.json()['success'])
+
+    async def test_same_rules_as_sync_view(self):
+        await self.async_client.aforce_login(self.data.members[0])
+        location = self.data.activities[2]
+        response = await self.async_client.post(self.url(location), {'lat': '0', 'lng': '0'})
+        self.assertEqual(response.json()['error'], '不在签到范围内')
+        response = await self.async_client.post(self.url(self.data.qr_activity), {'qr_token': 'stale'})
+        self.assertEqual(response.json()['error'], '二维码已过期或无效')
+
+        await self.async_client.aforce_login(self.data.tester)
+        for _ in range(2):
+            response = await self.async_client.post(self.url(self.data.activity))
+            self.assertTrue(response.json()['success'])
+        self.assertEqual(await self.data.activity.checkin_records().filter(user=self.data.tester).acount(), 1)
+
+    async def test_anonymous_is_redirected_to_login(self):
+        response = await self.async_client.post(self.url(self.data.activity))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/auth/login/', response['Location'])
+
+
+class MembershipCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        membership.clear()
+        self.addCleanup(membership.clear)
+
+    def fresh(self):
+        return Activity.objects.get(pk=self.data.activity.pk)
+
+    def test_checkin_answers_eligibility_from_memory(self):
+        url = reverse('checkin:checkin_api', args=[self.data.activity.id])
+        self.client.force_login(self.data.members[0])
+        self.assertTrue(self.client.post(url).json()['success'])
+
+        self.client.force_login(self.data.members[2])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.client.post(url).json()['success'])
+        self.assertFalse([q for q in queries if 'activityparticipation' in q['sql']])
+
+        self.client.force_login(self.data.admin)  # not a participant
+        self.assertEqual(self.client.post(url).json()['error'], '您无权参与此活动')
+
+    def test_participant_changes_invalidate(self):
+        member = self.data.members[0]
+        self.assertTrue(membership.is_member(self.fresh(), member.pk))
+
+        participation = self.data.activity.activityparticipation_set.get(user=member)
+        participation.can_participate = False
+        with self.captureOnCommitCallbacks(execute=True):
+            participation.save()
+        self.assertFalse(membership.is_member(self.fresh(), member.pk))
+
+        # The edit view deletes removed participants, then adds the new list.
+        participation.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            sharding.add_participants(self.data.activity, [member.pk, self.data.admin.pk])
+        activity = self.fresh()
+        self.assertTrue(membership.is_member(activity, member.pk))
+        self.assertTrue(membership.is_member(activity, self.data.admin.pk))
+
+    def test_other_process_sees_change_through_updated_at(self):
+        member = self.data.members[0]
+        stale = self.fresh()
+        self.assertTrue(membership.is_member(stale, member.pk))
+        # Another worker removed the participant: its touch() bumped updated_at in the database.
+        ActivityParticipation.objects.filter(activity=stale, user=member).update(can_participate=False)
+        Activity.objects.filter(pk=stale.pk).update(updated_at=timezone.now())
+        self.assertTrue(membership.is_member(stale, member.pk))
+        self.assertFalse(membership.is_member(self.fresh(), member.pk))
+
+    async def test_async_lookup(self):
+        activity = await Activity.objects.aget(pk=self.data.activity.pk)
+        self.assertTrue(await membership.ais_member(activity, self.data.members[0].pk))
+        self.assertFalse(await membership.ais_member(activity, self.data.admin.pk))
+
+
+class PrewarmTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+        now = timezone.now()
+        admin = cls.data.admin
+
+        def create(name, start, end, **extra):
+            activity = Activity.objects.create(name=name, start_time=start, end_time=end, created_by=admin, **extra)
+            sharding.add_participants(activity, [cls.data.member.pk])
+            return activity
+
+        cls.soon = create('Soon', now + timedelta(seconds=60), now + timedelta(hours=1))
+        cls.later = create('Later', now + timedelta(hours=3), now + timedelta(hours=4))
+        cls.ended = create('Ended', now - timedelta(hours=2), now - timedelta(minutes=1))
+        cls.closed = create('Closed', now + timedelta(seconds=30), now + timedelta(hours=1), is_active=False)
+        # is_open_for() reads the window on the datetime it is given (UTC here).
+        window_start = (now + timedelta(seconds=90)).time()
+        cls.daily = create(
+            'Daily', now - timedelta(days=3), now + timedelta(days=3),
+            repeat_type='daily', window_start_time=window_start,
+            window_end_time=(datetime.combine(now.date(), window_start) + timedelta(minutes=10)).time(),
+        )
+
+    def setUp(self):
+        membership.clear()
+        self.addCleanup(membership.clear)
+
+    def test_upcoming_activities(self):
+        names = {activity.name for activity in prewarm.upcoming(lead=timedelta(minutes=2))}
+        self.assertIn('Soon', names)
+        self.assertIn('Daily', names)
+        self.assertIn(self.data.activity.name, names)  # already open
+        self.assertNotIn('Later', names)
+        self.assertNotIn('Ended', names)
+        self.assertNotIn('Closed', names)
+
+    def test_warm_loads_membership(self):
+        self.assertGreaterEqual(prewarm.warm(), 2)
+        activity = Activity.objects.get(pk=self.soon.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(membership.is_member(activity, self.data.member.pk))
+            self.assertFalse(membership.is_member(activity, self.data.admin.pk))
+
+
+class GeofenceTests(TestCase):
+    # Shanghai; 0.001 degrees of latitude is about 111 m.
+    CAMPUS = [
+        {'lat': 31.23, 'lng': 121.47, 'radius_m': 150},
+        # An L-shaped hall east of the circle
+        {'polygon': [[31.2300, 121.4720], [31.2300, 121.4760], [31.2310, 121.4760],
+                     [31.2310, 121.4730], [31.2330, 121.4730], [31.2330, 121.4720]]},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        self.fence = geofence.compile_shapes(geofence.parse_shapes(self.CAMPUS))
+
+    def test_circle_matches_haversine(self):
+        from .management.commands.bench_geofence import haversine_within
+
+        circle = geofence.compile_shapes(self.CAMPUS[:1])
+        for metres in (0, 100, 149, 151, 300):
+            for bearing in (0, 45, 90, 200):
+                dlat = metres * math.cos(math.radians(bearing)) / geofence.METRES_PER_DEGREE
+                dlng = metres * math.sin(math.radians(bearing)) / (geofence.METRES_PER_DEGREE * math.cos(math.radians(31.23)))
+                point = (31.23 + dlat, 121.47 + dlng)
+                with self.subTest(metres=metres, bearing=bearing):
+                    self.assertEqual(circle.contains(*point), haversine_within(*point))
+
+    def test_polygon(self):
+        self.assertTrue(self.fence.contains(31.2305, 121.4750))  # foot of the L
+        self.assertTrue(self.fence.contains(31.2325, 121.4725))  # upright of the L
+        self.assertFalse(self.fence.contains(31.2325, 121.4750))  # inside the box, outside the L
+        self.assertFalse(self.fence.contains(39.9, 116.4))
+
+    def test_contains_many(self):
+        rng = random.Random(0)
+        lats = [31.231 + rng.uniform(-0.004, 0.004) for _ in range(500)]
+        lngs = [121.473 + rng.uniform(-0.006, 0.006) for _ in range(500)]
+        expected = [self.fence.contains(lat, lng) for lat, lng in zip(lats, lngs)]
+        self.assertTrue(any(expected) and not all(expected))
+        self.assertEqual([bool(v) for v in geofence.contains_many(self.fence, lats, lngs)], expected)
+        with mock.patch.object(geofence, 'np', None):
+            self.assertEqual(geofence.contains_many(self.fence, lats, lngs), expected)
+
+    def test_parse_shapes(self):
+        self.assertEqual(geofence.parse_shapes(None), [])
+        self.assertEqual(geofence.parse_shapes([{'lat': 1, 'lng': 2, 'radius_m': 3}]), [{'lat': 1.0, 'lng': 2.0, 'radius_m': 3.0}])
+        for bad in ({}, [{'lat': 1}], [{'lat': 1, 'lng': 2, 'radius_m': 0}], [{'lat': 91, 'lng': 2, 'radius_m': 3}],
+                    [{'polygon': [[0, 0], [0, 1]]}], [{'polygon': [[0, 0], [0, 1], ['a', 1]]}], [{'lat': True, 'lng': 2, 'radius_m': 3}]):
+            with self.subTest(bad=bad), self.assertRaises(ValueError):
+                geofence.parse_shapes(bad)
+
+    def test_checkin_inside_extra_shape(self):
+        location = self.data.activities[2]  # a 500 m circle at (31.23, 121.47)
+        Activity.objects.filter(pk=location.pk).update(location_fences=[{'lat': 31.30, 'lng': 121.50, 'radius_m': 200}])
+        self.client.force_login(self.data.members[2])
+        url = reverse('checkin:checkin_api', args=[location.id])
+        self.assertEqual(self.client.post(url, {'lat': '31.40', 'lng': '121.50'}).json()['error'], '不在签到范围内')
+        self.assertTrue(self.client.post(url, {'lat': '31.3005', 'lng': '121.5005'}).json()['success'])
+
+    def test_outside_checkins(self):
+        location = self.data.activities[2]
+        near, far = location.checkin_records().order_by('id')[:2]
+        CheckInRecord.objects.filter(pk=near.pk).update(latitude=31.2301, longitude=121.4701)
+        CheckInRecord.objects.filter(pk=far.pk).update(latitude=31.2330, longitude=121.4700)
+        self.assertEqual(geofence.outside_checkins(location), [])
+        location.location_radius_m = 100
+        self.assertEqual(geofence.outside_checkins(location), [far.pk])
+        location.location_enabled = False
+        self.assertEqual(geofence.outside_checkins(location), [])
+
+
+class BatchCheckInTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        membership.clear()
+        self.addCleanup(membership.clear)
+        self.activity = self.data.activity
+        self.url = reverse('checkin:batch_api', args=[self.activity.id])
+        self.client.force_login(self.data.admin)
+
+    def post(self, entries, **kwargs):
+        return self.client.post(self.url, json.dumps({'entries': entries}), content_type='application/json', **kwargs)
+
+    def test_per_entry_results(self):
+        members = self.data.members
+        now = timezone.now()
+        entries = [
+            {'username': members[0].username, 'time': (now - timedelta(minutes=5)).isoformat()},
+            {'username': members[1].username},  # checked in by the fixture
+            {'user_id': members[2].pk},
+            {'username': members[0].username},
+            {'username': 'nobody'},
+            {'username': self.data.admin.username},
+            {'user_id': members[4].pk, 'time': (now - timedelta(hours=3)).isoformat()},
+            {'user_id': members[4].pk, 'time': (now + timedelta(hours=1)).isoformat()},
+            {'user_id': members[4].pk, 'time': 'yesterday'},
+            'junk',
+        ]
+        response = self.post(entries)
+        body = response.json()
+        self.assertEqual(body['created'], 2)
+        self.assertEqual(
+            [(r['result'], r.get('error')) for r in body['results']],
+            [
+                ('created', None),
+                ('exists', None),
+                ('created', None),
+                ('exists', None),
+                ('error', '用户不存在'),
+                ('error', '该用户不在活动参与名单中'),
+                ('error', '活动不在开放时间'),
+                ('error', '无效的签到时间'),
+                ('error', '无效的签到时间'),
+                ('error', '无效的条目'),
+            ],
+        )
+        self.assertEqual(body['results'][2]['user_id'], members[2].pk)
+        record = CheckInRecord.objects.get(activity=self.activity, user=members[0])
+        self.assertEqual(record.checkin_time, now - timedelta(minutes=5))
+        self.assertTrue(CheckInRecord.objects.filter(activity=self.activity, user=members[2]).exists())
+
+    def test_lost_race_reports_exists(self):
+        members = self.data.members
+        # The lookup misses members[1]'s check-in, as if it was made concurrently.
+        def everyone(activity, alias, by_user):
+            return list(by_user.values())
+
+        with mock.patch.object(batch, '_fresh_records', side_effect=everyone):
+            body = self.post([{'user_id': members[1].pk}, {'user_id': members[2].pk}]).json()
+        self.assertEqual([r['result'] for r in body['results']], ['exists', 'created'])
+        self.assertEqual(CheckInRecord.objects.filter(activity=self.activity, user=members[1]).count(), 1)
+        self.assertTrue(CheckInRecord.objects.filter(activity=self.activity, user=members[2]).exists())
+
+    def test_invalid_user_ids_are_not_queried(self):
+        entries = [{'user_id': 2**63}, {'user_id': -1}, {'user_id': '5'}, {'user_id': 1.5}, {'user_id': True}]
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(batch._resolve_users(entries), {})
+        self.assertEqual(len(ctx.captured_queries), 0)
+        body = self.post(entries).json()
+        self.assertEqual({(r['result'], r['error']) for r in body['results']}, {('error', '无效的条目')})
+
+    def test_times_before_the_checkin_floor_are_rejected(self):
+        now = timezone.now()
+        entry = {'user_id': self.data.members[2].pk, 'time': (now - timedelta(minutes=5)).isoformat()}
+        with mock.patch.object(Activity, 'checkin_time_floor', return_value=now - timedelta(minutes=1)):
+            body = self.post([entry]).json()
+        self.assertEqual(body['results'][0]['error'], '无效的签到时间')
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        def queries(users):
+            with CaptureQueriesContext(connection) as ctx:
+                body = self.post([{'user_id': user.pk} for user in users]).json()
+            self.assertTrue(all(r['result'] == 'created' for r in body['results']))
+            return len(ctx.captured_queries)
+
+        membership.load(self.activity)
+        self.assertEqual(queries(self.data.members[0:1]), queries(self.data.members[2:5:2]))
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.client.post(self.url, 'not json', content_type='application/json').status_code, 400)
+        self.assertEqual(self.post({'username': 'x'}).status_code, 400)
+        with override_settings(CHECKIN_BATCH_MAX_ENTRIES=1):
+            self.assertEqual(self.post([{'user_id': 1}, {'user_id': 2}]).status_code, 400)
+
+    def test_presenters_only(self):
+        self.client.force_login(self.data.member)
+        self.assertEqual(self.post([{'user_id': self.data.member.pk}]).status_code, 403)
+        self.assertFalse(CheckInRecord.objects.filter(activity=self.activity, user=self.data.member).exists())
+
+
+class QRTokenTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        qrtoken.clear()
+        self.addCleanup(qrtoken.clear)
+        self.activity = self.data.qr_activity
+        self.interval = qrtoken.interval_of(self.activity)
+        self.now = timezone.now()
+
+    def ago(self, slots):
+        return self.now - timedelta(seconds=self.interval * slots)
+
+    def test_current_and_previous_slot(self):
+        token = qrtoken.issue(self.activity, self.now)
+        self.assertEqual(token, self.activity.current_qr_token(self.now))
+        self.assertTrue(qrtoken.verify(self.activity, token, self.now))
+        self.assertTrue(qrtoken.verify(self.activity, qrtoken.issue(self.activity, self.ago(1)), self.now))
+        self.assertFalse(qrtoken.verify(self.activity, qrtoken.issue(self.activity, self.ago(2)), self.now))
+        # Not valid before its slot either.
+        self.assertFalse(qrtoken.verify(self.activity, token, self.ago(1)))
+        with override_settings(CHECKIN_QR_PREVIOUS_SLOTS=0):
+            self.assertFalse(qrtoken.verify(self.activity, qrtoken.issue(self.activity, self.ago(1)), self.now))
+
+    def test_rejects_forged_and_malformed_tokens(self):
+        token = qrtoken.issue(self.activity, self.now)
+        forged = token[:-1] + ('0' if token[-1] != '0' else '1')
+        other = Activity.objects.get(pk=self.activity.pk)
+        other.pk = self.data.activity.pk
+        for bad in (forged, qrtoken.issue(other, self.now), None, '', 'stale', token + '0', token.upper(), token[:-1] + 'é'):
+            self.assertFalse(qrtoken.verify(self.activity, bad, self.now), bad)
+            self.assertNotEqual(qrtoken.verify_token(bad, self.now), self.activity.pk)
+
+        Activity.objects.filter(pk=self.activity.pk).update(qr_enabled=False)
+        self.activity.refresh_from_db()
+        self.assertFalse(qrtoken.verify(self.activity, token, self.now))
+
+    def test_verify_token_alone(self):
+        token = qrtoken.issue(self.activity, self.now)
+        qrtoken.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(qrtoken.verify_token(token, self.now), self.activity.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(qrtoken.verify_token(token, self.now), self.activity.pk)
+
+    def test_rotated_secret_rejects_old_tokens(self):
+        token = qrtoken.issue(self.activity, self.now)
+        self.activity.qr_secret = generate_qr_secret()
+        self.activity.save(update_fields=['qr_secret'])
+        self.assertFalse(qrtoken.verify(self.activity, token, self.now))
+        self.assertTrue(qrtoken.verify(self.activity, qrtoken.issue(self.activity, self.now), self.now))
+        self.assertIsNone(qrtoken.verify_token(token, self.now))
+
+    def test_admin_forgets_a_rotated_secret(self):
+        token = qrtoken.issue(self.activity, self.now)
+        self.activity.qr_secret = generate_qr_secret()
+        form = mock.Mock(changed_data=['qr_secret'])
+        ActivityAdmin(Activity, admin.site).save_model(None, self.activity, form, change=True)
+        self.assertIsNone(qrtoken.verify_token(token, self.now))
+
+    def test_memo_is_bounded(self):
+        with override_settings(CHECKIN_QR_TOKEN_CACHE_SIZE=2):
+            for slots in range(4):
+                qrtoken.issue(self.activity, self.ago(slots))
+            self.assertEqual(len(qrtoken._macs), 2)
+
+    def test_checkin_with_previous_slot_token(self):
+        member = self.data.members[2]
+        self.client.force_login(member)
+        token = qrtoken.issue(self.activity, self.now - timedelta(seconds=self.interval))
+        response = self.client.post(reverse('checkin:checkin_api', args=[self.activity.id]), {'qr_token': token})
+        self.assertEqual(response.json(), {'success': True, 'message': '签到成功'})
+
+    def test_prewarm_memoizes_tokens(self):
+        prewarm.warm(self.now)
+        token = qrtoken.issue(self.activity, self.now)
+        with self.assertNumQueries(0):
+            self.assertEqual(qrtoken.verify_token(token, self.now), self.activity.pk)
+
+
+class CollectCheckInTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        membership.clear()
+        collect.clear()
+        self.addCleanup(membership.clear)
+        self.addCleanup(collect.clear)
+        self.activity = self.data.activity
+        self.url = reverse('checkin:collect_api', args=[self.activity.id])
+        self.client.force_login(self.data.admin)
+        self.now = timezone.now()
+
+    def post(self, codes):
+        return self.client.post(self.url, json.dumps({'codes': codes}), content_type='application/json')
+
+    def test_personal_codes_are_stateless_and_rotate(self):
+        user_id = self.data.member.pk
+        interval = qrtoken.personal_interval()
+        code = qrtoken.issue_personal(user_id, self.now)
+        with self.assertNumQueries(0):
+            self.assertEqual(qrtoken.verify_personal(code, self.now), user_id)
+        previous = qrtoken.issue_personal(user_id, self.now - timedelta(seconds=interval))
+        self.assertEqual(qrtoken.verify_personal(previous, self.now), user_id)
+        stale = qrtoken.issue_personal(user_id, self.now - timedelta(seconds=interval * 2))
+        forged = code.replace(f'u.{user_id}.', f'u.{self.data.members[2].pk}.')
+        for bad in (stale, forged, code[:-1] + ('0' if code[-1] != '0' else '1'), None, '', qrtoken.issue(self.data.qr_activity, self.now)):
+            self.assertIsNone(qrtoken.verify_personal(bad, self.now), bad)
+
+    def test_collect_results(self):
+        members = self.data.members
+        codes = [
+            qrtoken.issue_personal(members[0].pk, self.now),
+            qrtoken.issue_personal(members[1].pk, self.now),  # checked in by the fixture
+            qrtoken.issue_personal(members[0].pk, self.now - timedelta(seconds=qrtoken.personal_interval())),
+            qrtoken.issue_personal(self.data.admin.pk, self.now),
+            'u.1.2.3',
+            42,
+        ]
+        body = self.post(codes).json()
+        self.assertEqual(body['created'], 1)
+        self.assertEqual(
+            [(r['result'], r.get('error')) for r in body['results']],
+            [
+                ('created', None),
+                ('exists', None),
+                ('exists', None),
+                ('error', '该用户不在活动参与名单中'),
+                ('error', '签到码已过期或无效'),
+                ('error', '签到码已过期或无效'),
+            ],
+        )
+        self.assertEqual(body['results'][0]['name'], members[0].first_name or members[0].username)
+        self.assertTrue(CheckInRecord.objects.filter(activity=self.activity, user=members[0]).exists())
+
+    def test_answered_users_are_remembered(self):
+        member = self.data.members[2]
+        self.assertEqual(self.post([qrtoken.issue_personal(member.pk, self.now)]).json()['created'], 1)
+        code = qrtoken.issue_personal(member.pk, self.now)
+        with CaptureQueriesContext(connection) as ctx:
+            body = self.post([code]).json()
+        self.assertEqual(body['results'][0]['result'], 'exists')
+        table = f'"{CheckInRecord._meta.db_table}"'
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if table in q['sql']])
+
+        with override_settings(CHECKIN_COLLECT_SEEN_SIZE=1):
+            collect._remember(self.activity.pk, {1: 'a', 2: 'b'})
+            self.assertEqual(list(collect._seen), [(self.activity.pk, 2)])
+
+    def test_presenters_only(self):
+        self.assertEqual(self.client.get(reverse('checkin:qr_collect', args=[self.activity.id])).status_code, 200)
+        self.client.force_login(self.data.member)
+        self.assertEqual(self.client.get(reverse('checkin:personal_code')).status_code, 200)
+        self.assertEqual(self.post([qrtoken.issue_personal(self.data.member.pk, self.now)]).status_code, 403)
+        self.assertEqual(self.client.get(reverse('checkin:qr_collect', args=[self.activity.id])).status_code, 403)
+        response = self.client.get(reverse('checkin:personal_code_image'))
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+
+class OfflineSyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        membership.clear()
+        qrtoken.clear()
+        self.addCleanup(membership.clear)
+        self.addCleanup(qrtoken.clear)
+        self.member = self.data.member
+        self.activity = self.data.activity
+        self.client.force_login(self.member)
+        self.now = timezone.now()
+        self.issued = self.now - timedelta(minutes=20)
+
+    def ticket(self, activity=None, user=None):
+        return offline.issue_ticket((user or self.member).pk, (activity or self.activity).pk, self.issued)
+
+    def sync(self, attempts, sent_at=None):
+        body = {'attempts': attempts}
+        if sent_at:
+            body['sent_at'] = sent_at.isoformat()
+        return self.client.post(reverse('checkin:sync_api'), json.dumps(body), content_type='application/json')
+
+    def test_recorded_time_with_device_clock_corrected(self):
+        skew = timedelta(hours=3)  # the phone's clock runs three hours late
+        when = self.now - timedelta(minutes=10)
+        body = self.sync([{'ticket': self.ticket(), 'time': (when - skew).isoformat()}], sent_at=self.now - skew).json()
+        self.assertEqual(body['results'], [{'activity_id': self.activity.pk, 'result': 'created'}])
+        record = CheckInRecord.objects.get(activity=self.activity, user=self.member)
+        self.assertAlmostEqual(record.checkin_time.timestamp(), when.timestamp(), delta=5)
+        self.assertEqual(self.sync([{'ticket': self.ticket(), 'time': when.isoformat()}]).json()['results'][0]['result'], 'exists')
+
+    def test_rejected_attempts(self):
+        ticket = self.ticket()
+        Activity.objects.filter(pk=self.data.activities[2].pk).update(is_active=False)
+        attempts = [
+            {'ticket': ticket[:-1] + ('A' if ticket[-1] != 'A' else 'B'), 'time': self.now.isoformat()},
+            {'ticket': self.ticket(user=self.data.members[2]), 'time': self.now.isoformat()},
+            {'ticket': ticket, 'time': (self.issued - timedelta(minutes=10)).isoformat()},
+            {'ticket': ticket, 'time': (self.now + timedelta(minutes=10)).isoformat()},
+            {'ticket': ticket},
+            {'ticket': self.ticket(self.data.activities[2]), 'time': self.now.isoformat()},
+            {'ticket': self.ticket(self.data.qr_activity), 'time': self.now.isoformat(), 'qr_token': 'stale'},
+            'junk',
+        ]
+        body = self.sync(attempts).json()
+        self.assertEqual(body['created'], 0)
+        self.assertEqual(
+            [r.get('error') for r in body['results']],
+            ['无效的离线签到凭证', '无效的离线签到凭证', '无效的签到时间', '无效的签到时间', '无效的签到时间',
+             '活动不存在或已停用', '二维码已过期或无效', '无效的离线签到凭证'],
+        )
+        with override_settings(CHECKIN_OFFLINE_TICKET_SECONDS=600):
+            body = self.sync([{'ticket': ticket, 'time': self.now.isoformat()}]).json()
+        self.assertEqual(body['results'][0]['error'], '无效的签到时间')
+        self.assertFalse(CheckInRecord.objects.filter(user=self.member).exists())
+
+    def test_late_sync_far_from_the_ticket_is_rejected(self):
+        end = self.now - timedelta(minutes=5)
+        Activity.objects.filter(pk=self.activity.pk).update(end_time=end)
+        self.issued = self.activity.start_time + timedelta(minutes=1)
+        # Posted after the end, for a time inside the window but long after the ticket
+        body = self.sync([{'ticket': self.ticket(), 'time': (end - timedelta(minutes=2)).isoformat()}]).json()
+        self.assertEqual(body['results'][0]['error'], '无效的签到时间')
+        body = self.sync([{'ticket': self.ticket(), 'time': (self.issued + timedelta(minutes=10)).isoformat()}]).json()
+        self.assertEqual(body['results'][0]['result'], 'created')
+
+    def test_sync_after_the_activity_was_auto_closed(self):
+        end = self.now - timedelta(minutes=5)
+        Activity.objects.filter(pk=self.activity.pk).update(end_time=end)
+        manager = Client()
+        manager.force_login(self.data.admin)
+        manager.get(reverse('management:activity_list'))  # ActivityAutoCloseMiddleware runs on /manage/
+        self.activity.refresh_from_db()
+        self.assertFalse(self.activity.is_active)
+        body = self.sync([{'ticket': self.ticket(), 'time': (self.issued + timedelta(minutes=10)).isoformat()}]).json()
+        self.assertEqual(body['results'], [{'activity_id': self.activity.pk, 'result': 'created'}])
+
+    @override_settings(CHECKIN_OFFLINE_TICKET_SECONDS=6 * 3600)
+    def test_ticket_lifetime_is_capped_at_the_window_length(self):
+        start = self.now - timedelta(minutes=20)
+        Activity.objects.filter(pk=self.activity.pk).update(start_time=start, end_time=self.now + timedelta(minutes=10))
+        when = (self.now - timedelta(minutes=5)).isoformat()
+        # Issued on a page loaded two hours before the 30-minute window opened
+        self.issued = start - timedelta(hours=2)
+        self.assertEqual(self.sync([{'ticket': self.ticket(), 'time': when}]).json()['results'][0]['error'], '无效的签到时间')
+        self.issued = start - timedelta(minutes=10)
+        self.assertEqual(self.sync([{'ticket': self.ticket(), 'time': when}]).json()['results'][0]['result'], 'created')
+
+    def test_window_length(self):
+        self.assertEqual(offline.window_length(self.activity), self.activity.end_time - self.activity.start_time)
+        daily = Activity(repeat_type='daily', window_start_time=dt_time(23, 0), window_end_time=dt_time(1, 0))
+        self.assertEqual(offline.window_length(daily), timedelta(hours=2))
+        daily.window_start_time, daily.window_end_time = dt_time(8, 0), dt_time(9, 30)
+        self.assertEqual(offline.window_length(daily), timedelta(minutes=90))
+
+    def test_window_and_qr_slot_at_recorded_time(self):
+        end = self.now - timedelta(minutes=5)
+        Activity.objects.filter(pk__in=[self.activity.pk, self.data.qr_activity.pk]).update(end_time=end)
+        qr_activity = Activity.objects.get(pk=self.data.qr_activity.pk)
+        scanned = end - timedelta(minutes=2)
+        attempts = [
+            # Just after the end, within the tolerance: recorded at the edge of the window.
+            {'ticket': self.ticket(), 'time': (end + timedelta(seconds=30)).isoformat()},
+            {'ticket': self.ticket(qr_activity), 'time': scanned.isoformat(), 'qr_token': qrtoken.issue(qr_activity, scanned)},
+        ]
+        body = self.sync(attempts).json()
+        self.assertEqual([r['result'] for r in body['results']], ['created', 'created'])
+        record = CheckInRecord.objects.get(activity=self.activity, user=self.member)
+        self.assertLessEqual(record.checkin_time, end)
+
+        CheckInRecord.objects.filter(user=self.member).delete()
+        attempts = [
+            {'ticket': self.ticket(), 'time': (end + timedelta(minutes=4)).isoformat()},
+            # A token of the slot before the ticket's page was even loaded.
+            {'ticket': self.ticket(qr_activity), 'time': scanned.isoformat(), 'qr_token': qrtoken.issue(qr_activity, self.issued - timedelta(minutes=10))},
+        ]
+        self.assertEqual(
+            [r.get('error') for r in self.sync(attempts).json()['results']],
+            ['活动不在开放时间', '二维码已过期或无效'],
+        )
+
+    def test_pages_carry_tickets(self):
+        response = self.client.get(reverse('checkin:dashboard'))
+        tickets = re.findall(r'data-offline-ticket="([^"]+)"', response.content.decode())
+        self.assertIn(self.activity.pk, {offline.read_ticket(ticket, self.member.pk)[0] for ticket in tickets})
+        self.assertIsNone(offline.read_ticket(tickets[0], self.data.members[2].pk))
+
+
+@override_settings(ROOT_URLCONF=__name__, RATELIMITS={'checkin:user': '2/m', 'checkin:ip': '', 'checkin:activity': ''})
+class CheckInRateLimitTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_user_bucket(self):
+        self.client.force_login(self.data.tester)  # test users may check in again and again
+        url = reverse('checkin:checkin_api', args=[self.data.activity.id])
+        for _ in range(2):
+            self.assertTrue(self.client.post(url).json()['success'])
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['error'], '请求过于频繁，请稍后再试')
+        self.assertEqual(response['Retry-After'], '30')
+
+        self.client.force_login(self.data.member)
+        self.assertTrue(self.client.post(url).json()['success'])
+
+    async def test_async_view(self):
+        await self.async_client.aforce_login(self.data.tester)
+        url = reverse('async_checkin_api', args=[self.data.activity.id])
+        statuses = [(await self.async_client.post(url)).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+
+@override_settings(ROOT_URLCONF=__name__, RATELIMITS={'checkin:user': '', 'checkin:ip': '', 'checkin:activity': ''})
+class IdempotencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.url = reverse('checkin:checkin_api', args=[self.data.activity.id])
+
+    def post(self, key, **kwargs):
+        return self.client.post(self.url, headers={'Idempotency-Key': key}, **kwargs)
+
+    def test_retry_is_replayed_without_checkin_queries(self):
+        member = self.data.member
+        self.client.force_login(member)
+        first = self.post('attempt-0001')
+        self.assertEqual(first.json(), {'success': True, 'message': '签到成功'})
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self.post('attempt-0001')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual((retry.status_code, retry.content), (200, first.content))
+        self.assertEqual([q['sql'] for q in ctx.captured_queries if '"checkin_' in q['sql']], [])
+        self.assertEqual(CheckInRecord.objects.filter(activity=self.data.activity, user=member).count(), 1)
+
+        # A new submission is checked again.
+        self.assertEqual(self.post('attempt-0002').json()['error'], '您已签到过此活动')
+
+    def test_keys_belong_to_one_user(self):
+        self.client.force_login(self.data.member)
+        self.assertTrue(self.post('shared-key').json()['success'])
+        self.client.force_login(self.data.members[2])
+        response = self.post('shared-key')
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertTrue(CheckInRecord.objects.filter(activity=self.data.activity, user=self.data.members[2]).exists())
+
+    def test_attempt_in_progress(self):
+        from core import idempotency
+
+        member = self.data.member
+        cache.add(idempotency.cache_key(member.pk, self.url, 'attempt-0001'), idempotency.IN_PROGRESS)
+        self.client.force_login(member)
+        response = self.post('attempt-0001')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(CheckInRecord.objects.filter(activity=self.data.activity, user=member).exists())
+
+    @override_settings(RATELIMITS={'checkin:user': '1/m', 'checkin:ip': '', 'checkin:activity': ''})
+    def test_throttled_answer_is_not_kept(self):
+        self.client.force_login(self.data.tester)
+        self.assertTrue(self.post('attempt-0001').json()['success'])
+        for _ in range(2):
+            response = self.post('attempt-0002')
+            self.assertEqual(response.status_code, 429)
+            self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_invalid_key(self):
+        self.client.force_login(self.data.member)
+        self.assertEqual(self.post('short').status_code, 400)
+        self.assertEqual(self.post('bad key with spaces').status_code, 400)
+        self.assertFalse(CheckInRecord.objects.filter(activity=self.data.activity, user=self.data.member).exists())
+
+    async def test_async_view(self):
+        await self.async_client.aforce_login(self.data.member)
+        url = reverse('async_checkin_api', args=[self.data.activity.id])
+        headers = {'Idempotency-Key': 'attempt-0001'}
+        first = await self.async_client.post(url, headers=headers)
+        retry = await self.async_client.post(url, headers=headers)
+        self.assertTrue(first.json()['success'])
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.content, first.content)
+
+
+class WriteBehindTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = Path(tmp.name)
+        self.buffer = ingest.WriteBehindBuffer(self.directory)
+        self.member = self.data.members[0]
+
+    def record(self, user, activity=None):
+        activity = activity or self.data.activity
+        return CheckInRecord(activity=activity, user=user, checkin_time=timezone.now(), ip_address='10.0.0.1')
+
+    def test_submit_journals_and_flush_inserts(self):
+        self.assertTrue(self.buffer.submit(self.record(self.member)))
+        self.assertFalse(self.buffer.submit(self.record(self.member)))
+        self.assertEqual(self.buffer.pending(), 1)
+        self.assertEqual(len(list(self.directory.glob('*.jsonl'))), 1)
+        self.assertFalse(CheckInRecord.objects.filter(activity=self.data.activity, user=self.member).exists())
+
+        self.assertEqual(self.buffer.flush(), 1)
+        record = CheckInRecord.objects.get(activity=self.data.activity, user=self.member)
+        self.assertEqual(record.ip_address, '10.0.0.1')
+        self.assertEqual(self.buffer.pending(), 0)
+        self.assertEqual(list(self.directory.glob('*.jsonl')), [])
+        # The claim is released once the row exists; a second flush has nothing to do.
+        self.assertIsNone(cache.get(ingest.dedupe_key(self.data.activity.id, self.member.id)))
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_flush_skips_rows_already_in_database(self):
+        already = self.data.members[1]  # odd members are checked in by the fixture
+        self.buffer.submit(self.record(already))
+        self.buffer.submit(self.record(self.member))
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(CheckInRecord.objects.filter(activity=self.data.activity, user=already).count(), 1)
+
+    def test_crashed_segment_is_replayed_once(self):
+        dead_pid = 2 ** 22 + 1  # above the default pid_max, so never a live process
+        records = [self.record(self.member), self.record(self.data.members[2])]
+        segment = self.directory / f'{dead_pid}-00000001.jsonl'
+        # The last line was torn by the crash and never acknowledged.
+        segment.write_text(''.join(ingest.to_line(r) for r in records) + '{"activity_id": 1, "us')
+        live = self.directory / f'{os.getppid()}-00000001.jsonl'
+        live.write_text(ingest.to_line(self.record(self.data.members[4])))
+
+        self.assertEqual(ingest.replay_orphans(self.directory), 2)
+        self.assertFalse(segment.exists())
+        self.assertTrue(live.exists())
+        self.assertEqual(
+            CheckInRecord.objects.filter(activity=self.data.activity, user__in=[r.user for r in records]).count(), 2
+        )
+
+        # Crash after the commit but before the segment was deleted: replay again.
+        segment.write_text(''.join(ingest.to_line(r) for r in records))
+        self.assertEqual(ingest.replay_orphans(self.directory), 0)
+        self.assertEqual(ingest.replay_orphans(self.directory, include_live=True), 1)
+
+    def test_api_acknowledges_before_insert(self):
+        client = Client()
+        client.force_login(self.member)
+        url = reverse('checkin:checkin_api', args=[self.data.activity.id])
+        with override_settings(CHECKIN_WRITE_BEHIND=True), mock.patch.object(ingest, 'get_buffer', return_value=self.buffer):
+            self.assertTrue(client.post(url).json()['success'])
+            self.assertEqual(client.post(url).json()['error'], '您已签到过此活动')
+            self.assertFalse(self.data.activity.checkin_records().filter(user=self.member).exists())
+            self.buffer.flush()
+            self.assertEqual(client.post(url).json()['error'], '您已签到过此活动')
+        self.assertTrue(self.data.activity.checkin_records().filter(user=self.member).exists())
+
+    def test_flush_is_one_batch(self):
+        users = User.objects.bulk_create(User(username=f'{30000000 + i}') for i in range(300))
+        buffer = ingest.WriteBehindBuffer(self.directory, fsync=False)
+        for user in users:
+            buffer.submit(self.record(user))
+        # One lookup of existing pairs, one each of the users and activities still there
+        # and one INSERT, however many check-ins are pending (plus the savepoint pair,
+        # as the test runs inside a transaction).
+        with self.assertNumQueries(6):
+            self.assertEqual(buffer.flush(), 300)
+
+    def test_flush_drops_check_ins_of_deleted_users(self):
+        user = User.objects.create_user('30000001')
+        buffer = ingest.WriteBehindBuffer(self.directory, fsync=False)
+        buffer.submit(self.record(user))
+        buffer.submit(self.record(self.member))
+        user.delete()
+        with self.assertLogs('neosign.ingest', 'WARNING'):
+            self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(buffer.pending(), 0)
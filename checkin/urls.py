@@ -1,21 +1,38 @@
+from django.conf import settings
 from django.urls import path
 
 from .views import (
+    AsyncCheckInAPIView,
+    BatchCheckInAPIView,
     CheckInAPIView,
+    CollectCheckInAPIView,
     CheckInDashboardView,
+    CheckInQRCollectView,
     CheckInQRImageView,
     CheckInQRPresenterView,
     CheckInQRScanView,
     CheckInResetAPIView,
+    OfflineSyncAPIView,
+    PersonalCodeImageView,
+    PersonalCodeView,
 )
 
 app_name = 'checkin'
 
+# The async view only pays off under ASGI; under WSGI Django would run it in a fresh event loop per request.
+checkin_api_view = AsyncCheckInAPIView if getattr(settings, 'CHECKIN_API_ASYNC', False) else CheckInAPIView
+
 urlpatterns = [
     path('', CheckInDashboardView.as_view(), name='dashboard'),
-    path('api/checkin/<int:activity_id>/', CheckInAPIView.as_view(), name='checkin_api'),
+    path('api/checkin/<int:activity_id>/', checkin_api_view.as_view(), name='checkin_api'),
+    path('api/batch/<int:activity_id>/', BatchCheckInAPIView.as_view(), name='batch_api'),
+    path('api/collect/<int:activity_id>/', CollectCheckInAPIView.as_view(), name='collect_api'),
+    path('api/sync/', OfflineSyncAPIView.as_view(), name='sync_api'),
     path('api/reset/<int:activity_id>/', CheckInResetAPIView.as_view(), name='reset_api'),
     path('qr/<int:activity_id>/presenter/', CheckInQRPresenterView.as_view(), name='qr_presenter'),
     path('qr/<int:activity_id>/image.png', CheckInQRImageView.as_view(), name='qr_image'),
     path('qr/<int:activity_id>/scan/', CheckInQRScanView.as_view(), name='qr_scan'),
+    path('qr/<int:activity_id>/collect/', CheckInQRCollectView.as_view(), name='qr_collect'),
+    path('code/', PersonalCodeView.as_view(), name='personal_code'),
+    path('code/image.png', PersonalCodeImageView.as_view(), name='personal_code_image'),
 ]
\ No newline at end of file
@@ -1,18 +1,56 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.templatetags.static import static
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.http import JsonResponse, HttpResponse
-from django.shortcuts import render, get_object_or_404
+from django.contrib.auth.views import redirect_to_login
+from django.shortcuts import aget_object_or_404, get_object_or_404, render
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from django.views import View
 from django.views.generic import TemplateView
 from django.urls import reverse
-import qrcode
+import functools
 import io
+import json
 
-from .models import Activity, ActivityParticipation, CheckInRecord
+from core.db_routers import ReplicaReadMixin
+from core.idempotency import IdempotencyMixin
+from core.ratelimit import RateLimitMixin
 
+from . import batch, collect, geofence, ingest, membership, offline, qrtoken
+from .models import Activity, CheckInRecord
+from .sharding import user_activity_ids, user_checkins
 
-class CheckInDashboardView(LoginRequiredMixin, TemplateView):
+CHECKIN_RATE_LIMITS = (('checkin:user', 'user'), ('checkin:ip', 'ip'), ('checkin:activity', 'activity'))
+
+JSQR_CDN_URL = 'https://cdn.jsdelivr.net/npm/jsqr@1.4.0/dist/jsQR.js'
+
+
+@functools.lru_cache(maxsize=None)
+def jsqr_url():
+    """Self-hosted jsQR (manage.py vendor_jsqr) when present, else the CDN copy.
+    Resolved once per process, as finders.find() searches every static directory."""
+    if finders.find('js/vendor/jsQR.js'):
+        try:
+            return static('js/vendor/jsQR.js')
+        except ValueError:  # vendored after the last collectstatic
+            pass
+    return JSQR_CDN_URL
+
+
+def qr_png_response(data: str) -> HttpResponse:
+    import qrcode  # pulls in PIL; only QR images load it
+
+    buf = io.BytesIO()
+    qrcode.make(data).save(buf, format='PNG')
+    response = HttpResponse(buf.getvalue(), content_type='image/png')
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+class CheckInDashboardView(LoginRequiredMixin, ReplicaReadMixin, TemplateView):
     template_name = 'checkin/dashboard.html'
 
     def get_context_data(self, **kwargs):
@@ -22,19 +60,22 @@ class CheckInDashboardView(LoginRequiredMixin, TemplateView):
         
         # Test users see all active activities; regular users see only their assigned activities
         if user.is_test:
-            activities = Activity.objects.filter(is_active=True).select_related('created_by').prefetch_related('checkins')
+            activities = Activity.objects.filter(is_active=True).select_related('created_by')
         else:
-            activities = Activity.objects.filter(participants=user, is_active=True).select_related('created_by').prefetch_related('checkins')
+            activities = Activity.objects.filter(id__in=user_activity_ids(user), is_active=True).select_related('created_by')
+
+        activities = [activity for activity in activities if activity.is_open_for(now)]
+        # One lookup for all of the user's check-ins instead of one per activity
+        checkins = {
+            record.activity_id: record
+            for record in user_checkins(user, [activity.id for activity in activities])
+        }
 
         activity_list = []
         for activity in activities:
-            if not activity.is_open_for(now):
-                continue
-            has_checked_in = CheckInRecord.objects.filter(activity=activity, user=user).exists()
-            checkin_time = None
-            if has_checked_in:
-                checkin = CheckInRecord.objects.filter(activity=activity, user=user).first()
-                checkin_time = checkin.checkin_time
+            checkin = checkins.get(activity.id)
+            has_checked_in = checkin is not None
+            checkin_time = checkin.checkin_time if checkin else None
 
             activity_list.append(
                 {
@@ -43,53 +84,47 @@ class CheckInDashboardView(LoginRequiredMixin, TemplateView):
                     'checkin_time': checkin_time,
                     'is_creator': activity.created_by_id == user.id,
                     'qr_interval': max(activity.qr_refresh_interval_s or 30, 10),
+                    # Lets a check-in made without network be submitted later (checkin/offline.py)
+                    'offline_ticket': None if has_checked_in else offline.issue_ticket(user.pk, activity.pk, now),
+                    # Everything the cached part of the card depends on besides config/language/time zone
+                    'card_version': (
+                        f'{activity.updated_at.timestamp()}:{has_checked_in}:'
+                        f'{activity.created_by.username}:{activity.created_by.first_name}'
+                    ),
                 }
             )
 
         context['activities'] = activity_list
         context['current_time'] = now
+        context['fragment_ttl'] = settings.FRAGMENT_CACHE_SECONDS
         return context
 
 
-class CheckInAPIView(LoginRequiredMixin, View):
-    def post(self, request, activity_id):
-        activity = get_object_or_404(Activity, id=activity_id, is_active=True)
-        if not activity.is_open_for(timezone.now()):
-            return JsonResponse({'success': False, 'error': _('活动不在开放时间')})
+class CheckInRulesMixin:
+    """Location / QR checks and request details shared by the sync and async check-in views."""
 
-        # Test users always allowed; regular users need participation record
-        if not request.user.is_test:
-            allowed = ActivityParticipation.objects.filter(
-                activity=activity, user=request.user, can_participate=True
-            ).exists()
-            if not allowed:
-                return JsonResponse({'success': False, 'error': _('您无权参与此活动')})
-
-            if CheckInRecord.objects.filter(activity=activity, user=request.user).exists():
-                return JsonResponse({'success': False, 'error': _('您已签到过此活动')})
-
-        lat = request.POST.get('lat')
-        lng = request.POST.get('lng')
+    def submission_error(self, activity: Activity, data, now):
+        """Error message for the submitted location and QR token, or None if they are acceptable."""
         if activity.location_enabled:
             try:
-                lat_v = float(lat)
-                lng_v = float(lng)
+                lat_v = float(data.get('lat'))
+                lng_v = float(data.get('lng'))
             except (TypeError, ValueError):
-                return JsonResponse({'success': False, 'error': _('缺少或无效的位置参数')})
+                return _('缺少或无效的位置参数')
             if not self._within_radius(activity, lat_v, lng_v):
-                return JsonResponse({'success': False, 'error': _('不在签到范围内')})
-
-        token = request.POST.get('qr_token')
-        if activity.qr_enabled and not activity.is_valid_qr_token(token, timezone.now()):
-            return JsonResponse({'success': False, 'error': _('二维码已过期或无效')})
+                return _('不在签到范围内')
 
-        # Test users can check-in multiple times (delete old record)
-        if request.user.is_test:
-            CheckInRecord.objects.filter(activity=activity, user=request.user).delete()
+        token = data.get('qr_token')
+        if activity.qr_enabled and not activity.is_valid_qr_token(token, now):
+            return _('二维码已过期或无效')
+        return None
 
-        CheckInRecord.objects.create(
+    def build_record(self, activity: Activity, request, user) -> CheckInRecord:
+        lat = request.POST.get('lat')
+        lng = request.POST.get('lng')
+        return CheckInRecord(
             activity=activity,
-            user=request.user,
+            user=user,
             ip_address=self.get_client_ip(request),
             user_agent=request.META.get('HTTP_USER_AGENT', ''),
             latitude=float(lat) if lat else None,
@@ -97,8 +132,6 @@ class CheckInAPIView(LoginRequiredMixin, View):
             status=CheckInRecord.CheckInStatus.PRESENT,
         )
 
-        return JsonResponse({'success': True, 'message': _('签到成功')})
-
     def get_client_ip(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
         if x_forwarded_for:
@@ -108,17 +141,86 @@ class CheckInAPIView(LoginRequiredMixin, View):
         return ip
 
     def _within_radius(self, activity: Activity, lat: float, lng: float) -> bool:
-        if not (activity.location_lat and activity.location_lng and activity.location_radius_m):
-            return True
-        # Haversine formula
-        from math import radians, sin, cos, asin, sqrt
-        R = 6371000.0
-        dlat = radians(lat - activity.location_lat)
-        dlng = radians(lng - activity.location_lng)
-        a = sin(dlat/2)**2 + cos(radians(activity.location_lat)) * cos(radians(lat)) * sin(dlng/2)**2
-        c = 2 * asin(sqrt(a))
-        distance = R * c
-        return distance <= float(activity.location_radius_m or 0)
+        fence = geofence.fence_for(activity)
+        # No area configured: the position is only required, not checked.
+        return fence is None or fence.contains(lat, lng)
+
+
+class CheckInAPIView(LoginRequiredMixin, IdempotencyMixin, RateLimitMixin, CheckInRulesMixin, View):
+    rate_limits = CHECKIN_RATE_LIMITS
+
+    def post(self, request, activity_id):
+        activity = get_object_or_404(Activity, id=activity_id, is_active=True)
+        now = timezone.now()
+        if not activity.is_open_for(now):
+            return JsonResponse({'success': False, 'error': _('活动不在开放时间')})
+
+        # Test users always allowed; regular users need participation record
+        if not request.user.is_test:
+            if not membership.is_member(activity, request.user.pk):
+                return JsonResponse({'success': False, 'error': _('您无权参与此活动')})
+
+            if activity.checkin_records(until=now).filter(user=request.user).exists():
+                return JsonResponse({'success': False, 'error': _('您已签到过此活动')})
+
+        error = self.submission_error(activity, request.POST, now)
+        if error:
+            return JsonResponse({'success': False, 'error': error})
+
+        # Test users can check-in multiple times (delete old record)
+        if request.user.is_test:
+            activity.checkin_records(until=now).filter(user=request.user).delete()
+
+        record = self.build_record(activity, request, request.user)
+        if ingest.enabled() and not request.user.is_test:
+            # Journaled now, inserted by the next flush (CHECKIN_WRITE_BEHIND).
+            if not ingest.get_buffer().submit(record):
+                return JsonResponse({'success': False, 'error': _('您已签到过此活动')})
+        else:
+            record.save(force_insert=True)
+
+        return JsonResponse({'success': True, 'message': _('签到成功')})
+
+
+class AsyncCheckInAPIView(IdempotencyMixin, RateLimitMixin, CheckInRulesMixin, View):
+    """Async-native CheckInAPIView for ASGI deployments (CHECKIN_API_ASYNC).
+    Same rules and responses; every query goes through the async ORM, so the
+    event loop keeps serving other check-ins while this one waits on the database.
+    """
+    rate_limits = CHECKIN_RATE_LIMITS
+
+    async def post(self, request, activity_id):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+
+        activity = await aget_object_or_404(Activity, id=activity_id, is_active=True)
+        now = timezone.now()
+        if not activity.is_open_for(now):
+            return JsonResponse({'success': False, 'error': _('活动不在开放时间')})
+
+        if not user.is_test:
+            if not await membership.ais_member(activity, user.pk):
+                return JsonResponse({'success': False, 'error': _('您无权参与此活动')})
+
+            if await activity.checkin_records(until=now).filter(user=user).aexists():
+                return JsonResponse({'success': False, 'error': _('您已签到过此活动')})
+
+        error = self.submission_error(activity, request.POST, now)
+        if error:
+            return JsonResponse({'success': False, 'error': error})
+
+        if user.is_test:
+            await activity.checkin_records(until=now).filter(user=user).adelete()
+
+        record = self.build_record(activity, request, user)
+        if ingest.enabled() and not user.is_test:
+            if not await sync_to_async(ingest.get_buffer().submit)(record):
+                return JsonResponse({'success': False, 'error': _('您已签到过此活动')})
+        else:
+            await record.asave(force_insert=True)
+
+        return JsonResponse({'success': True, 'message': _('签到成功')})
 
 
 class CheckInResetAPIView(LoginRequiredMixin, View):
@@ -130,7 +232,7 @@ class CheckInResetAPIView(LoginRequiredMixin, View):
             return JsonResponse({'success': False, 'error': _('仅测试用户可重置签到状态')})
 
         # 重置为未签到：删除该活动下该用户的签到记录
-        CheckInRecord.objects.filter(activity=activity, user=request.user).delete()
+        activity.checkin_records(until=timezone.now()).filter(user=request.user).delete()
 
         return JsonResponse({'success': True, 'message': _('已重置为未签到')})
 
@@ -145,6 +247,80 @@ class PresenterOnlyMixin(UserPassesTestMixin):
         return user.is_superuser or user.is_admin or activity.created_by_id == user.id
 
 
+class BatchCheckInAPIView(LoginRequiredMixin, PresenterOnlyMixin, IdempotencyMixin, CheckInRulesMixin, View):
+    """Check in many attendees at once from a staff-operated kiosk or card reader.
+
+    The body is JSON ``{"entries": [{"username": "...", "time": "<ISO 8601>"}, {"user_id": 12}, ...]}``;
+    the answer lists one result per entry (see ``checkin.batch.check_in_entries``).
+    Devices should send an ``Idempotency-Key`` so a resent batch gets the original results.
+    """
+
+    def post(self, request, activity_id):
+        activity = get_object_or_404(Activity, id=activity_id, is_active=True)
+        try:
+            entries = json.loads(request.body)['entries']
+        except (ValueError, TypeError, KeyError):
+            entries = None
+        if not isinstance(entries, list):
+            return JsonResponse({'success': False, 'error': _('无效的请求数据')}, status=400)
+        if len(entries) > batch.max_entries():
+            return JsonResponse(
+                {'success': False, 'error': _('单次最多提交 %(count)d 条') % {'count': batch.max_entries()}}, status=400
+            )
+        results = batch.check_in_entries(
+            activity, entries, self.get_client_ip(request), request.META.get('HTTP_USER_AGENT', '')
+        )
+        created = sum(1 for result in results if result['result'] == batch.CREATED)
+        return JsonResponse({'success': True, 'created': created, 'results': results})
+
+
+class CollectCheckInAPIView(LoginRequiredMixin, PresenterOnlyMixin, IdempotencyMixin, CheckInRulesMixin, View):
+    """Reverse QR: personal codes decoded by the presenter's collect page, as JSON ``{"codes": ["u.12.…", ...]}``.
+    The answer lists one result per code (see ``checkin.collect.check_in_codes``)."""
+
+    def post(self, request, activity_id):
+        activity = get_object_or_404(Activity, id=activity_id, is_active=True)
+        try:
+            codes = json.loads(request.body)['codes']
+        except (ValueError, TypeError, KeyError):
+            codes = None
+        if not isinstance(codes, list):
+            return JsonResponse({'success': False, 'error': _('无效的请求数据')}, status=400)
+        if len(codes) > batch.max_entries():
+            return JsonResponse(
+                {'success': False, 'error': _('单次最多提交 %(count)d 条') % {'count': batch.max_entries()}}, status=400
+            )
+        results = collect.check_in_codes(
+            activity, codes, self.get_client_ip(request), request.META.get('HTTP_USER_AGENT', '')
+        )
+        created = sum(1 for result in results if result['result'] == batch.CREATED)
+        return JsonResponse({'success': True, 'created': created, 'results': results})
+
+
+class OfflineSyncAPIView(LoginRequiredMixin, IdempotencyMixin, RateLimitMixin, CheckInRulesMixin, View):
+    """Check-ins queued while offline, as JSON ``{"sent_at": "<device time>", "attempts": [...]}``.
+    The answer lists one result per attempt (see ``checkin.offline.sync``)."""
+    rate_limits = CHECKIN_RATE_LIMITS
+
+    def post(self, request):
+        try:
+            data = json.loads(request.body)
+            attempts = data['attempts']
+        except (ValueError, TypeError, KeyError):
+            attempts = None
+        if not isinstance(attempts, list):
+            return JsonResponse({'success': False, 'error': _('无效的请求数据')}, status=400)
+        if len(attempts) > batch.max_entries():
+            return JsonResponse(
+                {'success': False, 'error': _('单次最多提交 %(count)d 条') % {'count': batch.max_entries()}}, status=400
+            )
+        results = offline.sync(
+            request.user, attempts, data.get('sent_at'), self.get_client_ip(request), request.META.get('HTTP_USER_AGENT', '')
+        )
+        created = sum(1 for result in results if result['result'] == batch.CREATED)
+        return JsonResponse({'success': True, 'created': created, 'results': results})
+
+
 class CheckInQRPresenterView(LoginRequiredMixin, PresenterOnlyMixin, TemplateView):
     template_name = 'checkin/qr_presenter.html'
 
@@ -159,11 +335,7 @@ class CheckInQRPresenterView(LoginRequiredMixin, PresenterOnlyMixin, TemplateVie
 class CheckInQRImageView(LoginRequiredMixin, PresenterOnlyMixin, View):
     def get(self, request, activity_id):
         activity = get_object_or_404(Activity, id=activity_id)
-        token = activity.current_qr_token(timezone.now())
-        img = qrcode.make(token)
-        buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        return HttpResponse(buf.getvalue(), content_type='image/png')
+        return qr_png_response(activity.current_qr_token(timezone.now()))
 
 
 class CheckInQRScanView(LoginRequiredMixin, TemplateView):
@@ -173,4 +345,31 @@ class CheckInQRScanView(LoginRequiredMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         activity = get_object_or_404(Activity, id=self.kwargs['activity_id'])
         context['activity'] = activity
-        return context
\ No newline at end of file
+        # Self-hosted copy (manage.py vendor_jsqr); the CDN is only a fallback.
+        context['jsqr_url'] = jsqr_url()
+        context['offline_ticket'] = offline.issue_ticket(self.request.user.pk, activity.pk)
+        return context
+
+
+class CheckInQRCollectView(LoginRequiredMixin, PresenterOnlyMixin, TemplateView):
+    template_name = 'checkin/qr_collect.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['activity'] = get_object_or_404(Activity, id=self.kwargs['activity_id'])
+        context['jsqr_url'] = jsqr_url()
+        return context
+
+
+class PersonalCodeView(LoginRequiredMixin, TemplateView):
+    template_name = 'checkin/personal_code.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['interval'] = qrtoken.personal_interval()
+        return context
+
+
+class PersonalCodeImageView(LoginRequiredMixin, View):
+    def get(self, request):
+        return qr_png_response(qrtoken.issue_personal(request.user.pk, timezone.now()))
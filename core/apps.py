@@ -5,3 +5,14 @@ class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
     verbose_name = '核心'
+
+    def ready(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+
+        from . import checks  # noqa: F401
+        from . import query_hooks
+
+        connection_created.connect(query_hooks.install)
+        for connection in connections.all(initialized_only=True):
+            query_hooks.install(connection=connection)
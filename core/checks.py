@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.checks import Tags, Warning, register
+
+CACHED_LOADER = 'django.template.loaders.cached.Loader'
+
+
+@register(Tags.templates, deploy=True)
+def check_cached_template_loader(app_configs, **kwargs):
+    """`manage.py check --deploy`: production must not re-read and recompile templates per request."""
+    warnings = []
+    for index, config in enumerate(settings.TEMPLATES):
+        if config.get('BACKEND') != 'django.template.backends.django.DjangoTemplates':
+            continue
+        loaders = config.get('OPTIONS', {}).get('loaders')
+        if loaders is None:
+            continue  # Django's default wraps the loaders in the cached loader
+        if not any(isinstance(loader, (list, tuple)) and loader[0] == CACHED_LOADER for loader in loaders):
+            warnings.append(
+                Warning(
+                    f'TEMPLATES[{index}] does not use {CACHED_LOADER}.',
+                    hint='Wrap the loaders in the cached loader so templates are compiled once per process.',
+                    id='core.W001',
+                )
+            )
+    return warnings
+
+
+@register(Tags.staticfiles, deploy=True)
+def check_vendored_jsqr(app_configs, **kwargs):
+    """`manage.py check --deploy`: the QR scanner should not depend on the CDN."""
+    if finders.find('js/vendor/jsQR.js'):
+        return []
+    return [
+        Warning(
+            'jsQR is not vendored; browsers without BarcodeDetector load it from cdn.jsdelivr.net.',
+            hint='Run manage.py vendor_jsqr (--tarball on machines without registry access) '
+            'and commit assets/js/vendor/.',
+            id='core.W002',
+        )
+    ]
@@ -0,0 +1,204 @@
+"""In-process sampling CPU profiler for selected URLs.
+
+Requests whose path matches one of ``CPU_PROFILER_PATHS`` are profiled with
+probability ``CPU_PROFILER_SAMPLE_RATE``. While the request runs, a helper
+thread snapshots the request thread's stack every ``CPU_PROFILER_INTERVAL_MS``
+via ``sys._current_frames()``; no signals or external tools are involved, so it
+works in any worker type. The samples are written in collapsed-stack format
+(``frame;frame;frame count``, as read by flamegraph.pl and speedscope) to
+``CPU_PROFILER_DIR``, and ``render_svg`` turns one into a flame graph.
+"""
+import os
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from html import escape
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+FILE_SUFFIX = '.collapsed'
+_NAME_RE = re.compile(r'^[\w.-]+\.collapsed$')
+_MAX_DEPTH = 200
+
+
+@lru_cache(maxsize=8)
+def _compile(patterns: tuple[str, ...]) -> re.Pattern | None:
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns)) if patterns else None
+
+
+def should_profile(path: str) -> bool:
+    rate = getattr(settings, 'CPU_PROFILER_SAMPLE_RATE', 0.0)
+    if rate <= 0:
+        return False
+    pattern = _compile(tuple(getattr(settings, 'CPU_PROFILER_PATHS', ())))
+    if pattern is None or not pattern.search(path):
+        return False
+    return random.random() < rate
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < _MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    # Semicolons separate frames in the collapsed format.
+    return ';'.join(reversed(names)).replace(' ', '_')
+
+
+class Sampler:
+    """Collect stack samples of one thread from a background thread."""
+
+    def __init__(self, thread_id: int | None = None, interval: float = 0.005):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='cpu-profiler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[_collapse(frame)] += 1
+            del frame
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+
+def profile(request, get_response):
+    """Run the request under a Sampler and store the samples."""
+    interval = getattr(settings, 'CPU_PROFILER_INTERVAL_MS', 5) / 1000
+    start = time.perf_counter()
+    with Sampler(interval=interval) as sampler:
+        response = get_response(request)
+        if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+            response.render()
+    if sampler.samples:
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        save(sampler.collapsed(), view, time.perf_counter() - start)
+    return response
+
+
+def _directory() -> Path:
+    return Path(settings.CPU_PROFILER_DIR)
+
+
+def save(collapsed: str, view: str, duration: float) -> Path | None:
+    directory = _directory()
+    stamp = timezone.localtime().strftime('%Y%m%dT%H%M%S')
+    slug = re.sub(r'[^\w-]+', '-', view).strip('-') or 'view'
+    path = directory / f'{stamp}-{slug}-{int(duration * 1000)}ms-{os.getpid()}{FILE_SUFFIX}'
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(collapsed, encoding='utf-8')
+        os.replace(tmp, path)
+        _prune(directory)
+    except OSError:
+        # Profiling must never break a request.
+        return None
+    return path
+
+
+def _prune(directory: Path) -> None:
+    keep = getattr(settings, 'CPU_PROFILER_KEEP', 200)
+    files = sorted(directory.glob(f'*{FILE_SUFFIX}'), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in files[keep:]:
+        old.unlink(missing_ok=True)
+
+
+@dataclass
+class ProfileFile:
+    name: str
+    size: int
+    modified: datetime
+
+
+def list_profiles() -> list[ProfileFile]:
+    """Stored profiles, newest first."""
+    directory = _directory()
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for path in directory.glob(f'*{FILE_SUFFIX}'):
+        stat = path.stat()
+        profiles.append(
+            ProfileFile(path.name, stat.st_size, datetime.fromtimestamp(stat.st_mtime, tz=timezone.get_current_timezone()))
+        )
+    return sorted(profiles, key=lambda p: p.modified, reverse=True)
+
+
+def profile_path(name: str) -> Path | None:
+    """Path of a stored profile, or None for unknown or unsafe names."""
+    if not _NAME_RE.match(name):
+        return None
+    path = _directory() / name
+    return path if path.is_file() else None
+
+
+def render_svg(collapsed: str, title: str = '', width: int = 1200) -> str:
+    """Minimal flame graph: root at the bottom, width proportional to samples."""
+    root: dict = {'count': 0, 'children': {}}
+    for line in collapsed.splitlines():
+        stack, _, count = line.rpartition(' ')
+        if not stack or not count.isdigit():
+            continue
+        node = root
+        node['count'] += int(count)
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, {'count': 0, 'children': {}})
+            node['count'] += int(count)
+
+    row = 16
+    rects = []
+    depth_max = 0
+    total = root['count'] or 1
+
+    def walk(node, x, depth):
+        nonlocal depth_max
+        depth_max = max(depth_max, depth)
+        for name, child in sorted(node['children'].items()):
+            w = child['count'] / total * width
+            if w >= 0.5:
+                rects.append((x, depth, w, name, child['count']))
+                walk(child, x, depth + 1)
+            x += w
+
+    walk(root, 0.0, 0)
+    height = (depth_max + 1) * row + 24
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">',
+        f'<text x="4" y="14">{escape(title)} ({root["count"]} samples)</text>',
+    ]
+    for x, depth, w, name, count in rects:
+        y = height - (depth + 1) * row
+        hue = 20 + zlib.crc32(name.encode()) % 40
+        label = escape(name[: int(w / 7)]) if w > 40 else ''
+        parts.append(
+            f'<g><title>{escape(name)} ({count} samples, {count / total:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" fill="hsl({hue},90%,60%)"/>'
+            f'<text x="{x + 2:.1f}" y="{y + 11}">{label}</text></g>'
+        )
+    parts.append('</svg>')
+    return '\n'.join(parts)
@@ -0,0 +1,191 @@
+"""Database routing for optional read replicas.
+
+Reads go to the primary unless a view (or a block of code) opts in with
+``ReplicaReadMixin`` / ``replica_reads()``. Clients that just wrote are pinned
+to the primary for ``DB_REPLICA_STICKY_SECONDS`` so they always read their own
+writes, and replicas that are down or lag behind are skipped.
+"""
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import DatabaseError, OperationalError
+
+PIN_COOKIE_NAME = 'neosign_db_pin'
+
+# Replication delay in seconds; 0 when the replica has replayed everything it received,
+# NULL on a server that is not in recovery.
+_PG_LAG_SQL = (
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+class _RoutingState:
+    __slots__ = ('use_replica', 'pinned', 'wrote', 'replica', 'replicas_used')
+
+    def __init__(self, pinned: bool = False):
+        self.use_replica = False
+        self.pinned = pinned
+        self.wrote = False
+        # The replica this request reads from; replicas lag by different amounts,
+        # so one request must not mix them.
+        self.replica: str | None = None
+        self.replicas_used: set[str] = set()
+
+
+_state: contextvars.ContextVar[_RoutingState | None] = contextvars.ContextVar('neosign_db_routing', default=None)
+
+
+def replica_aliases() -> list[str]:
+    return list(getattr(settings, 'DB_REPLICA_ALIASES', []))
+
+
+def _current_state() -> _RoutingState:
+    state = _state.get()
+    if state is None:
+        state = _RoutingState()
+        _state.set(state)
+    return state
+
+
+class _ReplicaHealth:
+    """Per-process cache of replica availability, re-probed every ``DB_REPLICA_HEALTH_TTL`` seconds."""
+
+    def __init__(self):
+        self._checked: dict[str, tuple[float, bool]] = {}
+        self._lock = threading.Lock()
+
+    def is_available(self, alias: str) -> bool:
+        ttl = getattr(settings, 'DB_REPLICA_HEALTH_TTL', 10)
+        now = time.monotonic()
+        checked = self._checked.get(alias)
+        if checked and now - checked[0] < ttl:
+            return checked[1]
+        ok = self._probe(alias)
+        with self._lock:
+            self._checked[alias] = (now, ok)
+        return ok
+
+    def mark_down(self, alias: str) -> None:
+        with self._lock:
+            self._checked[alias] = (time.monotonic(), False)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._checked.clear()
+
+    def _probe(self, alias: str) -> bool:
+        connection = connections[alias]
+        max_lag = getattr(settings, 'DB_REPLICA_MAX_LAG_SECONDS', 5)
+        try:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute(_PG_LAG_SQL)
+                    lag = cursor.fetchone()[0]
+                    return lag is None or float(lag) <= max_lag
+                cursor.execute('SELECT 1')
+                return True
+        except DatabaseError:
+            connection.close_if_unusable_or_obsolete()
+            return False
+
+
+replica_health = _ReplicaHealth()
+
+
+def pick_replica() -> str | None:
+    """Return a healthy replica alias, or None when reads must use the primary."""
+    candidates = replica_aliases()
+    random.shuffle(candidates)
+    for alias in candidates:
+        if replica_health.is_available(alias):
+            return alias
+    return None
+
+
+@contextmanager
+def request_scope(pinned: bool = False):
+    """Track routing decisions for one request (see ``DatabaseRoutingMiddleware``)."""
+    state = _RoutingState(pinned=pinned)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def replica_reads():
+    """Route reads inside the block to a replica unless the client is pinned to the primary."""
+    state = _current_state()
+    previous = state.use_replica
+    state.use_replica = True
+    try:
+        yield state
+    finally:
+        state.use_replica = previous
+
+
+def is_pinned(request) -> bool:
+    try:
+        return int(request.COOKIES.get(PIN_COOKIE_NAME, '0')) > time.time()
+    except ValueError:
+        return False
+
+
+class PrimaryReplicaRouter:
+    """Send opted-in reads to a healthy replica; everything else uses the primary."""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica or state.pinned or state.wrote:
+            return None
+        if state.replica is None or not replica_health.is_available(state.replica):
+            state.replica = pick_replica()
+            if state.replica:
+                state.replicas_used.add(state.replica)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive schema changes through replication.
+        if db in replica_aliases():
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """Serve a read-only view from a replica, falling back to the primary on replica errors."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if not replica_aliases() or is_pinned(request):
+            return super().dispatch(request, *args, **kwargs)
+        try:
+            with replica_reads() as state:
+                response = super().dispatch(request, *args, **kwargs)
+                # Template responses evaluate their querysets while rendering.
+                if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                    response.render()
+                return response
+        except OperationalError:
+            if not state.replicas_used:
+                raise
+            for alias in state.replicas_used:
+                replica_health.mark_down(alias)
+            return super().dispatch(request, *args, **kwargs)
@@ -0,0 +1,72 @@
+"""Liveness and readiness probes for load balancers.
+
+``/healthz`` only proves the process answers. ``/readyz`` also runs ``SELECT 1``
+on the default database and checks that no migrations are pending. Its result
+is cached per process for ``HEALTH_READY_CACHE_SECONDS``. Once migrations are
+found applied, that check is not repeated: new migrations only arrive with new
+code, which means a restart.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.migrations.executor import MigrationExecutor
+
+LIVE_PATHS = frozenset({'/healthz', '/healthz/'})
+READY_PATHS = frozenset({'/readyz', '/readyz/'})
+
+_lock = threading.Lock()
+_ready_result: tuple[float, bool, dict] | None = None
+_migrations_applied = False
+
+
+def _check_database(connection) -> str:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+    return 'ok'
+
+
+def _check_migrations(connection) -> str:
+    global _migrations_applied
+    if not _migrations_applied:
+        executor = MigrationExecutor(connection)
+        if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+            return 'pending'
+        _migrations_applied = True
+    return 'ok'
+
+
+def readiness() -> tuple[bool, dict]:
+    """(ready, checks), served from the per-process cache while fresh."""
+    global _ready_result
+    ttl = getattr(settings, 'HEALTH_READY_CACHE_SECONDS', 5)
+    now = time.monotonic()
+    cached = _ready_result
+    if cached is not None and now - cached[0] < ttl:
+        return cached[1], cached[2]
+
+    with _lock:
+        cached = _ready_result
+        if cached is not None and now - cached[0] < ttl:
+            return cached[1], cached[2]
+        connection = connections[DEFAULT_DB_ALIAS]
+        checks = {}
+        try:
+            checks['database'] = _check_database(connection)
+            checks['migrations'] = _check_migrations(connection)
+        except DatabaseError as exc:
+            checks.setdefault('database', 'error')
+            # Broken connections are dropped by close_old_connections() when the request finishes.
+            checks['error'] = exc.__class__.__name__
+        ready = all(value == 'ok' for value in checks.values())
+        _ready_result = (time.monotonic(), ready, checks)
+        return ready, checks
+
+
+def reset() -> None:
+    global _ready_result, _migrations_applied
+    with _lock:
+        _ready_result = None
+        _migrations_applied = False
@@ -0,0 +1,115 @@
+"""Replay the response of a retried POST instead of running it again.
+
+A phone on a congested network often sends a check-in, loses the response and
+sends it again. The client puts the same random ``Idempotency-Key`` header on
+every attempt of one submission. The first attempt runs normally and its
+response is kept for ``IDEMPOTENCY_TTL`` seconds in the ``IDEMPOTENCY_CACHE``
+cache, keyed by user and key. Retries get that response back (with
+``Idempotent-Replayed: true``) without touching the database. A retry that
+arrives while the first attempt is still running gets 409 and tries again.
+
+Only definitive answers are kept: 5xx and 429 responses are dropped so the
+retry runs for real. Views opt in with ``IdempotencyMixin``.
+"""
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+from django.utils.translation import gettext as _
+
+HEADER = 'Idempotency-Key'
+KEY_RE = re.compile(r'^[A-Za-z0-9_-]{8,128}$')
+
+# How long an attempt may run before a retry with its key is let through.
+IN_PROGRESS_TTL = 30
+IN_PROGRESS = 'in-progress'
+
+
+def _cache():
+    return caches[getattr(settings, 'IDEMPOTENCY_CACHE', 'default')]
+
+
+def _ttl() -> int:
+    return getattr(settings, 'IDEMPOTENCY_TTL', 600)
+
+
+def cache_key(user_id, path: str, key: str) -> str:
+    digest = hashlib.sha256(f'{path}\n{key}'.encode()).hexdigest()[:32]
+    return f'idempotency:{user_id}:{digest}'
+
+
+def storable(response) -> bool:
+    return not response.streaming and response.status_code < 500 and response.status_code != 429
+
+
+def freeze(response) -> tuple:
+    return (response.status_code, response['Content-Type'], response.content)
+
+
+def replay(stored) -> HttpResponse:
+    status, content_type, content = stored
+    response = HttpResponse(content, status=status, content_type=content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def in_progress() -> JsonResponse:
+    response = JsonResponse({'success': False, 'error': _('请求正在处理中，请稍后重试')}, status=409)
+    response['Retry-After'] = '1'
+    return response
+
+
+class IdempotencyMixin:
+    """Replay POST responses for repeated ``Idempotency-Key`` headers (see the module docstring).
+
+    Put the mixin after ``LoginRequiredMixin`` and before ``RateLimitMixin``: a
+    replay needs the user but should not use up a token. Requests without the
+    header are handled as before.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if request.method != 'POST' or key is None:
+            return super().dispatch(request, *args, **kwargs)
+        if not KEY_RE.match(key):
+            return JsonResponse({'success': False, 'error': _('无效的 Idempotency-Key')}, status=400)
+        if self.view_is_async:
+            return self._adispatch_idempotent(request, key, *args, **kwargs)
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+        cache, ck = _cache(), cache_key(user.pk, request.path, key)
+        if not cache.add(ck, IN_PROGRESS, IN_PROGRESS_TTL):
+            stored = cache.get(ck)
+            return in_progress() if stored in (None, IN_PROGRESS) else replay(stored)
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except BaseException:
+            cache.delete(ck)
+            raise
+        if storable(response):
+            cache.set(ck, freeze(response), _ttl())
+        else:
+            cache.delete(ck)
+        return response
+
+    async def _adispatch_idempotent(self, request, key, *args, **kwargs):
+        user = await request.auser() if hasattr(request, 'auser') else None
+        if user is None or not user.is_authenticated:
+            return await super().dispatch(request, *args, **kwargs)
+        cache, ck = _cache(), cache_key(user.pk, request.path, key)
+        if not await cache.aadd(ck, IN_PROGRESS, IN_PROGRESS_TTL):
+            stored = await cache.aget(ck)
+            return in_progress() if stored in (None, IN_PROGRESS) else replay(stored)
+        try:
+            response = await super().dispatch(request, *args, **kwargs)
+        except BaseException:
+            await cache.adelete(ck)
+            raise
+        if storable(response):
+            await cache.aset(ck, freeze(response), _ttl())
+        else:
+            await cache.adelete(ck)
+        return response
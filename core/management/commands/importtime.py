@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core import startup
+
+
+class Command(BaseCommand):
+    help = (
+        'Boot a fresh worker under `python -X importtime` and report the slowest imports, '
+        'total import time and peak memory.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25, help='Number of imports to list (by cumulative time).')
+        parser.add_argument('--settings-module', help='Settings module for the child process (default: current).')
+
+    def handle(self, *args, **options):
+        report = startup.measure(options['settings_module'])
+        self.stdout.write(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for entry in report.slowest(options['top']):
+            self.stdout.write(
+                f'{entry.cumulative_us / 1000:>14.1f} {entry.self_us / 1000:>9.1f}  {"  " * entry.depth}{entry.module}'
+            )
+        self.stdout.write('')
+        self.stdout.write(f'Total import time: {report.total_us / 1000:.0f} ms ({len(report.imports)} modules)')
+        self.stdout.write(f'Peak RSS: {report.maxrss_kb / 1024:.1f} MiB')
+        eager = [module for module in startup.HEAVY_MODULES if report.loaded(module)]
+        if eager:
+            self.stdout.write(self.style.WARNING(f'Loaded at startup (expected lazy): {", ".join(eager)}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Heavy optional modules stay unloaded until used.'))
@@ -0,0 +1,73 @@
+import base64
+import hashlib
+import io
+import json
+import tarfile
+import urllib.request
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+JSQR_VERSION = '1.4.0'
+REGISTRY_URL = 'https://registry.npmjs.org/jsqr/{version}'
+MEMBER = 'package/dist/jsQR.js'
+LICENSE_MEMBER = 'package/LICENSE'
+HEADER = '/*! jsQR {version} | Apache-2.0 (see jsQR.LICENSE) | https://github.com/cozmo/jsQR | npm {integrity} */\n'
+
+
+def verify_integrity(data: bytes, integrity: str) -> bool:
+    """Check an npm/SRI integrity string such as ``sha512-<base64>``."""
+    algorithm, _, expected = integrity.partition('-')
+    if algorithm not in ('sha256', 'sha384', 'sha512'):
+        raise CommandError(f'Unsupported integrity algorithm: {algorithm}')
+    digest = base64.b64encode(hashlib.new(algorithm, data).digest()).decode('ascii')
+    return digest == expected
+
+
+class Command(BaseCommand):
+    help = (
+        'Download jsQR from the npm registry, verify it against the published integrity hash '
+        'and store it as assets/js/vendor/jsQR.js with a license header, next to its LICENSE file '
+        '(served locally by the QR scan page; commit both).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jsqr-version', default=JSQR_VERSION, help=f'jsQR release to fetch (default: {JSQR_VERSION}).')
+        parser.add_argument('--tarball', help='Use a downloaded jsqr-<version>.tgz instead of fetching it.')
+        parser.add_argument('--integrity', help='Expected integrity (sha512-...) for --tarball; default: ask the registry.')
+
+    def _fetch(self, url: str) -> bytes:
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                return response.read()
+        except OSError as exc:
+            raise CommandError(f'Could not download {url}: {exc}') from exc
+
+    def handle(self, *args, **options):
+        version = options['jsqr_version']
+        integrity = options['integrity']
+        tarball_url = None
+        if not (options['tarball'] and integrity):
+            metadata = json.loads(self._fetch(REGISTRY_URL.format(version=version)))
+            integrity = integrity or metadata['dist']['integrity']
+            tarball_url = metadata['dist']['tarball']
+
+        data = Path(options['tarball']).read_bytes() if options['tarball'] else self._fetch(tarball_url)
+        if not verify_integrity(data, integrity):
+            raise CommandError('Integrity check failed; the tarball does not match the registry hash.')
+
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as archive:
+            try:
+                script = archive.extractfile(MEMBER).read()
+                license_text = archive.extractfile(LICENSE_MEMBER).read()
+            except (KeyError, AttributeError) as exc:
+                raise CommandError(f'{MEMBER} or {LICENSE_MEMBER} not found in the tarball') from exc
+
+        target = Path(settings.BASE_DIR) / 'assets' / 'js' / 'vendor' / 'jsQR.js'
+        target.parent.mkdir(parents=True, exist_ok=True)
+        header = HEADER.format(version=version, integrity=integrity).encode('ascii')
+        target.write_bytes(header + script)
+        target.with_name('jsQR.LICENSE').write_bytes(license_text)
+        self.stdout.write(self.style.SUCCESS(f'jsQR {version} written to {target} ({len(script)} bytes).'))
+        self.stdout.write('Run collectstatic to publish it.')
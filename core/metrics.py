@@ -0,0 +1,299 @@
+"""Request metrics aggregated across worker processes, rendered in Prometheus text format.
+
+Each process accumulates counters and histograms in memory and periodically
+writes a snapshot to ``METRICS_DIR/<pid>-<start>.json`` (atomically, via
+rename), where ``<start>`` is when the process first wrote one. The metrics
+endpoint merges every snapshot in the directory, so all gunicorn workers are
+reported together. A worker that reuses the pid of an exited one gets its own
+file, so the counters never go backwards. Snapshots of exited workers are
+folded into ``retained.json`` while the directory lock is held, which keeps
+the directory small when workers are recycled. Clear the directory when the
+server restarts.
+"""
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: snapshots are merged but never folded
+    fcntl = None
+
+RETAINED = 'retained.json'
+SNAPSHOT_NAME = re.compile(r'(\d+)(?:-(\d+))?\.json')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# name -> (type, help)
+METRICS = {
+    'neosign_http_requests_total': ('counter', 'Requests by URL name, method and status code.'),
+    'neosign_http_request_duration_seconds': ('histogram', 'Request latency by URL name.'),
+    'neosign_http_response_bytes_total': ('counter', 'Response body bytes by URL name (streaming responses excluded).'),
+    'neosign_db_queries_per_request': ('histogram', 'Database queries per request by URL name.'),
+    'neosign_db_query_seconds_total': ('counter', 'Time spent in database queries by URL name.'),
+}
+
+
+def _buckets_for(name: str) -> tuple:
+    return QUERY_COUNT_BUCKETS if name == 'neosign_db_queries_per_request' else LATENCY_BUCKETS
+
+
+class MetricsRegistry:
+    """In-process metric values with periodic file snapshots."""
+
+    def __init__(self, directory: Path | None = None, flush_interval: float | None = None):
+        self._directory = directory
+        self._flush_interval = flush_interval
+        self._counters: dict[tuple, float] = {}
+        # key -> [bucket counts..., +Inf count, sum]
+        self._histograms: dict[tuple, list[float]] = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        # (pid, file name); a forked worker inheriting this registry picks a new name
+        self._snapshot = None
+
+    @property
+    def directory(self) -> Path:
+        return Path(self._directory or settings.METRICS_DIR)
+
+    @property
+    def flush_interval(self) -> float:
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return getattr(settings, 'METRICS_FLUSH_INTERVAL', 5.0)
+
+    @property
+    def snapshot_name(self) -> str:
+        pid = os.getpid()
+        if self._snapshot is None or self._snapshot[0] != pid:
+            self._snapshot = (pid, f'{pid}-{time.time_ns()}.json')
+        return self._snapshot[1]
+
+    def inc(self, name: str, labels: tuple, amount: float = 1.0) -> None:
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+
+    def observe(self, name: str, labels: tuple, value: float) -> None:
+        buckets = _buckets_for(name)
+        key = (name, labels)
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0.0] * (len(buckets) + 2)
+            series[bisect_left(buckets, value)] += 1
+            series[-1] += value
+
+    def record_request(self, view, method, status, duration, size, queries, query_time) -> None:
+        labels = (('view', view),)
+        self.inc('neosign_http_requests_total', labels + (('method', method), ('status', str(status))))
+        self.observe('neosign_http_request_duration_seconds', labels, duration)
+        self.observe('neosign_db_queries_per_request', labels, queries)
+        if size is not None:
+            self.inc('neosign_http_response_bytes_total', labels, size)
+        if query_time:
+            self.inc('neosign_db_query_seconds_total', labels, query_time)
+        self.maybe_flush()
+
+    def maybe_flush(self) -> None:
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(values)] for (name, labels), values in self._histograms.items()],
+            }
+
+    def flush(self) -> None:
+        self._last_flush = time.monotonic()
+        directory = self.directory
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / self.snapshot_name
+            tmp = path.with_suffix(f'.tmp{threading.get_ident()}')
+            tmp.write_text(json.dumps(self.snapshot()), encoding='utf-8')
+            os.replace(tmp, path)
+        except OSError:
+            # Metrics must never break a request.
+            pass
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+registry = MetricsRegistry()
+
+
+def _read(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def _add(counters: dict, histograms: dict, data: dict) -> None:
+    for name, labels, value in data.get('counters', []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        counters[key] = counters.get(key, 0.0) + value
+    for name, labels, values in data.get('histograms', []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        merged = histograms.setdefault(key, [0.0] * len(values))
+        for index, value in enumerate(values):
+            merged[index] += value
+
+
+def _process_running(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _exited(snapshots: dict[Path, tuple[int, int]]) -> list[Path]:
+    """Snapshots whose process is gone: its pid is not running, or a newer snapshot has the same pid."""
+    newest: dict[int, int] = {}
+    for pid, started in snapshots.values():
+        newest[pid] = max(newest.get(pid, started), started)
+    return [
+        path for path, (pid, started) in snapshots.items()
+        if started < newest[pid] or not _process_running(pid)
+    ]
+
+
+@contextmanager
+def _directory_lock(directory: Path):
+    """Hold an exclusive lock on `directory`; yields False where locking is not available."""
+    if fcntl is None:
+        yield False
+        return
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        handle = open(directory / '.lock', 'a')
+    except OSError:
+        yield False
+        return
+    with handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _fold(directory: Path, retained: dict, paths: list[Path]) -> dict:
+    """Add the snapshots in `paths` to the retained totals, then delete them. Raises OSError
+    when the retained file cannot be written.
+
+    The retained file lists the snapshots it already contains, so a crash between
+    writing it and deleting them does not count them twice.
+    """
+    counters: dict[tuple, float] = {}
+    histograms: dict[tuple, list[float]] = {}
+    _add(counters, histograms, retained)
+    merged = {name for name in retained.get('merged', []) if (directory / name).exists()}
+    for path in paths:
+        _add(counters, histograms, _read(path))
+        merged.add(path.name)
+    retained = {
+        'merged': sorted(merged),
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(labels), values] for (name, labels), values in histograms.items()],
+    }
+    path = directory / RETAINED
+    tmp = path.with_suffix(f'.tmp{os.getpid()}')
+    tmp.write_text(json.dumps(retained), encoding='utf-8')
+    os.replace(tmp, path)
+    for folded in paths:
+        try:
+            folded.unlink()
+        except OSError:
+            pass  # listed in 'merged', so it is skipped until a later fold deletes it
+    return retained
+
+
+def collect(directory: Path | None = None) -> tuple[dict, dict]:
+    """Merge the retained totals and the snapshots of all processes into (counters, histograms)."""
+    directory = Path(directory or settings.METRICS_DIR)
+    with _directory_lock(directory) as locked:
+        retained = _read(directory / RETAINED)
+        already = set(retained.get('merged', []))
+        snapshots = {}
+        for path in sorted(directory.glob('*.json')):
+            match = SNAPSHOT_NAME.fullmatch(path.name)
+            if match and path.name not in already:
+                snapshots[path] = (int(match[1]), int(match[2] or 0))
+        if locked:
+            exited = _exited(snapshots)
+            if exited:
+                try:
+                    retained = _fold(directory, retained, exited)
+                except OSError:
+                    pass  # count them from their own files this time
+                else:
+                    snapshots = {path: key for path, key in snapshots.items() if path not in exited}
+        counters: dict[tuple, float] = {}
+        histograms: dict[tuple, list[float]] = {}
+        _add(counters, histograms, retained)
+        for path in snapshots:
+            _add(counters, histograms, _read(path))
+    return counters, histograms
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(counters: dict, histograms: dict) -> str:
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        if kind == 'counter':
+            series = sorted((labels, value) for (metric, labels), value in counters.items() if metric == name)
+        else:
+            series = sorted((labels, values) for (metric, labels), values in histograms.items() if metric == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for labels, value in series:
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+            continue
+        buckets = _buckets_for(name)
+        for labels, values in series:
+            cumulative = 0.0
+            for bound, count in zip(buckets, values):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, [("le", _number(bound))])} {_number(cumulative)}')
+            cumulative += values[len(buckets)]
+            lines.append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {_number(cumulative)}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(values[-1])}')
+            lines.append(f'{name}_count{_labels(labels)} {_number(cumulative)}')
+    return '\n'.join(lines) + '\n'
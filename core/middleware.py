@@ -1,17 +1,290 @@
+import asyncio
+import math
+import time
+from datetime import datetime, time as dt_time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.db.utils import OperationalError, ProgrammingError
 from django.utils import timezone, translation
 from django.shortcuts import redirect
 
+from . import cpu_profiler, db_routers, health, metrics, query_hooks, query_profiler, static
 from .models import SystemConfig
 from checkin.models import Activity
 
 
-class InstallationMiddleware:
+class _QueryTimer:
+    """Query observer (see core.query_hooks) counting queries and the time spent in them."""
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class HybridMiddleware:
+    """Base for middleware that runs natively under WSGI and ASGI.
+    Django hands an async get_response under ASGI; __call__ then dispatches to
+    __acall__, so no request pays for a sync/async thread hop in the stack.
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+
+class HealthCheckMiddleware(HybridMiddleware):
+    """Answer /healthz and /readyz before any other middleware (see core.health).
+    Keep it first in MIDDLEWARE: probes skip sessions, auth, host validation and the
+    installation/config queries, and are not counted in the request metrics.
+    """
+    @staticmethod
+    def _response(ready, checks):
+        return JsonResponse(
+            {'status': 'ok' if ready else 'unavailable', 'checks': checks},
+            status=200 if ready else 503,
+        )
 
     def __call__(self, request):
-        if request.path.startswith('/install/') or request.path.startswith('/static/'):
+        if self.async_mode:
+            return self.__acall__(request)
+        path = request.path_info
+        if path in health.LIVE_PATHS:
+            return JsonResponse({'status': 'ok'})
+        if path in health.READY_PATHS:
+            return self._response(*health.readiness())
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        path = request.path_info
+        if path in health.LIVE_PATHS:
+            return JsonResponse({'status': 'ok'})
+        if path in health.READY_PATHS:
+            return self._response(*await sync_to_async(health.readiness)())
+        return await self.get_response(request)
+
+
+class StaticFilesMiddleware(HybridMiddleware):
+    """Serve STATIC_URL from STATIC_ROOT with immutable caching and precompressed variants (see core.static).
+    Enabled with STATIC_SERVE (default: when DEBUG is off); placed before the metrics and session middleware.
+    """
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.enabled = getattr(settings, 'STATIC_SERVE', not settings.DEBUG)
+        self.prefix = settings.STATIC_URL
+
+    def _lookup(self, request):
+        if self.enabled and request.path_info.startswith(self.prefix):
+            return static.get_index().lookup(request.path_info)
+        return None
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        entry = self._lookup(request)
+        if entry is not None:
+            return static.serve(request, entry)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        entry = self._lookup(request)
+        if entry is not None:
+            return static.serve(request, entry)
+        return await self.get_response(request)
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """Record latency, DB queries, response size and status per resolved URL name (see core.metrics).
+    Keep it right after HealthCheckMiddleware so the timings cover the whole stack.
+    """
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.enabled = getattr(settings, 'METRICS_ENABLED', True)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        with query_hooks.observe(_QueryTimer()) as timer:
+            response = self.get_response(request)
+        return self._record(request, response, timer, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        start = time.perf_counter()
+        with query_hooks.observe(_QueryTimer()) as timer:
+            response = await self.get_response(request)
+        return self._record(request, response, timer, time.perf_counter() - start)
+
+    @staticmethod
+    def _record(request, response, timer, duration):
+        match = request.resolver_match
+        metrics.registry.record_request(
+            view=match.view_name if match else '<unresolved>',
+            method=request.method,
+            status=response.status_code,
+            duration=duration,
+            size=None if response.streaming else len(response.content),
+            queries=timer.count,
+            query_time=timer.duration,
+        )
+        return response
+
+
+class ConcurrencyLimitMiddleware(HybridMiddleware):
+    """Under ASGI, let at most ASGI_MAX_CONCURRENT_REQUESTS requests per process past this point.
+    Every in-flight async request holds its own database connection (the ORM runs in a
+    per-request thread), so without a cap a burst of check-ins exhausts PostgreSQL's
+    max_connections. Extra requests wait here as cheap coroutines, at most
+    ASGI_MAX_QUEUED_REQUESTS of them for up to ASGI_QUEUE_TIMEOUT seconds; beyond that
+    the answer is 503 with Retry-After. Sync workers are already bounded by their
+    thread count and pass straight through.
+    """
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.limit = getattr(settings, 'ASGI_MAX_CONCURRENT_REQUESTS', 40)
+        self.max_queued = getattr(settings, 'ASGI_MAX_QUEUED_REQUESTS', 200)
+        self.queue_timeout = getattr(settings, 'ASGI_QUEUE_TIMEOUT', 10)
+        self._semaphore = None
+        self._queued = 0
+
+    def overloaded(self):
+        # Shed load before the session, user or anything else touches the database.
+        response = HttpResponse('Server busy, retry shortly.', status=503, content_type='text/plain')
+        response['Retry-After'] = str(max(1, math.ceil(self.queue_timeout / 2)))
+        return response
+
+    async def __acall__(self, request):
+        if not self.limit:
+            return await self.get_response(request)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        if self._semaphore.locked():
+            if self._queued >= self.max_queued:
+                return self.overloaded()
+            self._queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except TimeoutError:
+                return self.overloaded()
+            finally:
+                self._queued -= 1
+        else:
+            await self._semaphore.acquire()
+        try:
+            return await self.get_response(request)
+        finally:
+            self._semaphore.release()
+
+
+class CpuProfilerMiddleware(HybridMiddleware):
+    """Sample the call stack of requests matching CPU_PROFILER_PATHS (see core.cpu_profiler).
+    Sync stacks only: under ASGI the event loop thread interleaves concurrent requests,
+    so its samples could not be attributed to one request and async requests pass through.
+    """
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not cpu_profiler.should_profile(request.path):
+            return self.get_response(request)
+        return cpu_profiler.profile(request, self.get_response)
+
+
+class QueryProfilerMiddleware(HybridMiddleware):
+    """Opt-in slow-query / N+1 detection (see core.query_profiler).
+    Must come after AuthenticationMiddleware: the per-request switch is for admins only.
+    """
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not query_profiler.should_profile(request):
+            return self.get_response(request)
+        return query_profiler.profile(request, self.get_response)
+
+    async def __acall__(self, request):
+        user = await request.auser()
+        if not query_profiler.should_profile(request, user):
+            return await self.get_response(request)
+        return await query_profiler.aprofile(request, self.get_response, user)
+
+
+class DatabaseRoutingMiddleware(HybridMiddleware):
+    """Scope replica routing to the request and pin clients that wrote to the primary.
+    After an unsafe request that wrote, the client reads from the primary for
+    DB_REPLICA_STICKY_SECONDS so it always sees its own check-in or edit.
+    """
+    safe_methods = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not db_routers.replica_aliases():
+            return self.get_response(request)
+
+        with db_routers.request_scope(pinned=db_routers.is_pinned(request)) as state:
+            response = self.get_response(request)
+        return self._pin(request, response, state)
+
+    async def __acall__(self, request):
+        if not db_routers.replica_aliases():
+            return await self.get_response(request)
+
+        # The routing state is a context variable, so ORM calls run through
+        # sync_to_async see (and update) the same state.
+        with db_routers.request_scope(pinned=db_routers.is_pinned(request)) as state:
+            response = await self.get_response(request)
+        return self._pin(request, response, state)
+
+    def _pin(self, request, response, state):
+        if state.wrote and request.method not in self.safe_methods:
+            sticky = getattr(settings, 'DB_REPLICA_STICKY_SECONDS', 10)
+            response.set_cookie(
+                db_routers.PIN_COOKIE_NAME,
+                str(int(time.time()) + sticky),
+                max_age=sticky,
+                httponly=True,
+                samesite='Lax',
+                secure=settings.SESSION_COOKIE_SECURE,
+            )
+        return response
+
+
+class InstallationMiddleware(HybridMiddleware):
+    @staticmethod
+    def _exempt(request):
+        return request.path.startswith('/install/') or request.path.startswith('/static/')
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if self._exempt(request):
             return self.get_response(request)
 
         try:
@@ -22,95 +295,155 @@ class InstallationMiddleware:
 
         return self.get_response(request)
 
+    async def __acall__(self, request):
+        if self._exempt(request):
+            return await self.get_response(request)
+
+        try:
+            if not await SystemConfig.objects.filter(installed=True).aexists():
+                return redirect('installation:welcome')
+        except (OperationalError, ProgrammingError):
+            return redirect('installation:welcome')
 
-class ActivityAutoCloseMiddleware:
+        return await self.get_response(request)
+
+
+class ActivityAutoCloseMiddleware(HybridMiddleware):
     """Auto-close expired activities on management requests.
     - Single events (repeat_type='none'): end_time < now -> is_active=False
     - Repeating events (daily/weekly): end_time date < today -> is_active=False
     """
-    def __init__(self, get_response):
-        self.get_response = get_response
+    @staticmethod
+    def _expired():
+        now = timezone.now()
+        today = timezone.localdate()
+        # Close repeating events beyond their overall end date (if set).
+        # Compare against local midnight rather than end_time__date so the
+        # partial index on active activities can be used.
+        start_of_today = timezone.make_aware(datetime.combine(today, dt_time.min))
+        return (
+            # Single-shot events past their end_time
+            Activity.objects.filter(repeat_type='none', is_active=True, end_time__lt=now),
+            Activity.objects.filter(
+                is_active=True
+            ).exclude(repeat_type='none').filter(
+                end_time__isnull=False, end_time__lt=start_of_today
+            ),
+        )
 
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
         # Only run on management pages to reduce overhead
         if request.path.startswith('/manage/'):
             try:
-                now = timezone.now()
-                today = timezone.localdate()
-                # Close single-shot events past their end_time
-                Activity.objects.filter(
-                    repeat_type='none', is_active=True, end_time__lt=now
-                ).update(is_active=False)
-                # Close repeating events beyond their overall end date (if set)
-                Activity.objects.filter(
-                    is_active=True
-                ).exclude(repeat_type='none').filter(
-                    end_time__isnull=False, end_time__date__lt=today
-                ).update(is_active=False)
+                for queryset in self._expired():
+                    queryset.update(is_active=False)
             except (OperationalError, ProgrammingError):
                 # DB not ready during installation/migration
                 pass
 
         return self.get_response(request)
 
+    async def __acall__(self, request):
+        if request.path.startswith('/manage/'):
+            try:
+                for queryset in self._expired():
+                    await queryset.aupdate(is_active=False)
+            except (OperationalError, ProgrammingError):
+                pass
 
-class ConfigLocaleMiddleware:
-    """Apply language and timezone from SystemConfig per request."""
+        return await self.get_response(request)
 
-    def __init__(self, get_response):
-        self.get_response = get_response
 
-    def __call__(self, request):
+class ConfigLocaleMiddleware(HybridMiddleware):
+    """Apply language and timezone from SystemConfig per request."""
+
+    @staticmethod
+    def _activate(cfg):
+        """Activate the configured time zone and language; returns what to deactivate."""
         lang_activated = False
         tz_activated = False
+        if cfg:
+            if cfg.timezone_str:
+                try:
+                    timezone.activate(cfg.timezone_str)
+                    tz_activated = True
+                except Exception:
+                    pass
+            if cfg.language_code:
+                translation.activate(cfg.language_code)
+                lang_activated = True
+        return lang_activated, tz_activated
+
+    @staticmethod
+    def _deactivate(lang_activated, tz_activated):
+        if lang_activated:
+            translation.deactivate()
+        if tz_activated:
+            timezone.deactivate()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
         try:
             cfg = SystemConfig.objects.first()
-            if cfg:
-                if cfg.timezone_str:
-                    try:
-                        timezone.activate(cfg.timezone_str)
-                        tz_activated = True
-                    except Exception:
-                        pass
-                if cfg.language_code:
-                    translation.activate(cfg.language_code)
-                    lang_activated = True
         except (OperationalError, ProgrammingError):
             cfg = None
+        activated = self._activate(cfg)
 
         response = self.get_response(request)
 
-        if lang_activated:
-            translation.deactivate()
-        if tz_activated:
-            timezone.deactivate()
+        self._deactivate(*activated)
         return response
 
+    async def __acall__(self, request):
+        try:
+            cfg = await SystemConfig.objects.afirst()
+        except (OperationalError, ProgrammingError):
+            cfg = None
+        activated = self._activate(cfg)
+
+        response = await self.get_response(request)
 
-class ForcePasswordChangeMiddleware:
+        self._deactivate(*activated)
+        return response
+
+
+class ForcePasswordChangeMiddleware(HybridMiddleware):
     """Force non-admin users to change password on first login.
     Allows access to password change route and static/install paths.
     """
-    def __init__(self, get_response):
-        self.get_response = get_response
+    allow_paths = (
+        '/auth/password-change-required/',
+        '/auth/logout/',
+        '/static/',
+        '/install/',
+    )
 
-    def __call__(self, request):
+    def _must_change(self, request, user) -> bool:
         path = request.path or ''
-        allow_paths = (
-            '/auth/password-change-required/',
-            '/auth/logout/',
-            '/static/',
-            '/install/',
-        )
         try:
-            user = getattr(request, 'user', None)
             if user and user.is_authenticated:
                 is_admin = getattr(user, 'is_admin', False) or user.is_superuser
                 is_test = getattr(user, 'is_test', False)
                 if user.first_login and not is_admin and not is_test:
-                    if not any(path.startswith(p) for p in allow_paths):
-                        return redirect('authentication:password_change_required')
+                    return not any(path.startswith(p) for p in self.allow_paths)
         except Exception:
             pass
+        return False
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if self._must_change(request, getattr(request, 'user', None)):
+            return redirect('authentication:password_change_required')
 
         return self.get_response(request)
+
+    async def __acall__(self, request):
+        user = await request.auser() if hasattr(request, 'auser') else None
+        if self._must_change(request, user):
+            return redirect('authentication:password_change_required')
+
+        return await self.get_response(request)
@@ -53,6 +53,11 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         verbose_name = '用户'
         verbose_name_plural = '用户'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='core_user_created_idx'),
+            # Test accounts are few; stats exclude them through this index
+            models.Index(fields=['id'], name='core_user_test_idx', condition=models.Q(is_test=True)),
+        ]
 
     def __str__(self) -> str:  # pragma: no cover - simple display
         return self.username
@@ -107,6 +112,8 @@ class SystemConfig(models.Model):
         verbose_name=_('用户名脱敏模式'),
         help_text=_('控制是否对用户名和姓名进行中间部分脱敏处理')
     )
+    # Bumped on every save; part of template fragment cache keys
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
     class Meta:
         verbose_name = '系统配置'
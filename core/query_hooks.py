@@ -0,0 +1,39 @@
+"""Per-request query observers that work under WSGI and ASGI alike.
+
+``connection.execute_wrapper()`` only affects one connection object, and
+connections are thread-local. Under ASGI the ORM runs in ``sync_to_async``
+threads whose connections the middleware never sees. Instead, every connection
+gets one permanent wrapper (installed on ``connection_created``). It hands each
+query to the observers registered with ``observe()`` in the current context.
+Context variables follow the request into those threads.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+_observers: ContextVar[tuple] = ContextVar('neosign_query_observers', default=())
+
+
+def _dispatch(execute, sql, params, many, context):
+    observers = _observers.get()
+    for observer in reversed(observers):
+        execute = partial(observer, execute)
+    return execute(sql, params, many, context)
+
+
+def install(sender=None, connection=None, **kwargs):
+    """connection_created receiver: attach the dispatcher to the connection once."""
+    if _dispatch not in connection.execute_wrappers:
+        # First in the list: execute_wrapper() blocks pop the last entry on exit.
+        connection.execute_wrappers.insert(0, _dispatch)
+
+
+@contextmanager
+def observe(observer):
+    """Send the queries of the current context (and the threads it spawns) to ``observer``,
+    an execute_wrapper-style callable."""
+    token = _observers.set(_observers.get() + (observer,))
+    try:
+        yield observer
+    finally:
+        _observers.reset(token)
@@ -0,0 +1,214 @@
+"""Opt-in slow-query and N+1 detection.
+
+A request is profiled when an admin sends the ``X-NeoSign-Profile: 1`` header or
+the ``neosign_profile=1`` cookie, or when it falls into the global
+``QUERY_PROFILER_SAMPLE_RATE``. Every query then runs through a query observer
+(``core.query_hooks``) that times it and remembers the project frame it came from.
+At the end of the request, queries slower than ``QUERY_PROFILER_SLOW_MS`` and
+query shapes repeated at least ``QUERY_PROFILER_REPEAT_THRESHOLD`` times are
+reported to the ``neosign.queries`` logger and appended to
+``QUERY_PROFILER_LOG`` (JSON lines), which the management page reads.
+"""
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import query_hooks
+
+logger = logging.getLogger('neosign.queries')
+
+PROFILE_HEADER = 'X-NeoSign-Profile'
+PROFILE_COOKIE = 'neosign_profile'
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_SPACES = re.compile(r'\s+')
+_SKIP_PATHS = (os.sep + 'site-packages' + os.sep, os.sep + 'django' + os.sep)
+_SKIP_FILES = frozenset({__file__, query_hooks.__file__})
+_write_lock = threading.Lock()
+
+
+def query_shape(sql: str) -> str:
+    """Normalise a statement so calls that only differ in parameters compare equal."""
+    return _IN_LIST.sub('IN (...)', _SPACES.sub(' ', sql).strip())
+
+
+def _origin() -> str:
+    """file:line (function) of the innermost project frame that issued the query."""
+    base = str(settings.BASE_DIR)
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base) and not any(part in filename for part in _SKIP_PATHS) and filename not in _SKIP_FILES:
+            return f'{os.path.relpath(filename, base)}:{frame.f_lineno} ({frame.f_code.co_name})'
+        frame = frame.f_back
+    return '<django>'
+
+
+@dataclass
+class _Query:
+    shape: str
+    sql: str
+    duration_ms: float
+    origin: str
+
+
+@dataclass
+class Finding:
+    kind: str  # 'slow' or 'repeated'
+    sql: str
+    origin: str
+    duration_ms: float
+    count: int = 1
+
+
+@dataclass
+class Report:
+    timestamp: str
+    method: str
+    path: str
+    view: str
+    user: str
+    total_queries: int
+    total_ms: float
+    findings: list[Finding] = field(default_factory=list)
+
+
+class QueryRecorder:
+    """execute_wrapper hook collecting timing and origin of every query."""
+
+    def __init__(self):
+        self.queries: list[_Query] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            self.queries.append(_Query(query_shape(sql), sql, duration, _origin()))
+
+    def findings(self, slow_ms: float, repeat_threshold: int) -> list[Finding]:
+        found = [
+            Finding('slow', q.sql, q.origin, round(q.duration_ms, 2))
+            for q in self.queries
+            if q.duration_ms >= slow_ms
+        ]
+        groups: dict[str, list[_Query]] = {}
+        for query in self.queries:
+            groups.setdefault(query.shape, []).append(query)
+        for shape, queries in groups.items():
+            if len(queries) >= repeat_threshold:
+                found.append(
+                    Finding(
+                        'repeated',
+                        shape,
+                        queries[0].origin,
+                        round(sum(q.duration_ms for q in queries), 2),
+                        count=len(queries),
+                    )
+                )
+        return found
+
+
+def should_profile(request, user=None) -> bool:
+    """``user`` defaults to request.user; async callers pass ``await request.auser()``."""
+    if user is None:
+        user = getattr(request, 'user', None)
+    is_admin = bool(user and user.is_authenticated and (user.is_admin or user.is_superuser))
+    if is_admin and (request.headers.get(PROFILE_HEADER) == '1' or request.COOKIES.get(PROFILE_COOKIE) == '1'):
+        return True
+    rate = getattr(settings, 'QUERY_PROFILER_SAMPLE_RATE', 0.0)
+    return rate > 0 and random.random() < rate
+
+
+def profile(request, get_response):
+    """Run the request with a QueryRecorder attached to every connection and report findings."""
+    with query_hooks.observe(QueryRecorder()) as recorder:
+        response = get_response(request)
+        # Count queries issued while rendering template responses too.
+        if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+            response.render()
+    return _finish(request, response, recorder, getattr(request, 'user', None))
+
+
+async def aprofile(request, get_response, user=None):
+    """Async counterpart of ``profile`` (the ASGI handler renders template responses itself)."""
+    with query_hooks.observe(QueryRecorder()) as recorder:
+        response = await get_response(request)
+    return _finish(request, response, recorder, user)
+
+
+def _finish(request, response, recorder: QueryRecorder, user):
+    findings = recorder.findings(
+        getattr(settings, 'QUERY_PROFILER_SLOW_MS', 100),
+        getattr(settings, 'QUERY_PROFILER_REPEAT_THRESHOLD', 5),
+    )
+    if findings:
+        match = request.resolver_match
+        report = Report(
+            timestamp=timezone.now().isoformat(),
+            method=request.method,
+            path=request.path,
+            view=match.view_name if match else '<unresolved>',
+            user=user.get_username() if user and user.is_authenticated else '',
+            total_queries=len(recorder.queries),
+            total_ms=round(sum(q.duration_ms for q in recorder.queries), 2),
+            findings=findings,
+        )
+        _publish(report)
+    response['X-NeoSign-Queries'] = str(len(recorder.queries))
+    return response
+
+
+def _publish(report: Report) -> None:
+    data = asdict(report)
+    context = {key: value for key, value in data.items() if key != 'findings'}
+    for finding in data['findings']:
+        # One JSON object per finding, so log shippers can index the fields.
+        logger.warning(json.dumps({**context, **finding}, ensure_ascii=False))
+    path = Path(settings.QUERY_PROFILER_LOG)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with _write_lock, path.open('a', encoding='utf-8') as fh:
+            fh.write(json.dumps(data, ensure_ascii=False) + '\n')
+        _trim(path)
+    except OSError:
+        logger.exception('Could not write query profile to %s', path)
+
+
+def _trim(path: Path) -> None:
+    keep = getattr(settings, 'QUERY_PROFILER_KEEP', 500)
+    if path.stat().st_size < keep * 4096:
+        return
+    with _write_lock:
+        lines = path.read_text(encoding='utf-8').splitlines(keepends=True)[-keep:]
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(''.join(lines), encoding='utf-8')
+        os.replace(tmp, path)
+
+
+def recent_reports(limit: int = 100) -> list[dict]:
+    """Newest reports first."""
+    path = Path(settings.QUERY_PROFILER_LOG)
+    if not path.exists():
+        return []
+    with path.open(encoding='utf-8') as fh:
+        lines = deque(fh, maxlen=limit)
+    reports = []
+    for line in reversed(lines):
+        try:
+            reports.append(json.loads(line))
+        except ValueError:
+            continue
+    return reports
@@ -0,0 +1,140 @@
+"""Token-bucket rate limits for endpoints that clients can hammer (check-in, login).
+
+A limit ``"30/m"`` is a bucket of 30 tokens refilled at 30 per minute; each
+request takes one. The bucket is stored as a single timestamp per key, the
+moment it will be full again (the GCRA form of a token bucket), in the
+``RATELIMIT_CACHE`` cache. With the per-process default cache every worker
+keeps its own buckets. With Redis they are shared; two workers updating the
+same key at the same instant can let one extra request through.
+
+``RATELIMITS`` maps a limit name to a rate, or None to turn it off. Views opt in
+with ``RateLimitMixin``.
+"""
+import hashlib
+import math
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.utils.translation import gettext as _
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+DEFAULT_LIMITS = {
+    'checkin:user': '20/m',
+    # Whole classrooms share one NAT address, so the IP bucket is generous.
+    'checkin:ip': '600/m',
+    'checkin:activity': None,
+    'login:ip': '30/m',
+    'login:username': '10/m',
+}
+
+_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Rate:
+    count: int
+    period: int
+
+    @classmethod
+    def parse(cls, value: str) -> 'Rate':
+        count, _slash, unit = value.partition('/')
+        if unit not in PERIODS or not count.isdigit() or int(count) < 1:
+            raise ValueError(f'Invalid rate {value!r}; expected e.g. "30/m"')
+        return cls(int(count), PERIODS[unit])
+
+
+def rate_for(name: str) -> Rate | None:
+    limits = {**DEFAULT_LIMITS, **getattr(settings, 'RATELIMITS', {})}
+    value = limits.get(name)
+    return Rate.parse(value) if value else None
+
+
+def client_ip(request) -> str:
+    """The client address, taken from X-Forwarded-For as written by RATELIMIT_PROXY_COUNT trusted proxies.
+    Entries left of those are supplied by the client and could be forged."""
+    proxies = getattr(settings, 'RATELIMIT_PROXY_COUNT', 1)
+    forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+    if proxies and len(forwarded) >= proxies:
+        return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def hit(name: str, key, rate: Rate, now: float | None = None) -> float:
+    """Take a token from the bucket; returns 0 if allowed, else the seconds until one is available."""
+    cache = caches[getattr(settings, 'RATELIMIT_CACHE', 'default')]
+    digest = hashlib.sha256(str(key).encode()).hexdigest()[:32]
+    cache_key = f'ratelimit:{name}:{digest}'
+    interval = rate.period / rate.count
+    now = time.time() if now is None else now
+    with _lock:
+        full_at = max(cache.get(cache_key, now), now) + interval
+        allowed_from = full_at - rate.period
+        if now < allowed_from:
+            return allowed_from - now
+        cache.set(cache_key, full_at, timeout=math.ceil(full_at - now) + 1)
+    return 0.0
+
+
+class RateLimitMixin:
+    """Check the view's token buckets before it runs.
+
+    ``rate_limits`` pairs a ``RATELIMITS`` name with a scope understood by
+    ``rate_limit_key()``: ``'user'``, ``'ip'``, ``'activity'`` (the
+    ``activity_id`` URL argument) or ``'username'`` (the posted field). Put the
+    mixin after ``LoginRequiredMixin`` so anonymous requests are redirected first.
+    """
+
+    rate_limits: tuple[tuple[str, str], ...] = ()
+    rate_limit_methods = ('POST',)
+
+    def rate_limit_key(self, request, scope: str, user):
+        if scope == 'user':
+            return user.pk if user is not None and user.is_authenticated else None
+        if scope == 'ip':
+            return client_ip(request)
+        if scope == 'activity':
+            return self.kwargs.get('activity_id')
+        if scope == 'username':
+            return (request.POST.get('username') or '').strip().lower() or None
+        raise ValueError(f'Unknown rate limit scope {scope!r}')
+
+    def check_rate_limits(self, request, user) -> float:
+        """0 if the request may proceed, else the number of seconds to wait."""
+        for name, scope in self.rate_limits:
+            rate = rate_for(name)
+            if rate is None:
+                continue
+            key = self.rate_limit_key(request, scope, user)
+            if key is None:
+                continue
+            wait = hit(name, key, rate)
+            if wait:
+                return wait
+        return 0.0
+
+    def rate_limited(self, request, retry_after: float):
+        response = JsonResponse({'success': False, 'error': _('请求过于频繁，请稍后再试')}, status=429)
+        response['Retry-After'] = str(math.ceil(retry_after))
+        return response
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in self.rate_limit_methods or not self.rate_limits:
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self._adispatch(request, *args, **kwargs)
+        wait = self.check_rate_limits(request, getattr(request, 'user', None))
+        if wait:
+            return self.rate_limited(request, wait)
+        return super().dispatch(request, *args, **kwargs)
+
+    async def _adispatch(self, request, *args, **kwargs):
+        user = await request.auser() if hasattr(request, 'auser') else None
+        wait = self.check_rate_limits(request, user)
+        if wait:
+            return self.rate_limited(request, wait)
+        return await super().dispatch(request, *args, **kwargs)
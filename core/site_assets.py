@@ -0,0 +1,134 @@
+"""Images derived from the uploaded site logo (favicon, apple-touch icon, header logo).
+
+Each variant is rendered once per logo *content* and stored under
+``SITE_ASSET_DIR`` as ``<digest>-<variant>.<ext>``. The digest doubles as a
+stable ETag, so every worker answers ``If-None-Match`` the same way. Replacing
+the logo changes the digest, which makes new files; ``invalidate()``, called
+by the site settings page, drops the old ones.
+"""
+import hashlib
+import io
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+
+
+@dataclass(frozen=True)
+class Variant:
+    name: str
+    extension: str
+    content_type: str
+    size: tuple[int, int]
+    # Fill colour for the padding; None keeps transparency.
+    background: tuple[int, int, int] | None = None
+    # Keep the aspect ratio and only bound the box instead of padding to a square.
+    fit: bool = False
+
+
+VARIANTS = {
+    'favicon': Variant('favicon', 'ico', 'image/x-icon', (48, 48)),
+    # iOS shows transparent pixels as black, so this one gets a white background.
+    'apple-touch-icon': Variant('apple-touch-icon', 'png', 'image/png', (180, 180), background=(255, 255, 255)),
+    # Twice the 28 px navbar height for high-density screens.
+    'header': Variant('header', 'png', 'image/png', (224, 56), fit=True),
+}
+
+
+@dataclass(frozen=True)
+class Asset:
+    path: Path
+    digest: str
+    variant: Variant
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.digest}-{self.variant.name}"'
+
+
+_digests: dict[str, tuple[tuple[int, int], str]] = {}
+_lock = threading.Lock()
+
+
+def asset_dir() -> Path:
+    return Path(getattr(settings, 'SITE_ASSET_DIR', Path(settings.MEDIA_ROOT) / 'derived'))
+
+
+def logo_digest(path: str) -> str:
+    """Content hash of the logo file; re-read only when its size or mtime changes."""
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _digests.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    with open(path, 'rb') as f:
+        digest = hashlib.file_digest(f, 'sha256').hexdigest()[:20]
+    _digests[path] = (version, digest)
+    return digest
+
+
+def render(logo_path: str, variant: Variant) -> bytes:
+    from PIL import Image  # only needed when a variant is missing
+
+    with Image.open(logo_path) as img:
+        img = img.convert('RGBA')
+        img.thumbnail(variant.size, Image.Resampling.LANCZOS)
+        if variant.fit:
+            canvas = img
+        else:
+            fill = (*variant.background, 255) if variant.background else (0, 0, 0, 0)
+            canvas = Image.new('RGBA', variant.size, fill)
+            offset = ((variant.size[0] - img.size[0]) // 2, (variant.size[1] - img.size[1]) // 2)
+            canvas.paste(img, offset, img)
+        if variant.background:
+            canvas = canvas.convert('RGB')
+        buffer = io.BytesIO()
+        if variant.extension == 'ico':
+            canvas.save(buffer, format='ICO', sizes=[(16, 16), (32, 32), (48, 48)])
+        else:
+            canvas.save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue()
+
+
+def get_asset(config, name: str) -> Asset | None:
+    """The rendered variant for the current logo, or None without a logo.
+    Raises OSError if the logo cannot be read or decoded."""
+    variant = VARIANTS[name]
+    if not config or not config.site_logo:
+        return None
+    logo_path = config.site_logo.path
+    digest = logo_digest(logo_path)
+    path = asset_dir() / f'{digest}-{variant.name}.{variant.extension}'
+    if not path.exists():
+        with _lock:
+            if not path.exists():
+                data = render(logo_path, variant)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+                tmp.write_bytes(data)
+                os.replace(tmp, path)  # other workers never see a half-written file
+    return Asset(path, digest, variant)
+
+
+def invalidate(config=None) -> int:
+    """Forget cached digests and delete variants of logos other than the current one."""
+    keep = None
+    if config is not None and config.site_logo:
+        try:
+            keep = logo_digest(config.site_logo.path)
+        except OSError:
+            pass
+    with _lock:
+        _digests.clear()
+        removed = 0
+        directory = asset_dir()
+        if not directory.is_dir():
+            return 0
+        for path in directory.iterdir():
+            if keep and path.name.startswith(f'{keep}-'):
+                continue
+            path.unlink(missing_ok=True)
+            removed += 1
+        return removed
@@ -0,0 +1,85 @@
+"""Measure what a fresh worker imports, how long it takes and how much memory it uses.
+
+``measure()`` starts a child interpreter with ``-X importtime`` that boots Django
+the way a gunicorn worker does: ``django.setup()``, the WSGI handler (which
+builds the middleware stack) and the URLconf (which imports every view). It
+then parses the report on stderr.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+HEAVY_MODULES = ('PIL', 'qrcode', 'openpyxl', 'cryptography')
+
+_BOOT = '''
+import json, os, resource, sys
+import django
+django.setup()
+from django.core.handlers.wsgi import WSGIHandler
+from django.urls import get_resolver
+WSGIHandler()
+get_resolver().url_patterns
+try:
+    # Peak RSS of this image; ru_maxrss can include the parent's memory from before exec().
+    with open("/proc/self/status") as status:
+        maxrss_kb = next(int(line.split()[1]) for line in status if line.startswith("VmHWM:"))
+except (OSError, StopIteration):
+    maxrss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "modules": sorted(m for m in sys.modules if "." not in m),
+    "maxrss_kb": maxrss_kb,
+}))
+'''
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+@dataclass
+class ImportTime:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+@dataclass
+class StartupReport:
+    imports: list[ImportTime] = field(default_factory=list)
+    top_level_modules: list[str] = field(default_factory=list)
+    maxrss_kb: int = 0
+
+    @property
+    def total_us(self) -> int:
+        return sum(entry.self_us for entry in self.imports)
+
+    def slowest(self, limit: int = 25) -> list[ImportTime]:
+        return sorted(self.imports, key=lambda entry: entry.cumulative_us, reverse=True)[:limit]
+
+    def loaded(self, module: str) -> bool:
+        return module in self.top_level_modules
+
+
+def measure(settings_module: str | None = None) -> StartupReport:
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module or os.environ.get('DJANGO_SETTINGS_MODULE', ''))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _BOOT],
+        cwd=settings.BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    report = StartupReport()
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            report.imports.append(ImportTime(module, int(self_us), int(cumulative_us), len(indent) // 2))
+    data = json.loads(result.stdout.strip().splitlines()[-1])
+    report.top_level_modules = data['modules']
+    report.maxrss_kb = data['maxrss_kb']
+    return report
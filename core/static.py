@@ -0,0 +1,148 @@
+"""Serve collected static files from the application (no web server needed).
+
+Files are looked up in an index of ``STATIC_ROOT`` built on first use, so a
+request costs a dictionary lookup and a file open. Files named in the
+manifest with a content hash are served with ``Cache-Control: immutable``
+for a year; other files get a short max-age. A ``.br`` or ``.gz`` variant is
+chosen from ``Accept-Encoding`` when ``collectstatic`` produced one.
+"""
+import json
+import mimetypes
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# (Accept-Encoding token, file suffix), most preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+_TOKEN = re.compile(r'\s*([a-z*]+)\s*(?:;\s*q=([0-9.]+))?', re.IGNORECASE)
+
+
+@dataclass
+class StaticFile:
+    path: Path
+    content_type: str
+    size: int
+    mtime: float
+    cache_control: str
+    etag: str
+    variants: dict[str, tuple[Path, int]] = field(default_factory=dict)
+
+
+class StaticIndex:
+    def __init__(self, root: Path, url_prefix: str, max_age: int):
+        self.root = Path(root)
+        self.url_prefix = url_prefix
+        self.max_age = max_age
+        self.files: dict[str, StaticFile] = {}
+        self._build()
+
+    def _immutable_names(self) -> set[str]:
+        try:
+            manifest = json.loads((self.root / 'staticfiles.json').read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return set()
+        return set(manifest.get('paths', {}).values())
+
+    def _build(self) -> None:
+        if not self.root.is_dir():
+            return
+        immutable = self._immutable_names()
+        suffixes = tuple(suffix for _, suffix in ENCODINGS)
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(suffixes) or filename == 'staticfiles.json':
+                    continue
+                path = Path(dirpath) / filename
+                name = path.relative_to(self.root).as_posix()
+                stat = path.stat()
+                content_type, _ = mimetypes.guess_type(filename)
+                entry = StaticFile(
+                    path=path,
+                    content_type=content_type or 'application/octet-stream',
+                    size=stat.st_size,
+                    mtime=stat.st_mtime,
+                    cache_control=IMMUTABLE if name in immutable else f'public, max-age={self.max_age}',
+                    etag=f'"{int(stat.st_mtime):x}-{stat.st_size:x}"',
+                )
+                for encoding, suffix in ENCODINGS:
+                    variant = path.with_name(filename + suffix)
+                    if variant.exists():
+                        entry.variants[encoding] = (variant, variant.stat().st_size)
+                self.files[self.url_prefix + name] = entry
+
+    def lookup(self, url_path: str) -> StaticFile | None:
+        return self.files.get(url_path)
+
+
+def accepted_encodings(header: str) -> set[str]:
+    accepted = set()
+    for part in header.split(','):
+        match = _TOKEN.match(part)
+        if match and (match.group(2) is None or float(match.group(2) or 0) > 0):
+            accepted.add(match.group(1).lower())
+    return accepted
+
+
+def serve(request, entry: StaticFile):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponse(status=405, headers={'Allow': 'GET, HEAD'})
+
+    encoding, path, size = None, entry.path, entry.size
+    if entry.variants:
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        for candidate, _suffix in ENCODINGS:
+            if candidate in accepted and candidate in entry.variants:
+                encoding = candidate
+                path, size = entry.variants[candidate]
+                break
+    etag = entry.etag if encoding is None else f'{entry.etag[:-1]}-{encoding}"'
+
+    headers = {'Cache-Control': entry.cache_control, 'ETag': etag, 'Last-Modified': http_date(entry.mtime)}
+    if entry.variants:
+        headers['Vary'] = 'Accept-Encoding'
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (if_none_match == '*' or etag in (tag.strip() for tag in if_none_match.split(','))):
+        response = HttpResponseNotModified()
+        for key, value in headers.items():
+            response[key] = value
+        return response
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=entry.content_type)
+    else:
+        response = FileResponse(path.open('rb'), content_type=entry.content_type)
+        response.headers.pop('Content-Disposition', None)
+    response['Content-Length'] = str(size)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    for key, value in headers.items():
+        response[key] = value
+    return response
+
+
+_index: StaticIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> StaticIndex:
+    global _index
+    if _index is None or _index.root != Path(settings.STATIC_ROOT):
+        with _index_lock:
+            if _index is None or _index.root != Path(settings.STATIC_ROOT):
+                _index = StaticIndex(
+                    settings.STATIC_ROOT, settings.STATIC_URL, getattr(settings, 'STATIC_MAX_AGE', 300)
+                )
+    return _index
+
+
+def reset() -> None:
+    global _index
+    with _index_lock:
+        _index = None
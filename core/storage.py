@@ -0,0 +1,81 @@
+"""Static files storage: content-hashed names plus precompressed variants.
+
+``collectstatic`` writes ``name.<hash>.ext`` for every file, rewrites the
+references inside CSS, and stores ``.gz`` (and ``.br`` when the optional
+``brotli`` package is installed) next to every compressible file. The variants
+are only kept when they are actually smaller. ``core.static`` serves the
+variants.
+"""
+import gzip
+import logging
+from pathlib import Path
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_SUFFIXES = frozenset({'.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.ico', '.xml'})
+MIN_COMPRESS_SIZE = 512
+
+
+def compress_file(path: Path) -> list[Path]:
+    """Write path.gz / path.br if they save space; returns the files written."""
+    data = path.read_bytes()
+    written = []
+    variants = [('.gz', lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', lambda raw: brotli.compress(raw, quality=11)))
+    for suffix, compress in variants:
+        compressed = compress(data)
+        target = path.with_name(path.name + suffix)
+        if len(compressed) < len(data) * 0.95:
+            target.write_bytes(compressed)
+            written.append(target)
+        else:
+            target.unlink(missing_ok=True)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def stored_name(self, name):
+        # Before the first collectstatic (development, tests) there is no manifest:
+        # fall back to the plain name instead of failing every {% static %} tag.
+        if not self.hashed_files and not self.manifest_storage.exists(self.manifest_name):
+            return name
+        return super().stored_name(name)
+
+    def url_converter(self, name, hashed_files, template=None):
+        converter = super().url_converter(name, hashed_files, template)
+
+        def convert(matchobj):
+            # Vendored bundles reference source maps that are not shipped
+            # (e.g. bootstrap.bundle.min.js.map): keep the reference as-is.
+            try:
+                return converter(matchobj)
+            except ValueError as exc:
+                logger.warning('%s: %s', name, exc)
+                return matchobj.group(0)
+
+        return convert
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed = []
+        for original, processed, was_processed in super().post_process(paths, dry_run=dry_run, **options):
+            if isinstance(was_processed, Exception):
+                yield original, processed, was_processed
+                continue
+            hashed.append(processed)
+            yield original, processed, was_processed
+        if dry_run:
+            return
+        for name in {*hashed, *paths}:
+            if not name or Path(name).suffix.lower() not in COMPRESSIBLE_SUFFIXES:
+                continue
+            path = Path(self.path(name))
+            if path.exists() and path.stat().st_size >= MIN_COMPRESS_SIZE:
+                compress_file(path)
@@ -0,0 +1,167 @@
+"""Shared fixtures and assertions for the view test suites."""
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from checkin.models import Activity, ActivityParticipation, CheckInRecord
+from core.models import SystemConfig
+
+User = get_user_model()
+
+FIXTURE_PASSWORD = 'Fixture-Passw0rd!'
+
+
+@dataclass
+class FixtureSize:
+    users: int
+    activities: int
+
+    # Every member participates in every activity and every other member has
+    # checked in, so per-row queries show up as growth between sizes.
+    checkin_every: int = 2
+
+
+SMALL = FixtureSize(users=5, activities=3)
+LARGE = FixtureSize(users=300, activities=40)
+
+
+@dataclass
+class Fixture:
+    admin: object
+    member: object
+    tester: object
+    activity: object
+    qr_activity: object
+    members: list = field(default_factory=list)
+    activities: list = field(default_factory=list)
+
+
+def seed(size: FixtureSize) -> Fixture:
+    """Create an installed site with users, open activities, participations and check-ins."""
+    SystemConfig.objects.update_or_create(pk=1, defaults={'installed': True})
+    now = timezone.now()
+
+    admin = User.objects.create_user('10000001', FIXTURE_PASSWORD, is_admin=True, is_staff=True, first_login=False)
+    tester = User.objects.create_user('10000002', FIXTURE_PASSWORD, is_test=True, first_login=False)
+    password = User.objects.get(pk=admin.pk).password
+    User.objects.bulk_create(
+        User(username=f'{20000000 + i}', first_name=f'Member {i}', password=password, first_login=False)
+        for i in range(size.users)
+    )
+    members = list(User.objects.filter(username__startswith='2').order_by('username'))
+
+    Activity.objects.bulk_create(
+        Activity(
+            name=f'Activity {i}',
+            start_time=now - timedelta(hours=1),
+            end_time=now + timedelta(hours=2),
+            qr_enabled=(i == 1),
+            location_enabled=(i == 2),
+            location_lat=31.23 if i == 2 else None,
+            location_lng=121.47 if i == 2 else None,
+            location_radius_m=500 if i == 2 else 0,
+            created_by=admin,
+        )
+        for i in range(size.activities)
+    )
+    activities = list(Activity.objects.order_by('name'))
+    ActivityParticipation.objects.bulk_create(
+        ActivityParticipation(activity=activity, user=user) for activity in activities for user in members
+    )
+    CheckInRecord.objects.bulk_create(
+        CheckInRecord(activity=activity, user=user, checkin_time=now, ip_address='127.0.0.1')
+        for activity in activities
+        for index, user in enumerate(members)
+        if index % size.checkin_every
+    )
+    return Fixture(
+        admin=admin,
+        member=members[0],
+        tester=tester,
+        activity=activities[0],
+        qr_activity=activities[1],
+        members=members,
+        activities=activities,
+    )
+
+
+@contextmanager
+def database_aliases(**aliases):
+    """Configure extra database aliases, e.g. in ``setUpClass`` before ``super()``.
+
+    Each value updates a copy of the ``default`` test database settings:
+    ``{'TEST': {'MIRROR': 'default'}}`` is a second connection to the same
+    database (a replica), ``{'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}``
+    a separate database, which is migrated first. The test class lists them
+    through ``databases = '__all__'``. TestCase transactions do not span
+    connections, so tests that read through a mirror should be
+    TransactionTestCases.
+    """
+    base = connections['default'].settings_dict
+    for alias, overrides in aliases.items():
+        test = {**base['TEST'], 'MIRROR': None, **overrides.get('TEST', {})}
+        options = base['OPTIONS'] if overrides.get('ENGINE', base['ENGINE']) == base['ENGINE'] else {}
+        connections.settings[alias] = {**base, 'OPTIONS': options, **overrides, 'TEST': test}
+    try:
+        for alias, overrides in aliases.items():
+            if not connections.settings[alias]['TEST']['MIRROR']:
+                call_command('migrate', database=alias, verbosity=0)
+        yield
+    finally:
+        for alias in aliases:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+
+
+class TestRunner(DiscoverRunner):
+    """Runs the suite over plain HTTP. The test client does not speak HTTPS, so with
+    SECURE_SSL_REDIRECT on (the default) every request would get a 301.
+
+    Tests tagged ``timing`` assert wall-clock limits that depend on the machine;
+    they only run when asked for with ``--tag timing``."""
+
+    opt_in_tags = {'timing'}
+
+    def __init__(self, *args, tags=None, exclude_tags=None, **kwargs):
+        exclude_tags = set(exclude_tags or ()) | (self.opt_in_tags - set(tags or ()))
+        super().__init__(*args, tags=tags, exclude_tags=exclude_tags, **kwargs)
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._plain_http = override_settings(SECURE_SSL_REDIRECT=False)
+        self._plain_http.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._plain_http.disable()
+        super().teardown_test_environment(**kwargs)
+
+
+class QueryBudgetMixin:
+    """Assertions for TestCase classes that pin the number of queries per request."""
+
+    def assertQueryBudget(self, budget: int, method: str, url: str, data=None, status: int = 200, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data or {}, **extra)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        self.assertEqual(response.status_code, status, f'{method.upper()} {url}')
+        if len(queries) > budget:
+            statements = '\n'.join(f'{i}. {q["sql"]}' for i, q in enumerate(queries.captured_queries, 1))
+            self.fail(f'{method.upper()} {url} ran {len(queries)} queries, budget is {budget}:\n{statements}')
+        return response
+
+    @contextmanager
+    def assertFasterThan(self, seconds: float, label: str):
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, seconds, f'{label} took {elapsed:.3f}s, limit is {seconds:.3f}s')
@@ -0,0 +1,769 @@
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import logging
+import tarfile
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock, skipIf
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, tag
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from checkin.models import Activity
+from core.models import SystemConfig
+from core.testing import FIXTURE_PASSWORD, SMALL, database_aliases, seed
+
+from . import (
+    checks, cpu_profiler, db_routers, health, metrics, query_profiler, ratelimit, site_assets, startup, static, warmup,
+)
+from .singleflight import SingleFlight
+from .middleware import ConcurrencyLimitMiddleware, CpuProfilerMiddleware, MetricsMiddleware, QueryProfilerMiddleware
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        self.metrics_dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(METRICS_DIR=self.metrics_dir, METRICS_TOKEN='scrape-token'))
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+
+    def test_snapshots_of_workers_are_merged(self):
+        other_worker = metrics.MetricsRegistry()
+        for registry in (metrics.registry, other_worker):
+            registry.record_request('checkin:dashboard', 'GET', 200, 0.03, 512, 4, 0.01)
+        metrics.registry.flush()
+        (self.metrics_dir / '999999.json').write_text(json.dumps(other_worker.snapshot()))
+
+        text = metrics.render(*metrics.collect())
+        self.assertIn(
+            'neosign_http_requests_total{view="checkin:dashboard",method="GET",status="200"} 2', text
+        )
+        self.assertIn('neosign_http_request_duration_seconds_bucket{view="checkin:dashboard",le="0.05"} 2', text)
+        self.assertIn('neosign_http_request_duration_seconds_count{view="checkin:dashboard"} 2', text)
+        self.assertIn('neosign_http_response_bytes_total{view="checkin:dashboard"} 1024', text)
+        self.assertIn('neosign_db_queries_per_request_bucket{view="checkin:dashboard",le="2"} 0', text)
+        self.assertIn('neosign_db_queries_per_request_bucket{view="checkin:dashboard",le="5"} 2', text)
+
+    @skipIf(metrics.fcntl is None, 'snapshots are only folded where fcntl is available')
+    def test_exited_workers_are_retained(self):
+        def worker(requests):
+            registry = metrics.MetricsRegistry()
+            for _ in range(requests):
+                registry.record_request('checkin:dashboard', 'GET', 200, 0.03, 512, 4, 0.01)
+            with mock.patch.object(metrics.os, 'getpid', return_value=4242):
+                registry.flush()
+
+        def total():
+            counters, _ = metrics.collect()
+            return counters[('neosign_http_requests_total', (
+                ('view', 'checkin:dashboard'), ('method', 'GET'), ('status', '200')
+            ))]
+
+        worker(2)
+        worker(1)  # a new worker that got the pid of the exited one
+        with mock.patch.object(metrics, '_process_running', return_value=True):
+            self.assertEqual(total(), 3)
+            self.assertEqual(len(list(self.metrics_dir.glob('4242-*.json'))), 1)
+            self.assertEqual(total(), 3)
+        with mock.patch.object(metrics, '_process_running', return_value=False):
+            self.assertEqual(total(), 3)
+        self.assertEqual(sorted(path.name for path in self.metrics_dir.glob('*.json')), [metrics.RETAINED])
+
+    def test_endpoint_requires_admin_or_token(self):
+        url = reverse('core:metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.data.member)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.logout()
+
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_login(self.data.admin)
+        self.client.get(reverse('management:activity_list'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertContains(response, 'neosign_http_requests_total{view="management:activity_list",method="GET",status="200"} 1')
+        self.assertContains(response, 'neosign_db_query_seconds_total{view="management:activity_list"}')
+
+    @override_settings(METRICS_FLUSH_INTERVAL=3600)
+    def test_middleware_does_no_io_per_request(self):
+        request = RequestFactory().get('/')
+        middleware = MetricsMiddleware(lambda request: HttpResponse('ok'))
+        registry = metrics.registry
+        with mock.patch.object(registry, 'record_request', wraps=registry.record_request) as record, \
+                mock.patch.object(registry, 'flush') as flush, CaptureQueriesContext(connection) as queries:
+            for _ in range(100):
+                middleware(request)
+        self.assertEqual(record.call_count, 100)
+        self.assertLessEqual(flush.call_count, 1)
+        self.assertEqual(len(queries), 0)
+
+    @tag('timing')
+    def test_middleware_overhead_is_negligible(self):
+        request = RequestFactory().get('/')
+
+        def view(request):
+            return HttpResponse('ok')
+
+        def per_request(handler, rounds=2000):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                handler(request)
+            return (time.perf_counter() - start) / rounds
+
+        instrumented = MetricsMiddleware(view)
+        per_request(instrumented, 200)  # warm up
+        overhead = min(per_request(instrumented) - per_request(view) for _ in range(3))
+        self.assertLess(overhead, 0.0002, f'metrics middleware adds {overhead * 1e6:.0f}µs per request')
+
+
+def n_plus_one_view(request):
+    names = [Activity.objects.get(pk=pk).name for pk in Activity.objects.values_list('pk', flat=True)]
+    return HttpResponse(', '.join(names))
+
+
+class QueryProfilerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        log = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'profiles.jsonl'
+        self.enterContext(
+            override_settings(
+                QUERY_PROFILER_LOG=log,
+                QUERY_PROFILER_SAMPLE_RATE=0,
+                QUERY_PROFILER_REPEAT_THRESHOLD=len(self.data.activities),
+            )
+        )
+        # Keep findings out of the test output; assertLogs still sees them.
+        self.enterContext(mock.patch.object(query_profiler.logger, 'handlers', [logging.NullHandler()]))
+
+    def _request(self, user, **headers):
+        request = RequestFactory().get('/n-plus-one/', headers=headers)
+        request.user = user
+        return request
+
+    def test_only_admins_switch_profiling_on(self):
+        middleware = QueryProfilerMiddleware(n_plus_one_view)
+        response = middleware(self._request(self.data.member, **{'X-NeoSign-Profile': '1'}))
+        self.assertNotIn('X-NeoSign-Queries', response)
+        self.assertEqual(query_profiler.recent_reports(), [])
+
+        response = middleware(self._request(self.data.admin, **{'X-NeoSign-Profile': '1'}))
+        self.assertEqual(response['X-NeoSign-Queries'], str(1 + len(self.data.activities)))
+
+    def test_sampling_profiles_anonymous_requests(self):
+        with override_settings(QUERY_PROFILER_SAMPLE_RATE=1):
+            response = QueryProfilerMiddleware(n_plus_one_view)(self._request(AnonymousUser()))
+        self.assertIn('X-NeoSign-Queries', response)
+
+    def test_repeated_and_slow_queries_are_reported(self):
+        request = self._request(self.data.admin, **{'X-NeoSign-Profile': '1'})
+        with self.assertLogs('neosign.queries', logging.WARNING) as logs, override_settings(QUERY_PROFILER_SLOW_MS=0):
+            QueryProfilerMiddleware(n_plus_one_view)(request)
+
+        (report,) = query_profiler.recent_reports()
+        self.assertEqual(report['user'], self.data.admin.username)
+        repeated = [f for f in report['findings'] if f['kind'] == 'repeated']
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0]['count'], len(self.data.activities))
+        self.assertRegex(repeated[0]['origin'], r'^core/tests\.py:\d+ \(<listcomp>|n_plus_one_view\)')
+        self.assertTrue(any(f['kind'] == 'slow' for f in report['findings']))
+
+        logged = [json.loads(line.split(':', 2)[2]) for line in logs.output]
+        self.assertEqual(len(logged), len(report['findings']))
+        self.assertEqual(logged[0]['path'], '/n-plus-one/')
+
+    def test_in_lists_share_a_shape(self):
+        self.assertEqual(
+            query_profiler.query_shape('SELECT 1 WHERE id IN (%s, %s)'),
+            query_profiler.query_shape('SELECT 1\n WHERE id IN (%s)'),
+        )
+
+    def test_management_page(self):
+        self.client.force_login(self.data.admin)
+        url = reverse('management:query_profiles')
+        response = self.client.get(url, HTTP_X_NEOSIGN_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-NeoSign-Queries', response)
+
+        QueryProfilerMiddleware(n_plus_one_view)(self._request(self.data.admin, **{'X-NeoSign-Profile': '1'}))
+        response = self.client.get(url)
+        self.assertContains(response, '/n-plus-one/')
+
+        self.client.force_login(self.data.member)
+        self.assertRedirects(self.client.get(url), reverse('checkin:dashboard'), fetch_redirect_response=False)
+
+
+def busy_view(request):
+    deadline = time.perf_counter() + 0.05
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(100))
+    return HttpResponse(str(total))
+
+
+class CpuProfilerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        self.profile_dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(
+            override_settings(
+                CPU_PROFILER_DIR=self.profile_dir,
+                CPU_PROFILER_PATHS=[r'^/manage/users/'],
+                CPU_PROFILER_SAMPLE_RATE=1,
+                CPU_PROFILER_INTERVAL_MS=1,
+            )
+        )
+
+    def test_only_matching_paths_are_profiled(self):
+        middleware = CpuProfilerMiddleware(busy_view)
+        middleware(RequestFactory().get('/checkin/'))
+        self.assertEqual(cpu_profiler.list_profiles(), [])
+
+        middleware(RequestFactory().get('/manage/users/'))
+        (profile,) = cpu_profiler.list_profiles()
+        collapsed = (self.profile_dir / profile.name).read_text()
+        self.assertIn('core.tests:busy_view', collapsed)
+        stack, count = collapsed.splitlines()[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+
+    def test_download(self):
+        CpuProfilerMiddleware(busy_view)(RequestFactory().get('/manage/users/'))
+        (profile,) = cpu_profiler.list_profiles()
+        url = reverse('management:cpu_profile_download', args=[profile.name])
+
+        self.client.force_login(self.data.member)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.data.admin)
+        self.assertContains(self.client.get(reverse('management:cpu_profiles')), profile.name)
+        response = self.client.get(url)
+        self.assertIn(b'core.tests:busy_view', b''.join(response.streaming_content))
+        response = self.client.get(url, {'format': 'svg'})
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertContains(response, '<title>core.tests:busy_view')
+        self.assertEqual(
+            self.client.get(reverse('management:cpu_profile_download', args=['..settings.collapsed'])).status_code,
+            404,
+        )
+
+
+class HealthCheckTests(TestCase):
+    def setUp(self):
+        health.reset()
+        self.addCleanup(health.reset)
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+
+    def test_healthz_needs_no_database(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/healthz', HTTP_HOST='10.0.0.5')
+        self.assertEqual(response.json(), {'status': 'ok'})
+        self.assertEqual(metrics.registry.snapshot()['counters'], [])
+
+    def test_readyz_is_cached(self):
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['checks'], {'database': 'ok', 'migrations': 'ok'})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/readyz/').status_code, 200)
+
+        with override_settings(HEALTH_READY_CACHE_SECONDS=0), self.assertNumQueries(1):
+            self.client.get('/readyz')
+
+    def test_readyz_reports_database_errors(self):
+        with mock.patch.object(health, '_check_database', side_effect=OperationalError('down')):
+            response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['checks'], {'database': 'error', 'error': 'OperationalError'})
+
+    def test_readyz_reports_pending_migrations(self):
+        with mock.patch.object(health.MigrationExecutor, 'migration_plan', return_value=[('plan', False)]):
+            response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['checks']['migrations'], 'pending')
+
+
+class StartupBudgetTests(SimpleTestCase):
+    """A fresh worker must not import optional heavy libraries or outgrow its budget."""
+
+    # Measured about 290 ms / 616 modules / 54 MiB; before lazy imports 520 ms / 879 / 68 MiB.
+    MAX_IMPORT_MS = 1000
+    MAX_MODULES = 700
+    MAX_RSS_MIB = 64
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.report = startup.measure()
+
+    def test_heavy_modules_are_lazy(self):
+        eager = [module for module in startup.HEAVY_MODULES if self.report.loaded(module)]
+        self.assertEqual(eager, [])
+
+    def test_module_budget(self):
+        self.assertLess(len(self.report.imports), self.MAX_MODULES)
+
+    @tag('timing')
+    def test_time_and_memory_budget(self):
+        self.assertLess(self.report.total_us / 1000, self.MAX_IMPORT_MS)
+        self.assertLess(self.report.maxrss_kb / 1024, self.MAX_RSS_MIB)
+
+
+class WarmupTests(TransactionTestCase):
+    def setUp(self):
+        self.key_dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(LOGIN_KEY_DIR=self.key_dir))
+
+    def test_warm_up_closes_connections(self):
+        report = warmup.warm_up(import_optional=False)
+        self.assertEqual(list(report.steps), ['keys', 'urls', 'templates', 'config'])
+        self.assertGreater(report.templates, 10)
+        self.assertTrue((self.key_dir / 'login_private.pem').exists())
+        self.assertIsNone(connection.connection)
+
+    def test_mismatched_keys_are_rejected(self):
+        warmup.load_login_keys()
+        (self.key_dir / 'login_public.pem').unlink()
+        other_dir = self.key_dir / 'other'
+        with override_settings(LOGIN_KEY_DIR=other_dir):
+            warmup.load_login_keys()
+        (other_dir / 'login_public.pem').rename(self.key_dir / 'login_public.pem')
+        with self.assertRaises(ImproperlyConfigured):
+            warmup.load_login_keys()
+
+
+class VendorJsqrTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.base = Path(tmp.name)
+        self.script = b'/* jsQR */'
+        self.tarball = self.base / 'jsqr-1.4.0.tgz'
+        with tarfile.open(self.tarball, 'w:gz') as archive:
+            for name, data in (('package/dist/jsQR.js', self.script), ('package/LICENSE', b'Apache License')):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+
+    def integrity(self, data):
+        return 'sha512-' + base64.b64encode(hashlib.sha512(data).digest()).decode()
+
+    def test_verified_tarball_is_stored(self):
+        integrity = self.integrity(self.tarball.read_bytes())
+        with override_settings(BASE_DIR=self.base):
+            call_command('vendor_jsqr', tarball=str(self.tarball), integrity=integrity, stdout=io.StringIO())
+        vendor = self.base / 'assets' / 'js' / 'vendor'
+        header, script = (vendor / 'jsQR.js').read_bytes().split(b'\n', 1)
+        self.assertEqual(script, self.script)
+        self.assertIn(b'Apache-2.0', header)
+        self.assertIn(integrity.encode(), header)
+        self.assertEqual((vendor / 'jsQR.LICENSE').read_bytes(), b'Apache License')
+
+    def test_integrity_mismatch_is_refused(self):
+        with override_settings(BASE_DIR=self.base), self.assertRaisesMessage(CommandError, 'Integrity check failed'):
+            call_command('vendor_jsqr', tarball=str(self.tarball), integrity=self.integrity(b'other'))
+        self.assertFalse((self.base / 'assets').exists())
+
+    def test_deploy_check_warns_without_the_vendored_copy(self):
+        with mock.patch('core.checks.finders.find', return_value=None):
+            self.assertEqual([w.id for w in checks.check_vendored_jsqr(None)], ['core.W002'])
+        with mock.patch('core.checks.finders.find', return_value='/srv/assets/js/vendor/jsQR.js'):
+            self.assertEqual(checks.check_vendored_jsqr(None), [])
+
+    def test_url_is_resolved_once(self):
+        from checkin.views import JSQR_CDN_URL, jsqr_url
+
+        jsqr_url.cache_clear()
+        self.addCleanup(jsqr_url.cache_clear)
+        with mock.patch('checkin.views.finders.find', return_value=None) as find:
+            self.assertEqual(jsqr_url(), JSQR_CDN_URL)
+            self.assertEqual(jsqr_url(), JSQR_CDN_URL)
+        find.assert_called_once_with('js/vendor/jsQR.js')
+
+
+class StaticFilesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = Path(cls.enterClassContext(tempfile.TemporaryDirectory()))
+        cls.enterClassContext(override_settings(STATIC_ROOT=cls.root, STATIC_SERVE=True))
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def setUp(self):
+        static.reset()
+        self.addCleanup(static.reset)
+        self.css = staticfiles_storage.url('css/bootstrap.min.css')
+
+    def test_collectstatic_writes_hashed_and_compressed_files(self):
+        self.assertRegex(self.css, r'^/static/css/bootstrap\.min\.[0-9a-f]{12}\.css$')
+        hashed = self.root / self.css.removeprefix('/static/')
+        self.assertTrue(hashed.with_name(hashed.name + '.gz').exists())
+        # Too small to be worth compressing
+        self.assertFalse((self.root / 'css' / 'style.css.gz').exists())
+
+    def test_hashed_file_is_immutable_and_precompressed(self):
+        response = self.client.get(self.css, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], static.IMMUTABLE)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertNotIn('Content-Disposition', response)
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), int(response['Content-Length']))
+
+        plain = self.client.get(self.css, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertGreater(int(plain['Content-Length']), len(body))
+        self.assertNotEqual(plain['ETag'], response['ETag'])
+
+        cached = self.client.get(self.css, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_unhashed_name_gets_short_max_age(self):
+        with override_settings(STATIC_MAX_AGE=60):
+            response = self.client.head('/static/css/style.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+
+    def test_unknown_file_falls_through(self):
+        self.assertEqual(self.client.get('/static/css/missing.css').status_code, 404)
+
+
+def png_bytes(color, size=(64, 40)):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class SiteLogoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        media = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(MEDIA_ROOT=media, SITE_ASSET_DIR=media / 'derived'))
+        self.asset_dir = media / 'derived'
+        self.addCleanup(site_assets.invalidate)
+        self.config = SystemConfig.objects.get(pk=1)
+        self.config.site_logo = SimpleUploadedFile('logo.png', png_bytes('red'))
+        self.config.save()
+
+    def test_variants_are_rendered_once_with_stable_etag(self):
+        with mock.patch.object(site_assets, 'render', wraps=site_assets.render) as render:
+            first = self.client.get('/favicon.ico')
+            second = self.client.get('/favicon.ico')
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first['Content-Type'], 'image/x-icon')
+        self.assertEqual(first['ETag'], second['ETag'])
+        digest = site_assets.logo_digest(self.config.site_logo.path)
+        self.assertEqual(first['ETag'], f'"{digest}-favicon"')
+
+        cached = self.client.get('/favicon.ico', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(b''.join(first.streaming_content)[:4], b'\x00\x00\x01\x00')
+
+        touch = self.client.get('/apple-touch-icon.png?v=1')
+        self.assertEqual(touch['Cache-Control'], 'public, max-age=31536000, immutable')
+        header = self.client.get(reverse('core:site_logo', args=['header']))
+        self.assertEqual(header['Content-Type'], 'image/png')
+        self.assertEqual(len(list(self.asset_dir.iterdir())), 3)
+        self.assertEqual(self.client.get(reverse('core:site_logo', args=['other'])).status_code, 404)
+
+    def test_site_settings_replace_and_clear_logo(self):
+        old_etag = self.client.get('/favicon.ico')['ETag']
+        self.client.login(username=self.data.admin.username, password=FIXTURE_PASSWORD)
+        form = {
+            'site_title': 'NeoSign', 'password_length': 8, 'password_symbols': '!@#',
+            'username_display_mode': self.config.username_display_mode,
+            'username_masking_mode': self.config.username_masking_mode,
+            'language_code': 'zh-hans', 'timezone_str': 'Asia/Shanghai',
+        }
+        response = self.client.post(
+            reverse('management:site_settings'), {**form, 'site_logo': SimpleUploadedFile('new.png', png_bytes('blue'))}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(self.asset_dir.iterdir()), [])
+        new_etag = self.client.get('/favicon.ico')['ETag']
+        self.assertNotEqual(new_etag, old_etag)
+        self.assertEqual(self.client.get('/favicon.ico', HTTP_IF_NONE_MATCH=old_etag).status_code, 200)
+
+        self.client.post(reverse('management:site_settings'), {**form, 'site_logo-clear': 'on'})
+        self.assertEqual(list(self.asset_dir.iterdir()), [])
+        self.assertEqual(self.client.get('/favicon.ico').status_code, 404)
+
+
+class AsyncMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        self.enterContext(override_settings(METRICS_DIR=Path(self.enterContext(tempfile.TemporaryDirectory()))))
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+
+    def test_whole_stack_is_async_capable(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        for path in settings.MIDDLEWARE:
+            middleware = import_string(path)(get_response)
+            self.assertTrue(iscoroutinefunction(middleware), f'{path} would need a sync/async adapter')
+
+    async def test_concurrency_limit_queues_requests(self):
+        running = peak = 0
+
+        async def view(request):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return HttpResponse()
+
+        with override_settings(ASGI_MAX_CONCURRENT_REQUESTS=2):
+            middleware = ConcurrencyLimitMiddleware(view)
+        request = RequestFactory().get('/')
+        responses = await asyncio.gather(*(middleware(request) for _ in range(6)))
+        self.assertEqual([r.status_code for r in responses], [200] * 6)
+        self.assertEqual(peak, 2)
+
+    async def test_concurrency_limit_sheds_load(self):
+        release = asyncio.Event()
+
+        async def view(request):
+            await release.wait()
+            return HttpResponse()
+
+        with override_settings(ASGI_MAX_CONCURRENT_REQUESTS=1, ASGI_MAX_QUEUED_REQUESTS=1, ASGI_QUEUE_TIMEOUT=0.05):
+            middleware = ConcurrencyLimitMiddleware(view)
+        request = RequestFactory().get('/')
+        running = asyncio.ensure_future(middleware(request))
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(middleware(request))
+        await asyncio.sleep(0)
+        # The queue is full: turned away at once.
+        rejected = await middleware(request)
+        self.assertEqual(rejected.status_code, 503)
+        self.assertEqual(rejected['Retry-After'], '1')
+        # The queued one gives up after ASGI_QUEUE_TIMEOUT.
+        self.assertEqual((await queued).status_code, 503)
+        release.set()
+        self.assertEqual((await running).status_code, 200)
+        self.assertEqual((await middleware(request)).status_code, 200)
+
+    async def test_requests_through_the_async_stack(self):
+        response = await self.async_client.get('/healthz')
+        self.assertEqual(response.json(), {'status': 'ok'})
+
+        await self.async_client.aforce_login(self.data.member)
+        response = await self.async_client.get(reverse('checkin:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        snapshot = metrics.registry.snapshot()
+        view = ('view', 'checkin:dashboard')
+        self.assertIn(
+            ['neosign_http_requests_total', [view, ('method', 'GET'), ('status', '200')], 1.0], snapshot['counters']
+        )
+        # Queries run by the ORM in sync_to_async threads are still counted.
+        query_sums = {h[1][0]: h[2][-1] for h in snapshot['histograms'] if h[0] == 'neosign_db_queries_per_request'}
+        self.assertGreater(query_sums[view], 0)
+
+        self.data.member.first_login = True
+        await self.data.member.asave(update_fields=['first_login'])
+        response = await self.async_client.get(reverse('checkin:dashboard'))
+        self.assertRedirects(response, reverse('authentication:password_change_required'), fetch_redirect_response=False)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def run_concurrently(self, flight, fn, count=8):
+        results, errors = [], []
+        barrier = threading.Barrier(count)
+
+        def worker():
+            barrier.wait()
+            try:
+                results.append(flight.do('key', fn))
+            except ValueError as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_misses_share_one_call(self):
+        calls = []
+
+        def load():
+            calls.append(1)
+            time.sleep(0.1)
+            return object()
+
+        flight = SingleFlight()
+        results, _ = self.run_concurrently(flight, load)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 8)
+        self.assertEqual(len({id(result) for result in results}), 1)
+        # Finished calls are not remembered; caching the result is the caller's job.
+        flight.do('key', load)
+        self.assertEqual(len(calls), 2)
+
+    def test_error_reaches_every_waiter(self):
+        def fail():
+            time.sleep(0.1)
+            raise ValueError('database down')
+
+        results, errors = self.run_concurrently(SingleFlight(), fail)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 8)
+
+
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'ratelimit-tests'}}))
+
+    def test_parse(self):
+        self.assertEqual(ratelimit.Rate.parse('30/m'), ratelimit.Rate(30, 60))
+        for value in ('30', '0/m', '5/w', 'x/s'):
+            with self.assertRaises(ValueError):
+                ratelimit.Rate.parse(value)
+
+    def test_bucket_allows_burst_then_refills(self):
+        rate = ratelimit.Rate(3, 3)  # 3 tokens, one back per second
+        now = 1000.0
+        self.assertEqual([ratelimit.hit('t', 'k', rate, now) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(ratelimit.hit('t', 'k', rate, now), 1.0)
+        self.assertEqual(ratelimit.hit('t', 'other', rate, now), 0)
+        self.assertAlmostEqual(ratelimit.hit('t', 'k', rate, now + 0.5), 0.5)
+        self.assertEqual(ratelimit.hit('t', 'k', rate, now + 1), 0)
+        self.assertGreater(ratelimit.hit('t', 'k', rate, now + 1), 0)
+        # A full refill after a quiet period, but never more than the burst.
+        self.assertEqual([ratelimit.hit('t', 'k', rate, now + 60) for _ in range(3)], [0, 0, 0])
+        self.assertGreater(ratelimit.hit('t', 'k', rate, now + 60), 0)
+
+    def test_client_ip_trusts_only_configured_proxies(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='6.6.6.6, 203.0.113.7')
+        self.assertEqual(ratelimit.client_ip(request), '203.0.113.7')
+        with override_settings(RATELIMIT_PROXY_COUNT=2):
+            self.assertEqual(ratelimit.client_ip(request), '6.6.6.6')
+        with override_settings(RATELIMIT_PROXY_COUNT=0):
+            self.assertEqual(ratelimit.client_ip(request), '10.0.0.1')
+
+
+@override_settings(DB_REPLICA_ALIASES=['replica_a', 'replica_b'])
+class ReplicaRoutingTests(TransactionTestCase):
+    """Two replica aliases mirroring ``default``: separate connections to the same database."""
+    # The aliases only exist from setUpClass on; the test runner checks named ones earlier.
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        mirror = {'TEST': {'MIRROR': 'default'}}
+        cls.enterClassContext(database_aliases(replica_a=mirror, replica_b=mirror))
+        super().setUpClass()
+
+    def setUp(self):
+        db_routers.replica_health.reset()
+        self.addCleanup(db_routers.replica_health.reset)
+        self.data = seed(SMALL)
+        self.client.force_login(self.data.member)
+
+    def replica_queries(self):
+        contexts = [CaptureQueriesContext(connections[alias]) for alias in ('replica_a', 'replica_b')]
+        for context in contexts:
+            self.enterContext(context)
+        return contexts
+
+    def test_reads_use_one_replica_and_writes_the_primary(self):
+        with db_routers.request_scope(), db_routers.replica_reads() as state:
+            aliases = {Activity.objects.all().db for _ in range(20)}
+            self.assertEqual(len(aliases), 1)
+            self.assertIn(aliases.pop(), ('replica_a', 'replica_b'))
+            self.assertEqual(Activity.objects.count(), 3)
+            with CaptureQueriesContext(connection) as primary:
+                Activity.objects.filter(pk=self.data.activity.pk).update(name='renamed')
+            self.assertEqual(len(primary), 1)
+            # Read your own writes for the rest of the request.
+            self.assertTrue(state.wrote)
+            self.assertEqual(Activity.objects.all().db, 'default')
+        self.assertEqual(Activity.objects.all().db, 'default')
+
+    def test_dashboard_reads_from_replica(self):
+        replica_a, replica_b = self.replica_queries()
+        self.assertEqual(self.client.get(reverse('checkin:dashboard')).status_code, 200)
+        self.assertTrue(len(replica_a) + len(replica_b))
+        self.assertFalse(len(replica_a) and len(replica_b))
+
+    def test_pin_cookie_keeps_reads_on_primary(self):
+        response = self.client.post(reverse('checkin:checkin_api', args=[self.data.activity.pk]))
+        self.assertTrue(response.json()['success'])
+        self.assertIn(db_routers.PIN_COOKIE_NAME, response.cookies)
+
+        replica_a, replica_b = self.replica_queries()
+        response = self.client.get(reverse('checkin:dashboard'))
+        self.assertContains(response, '签到时间')
+        self.assertEqual(len(replica_a) + len(replica_b), 0)
+
+    def test_unhealthy_replica_falls_back_to_primary(self):
+        with mock.patch.object(db_routers.replica_health, '_probe', side_effect=lambda alias: alias == 'replica_b'):
+            with db_routers.request_scope(), db_routers.replica_reads():
+                self.assertEqual(Activity.objects.all().db, 'replica_b')
+        db_routers.replica_health.reset()
+        with mock.patch.object(db_routers.replica_health, '_probe', return_value=False):
+            with db_routers.request_scope(), db_routers.replica_reads():
+                self.assertEqual(Activity.objects.all().db, 'default')
+
+    def test_replica_errors_retry_on_primary(self):
+        # The probe passes, then the replica fails mid-request. The name is in a missing
+        # directory so that SQLite cannot create it either.
+        def missing(alias):
+            settings_dict = {**connections[alias].settings_dict, 'NAME': '/nonexistent/missing_replica'}
+            return mock.patch.object(connections[alias], 'settings_dict', settings_dict)
+
+        with mock.patch.object(db_routers.replica_health, '_probe', return_value=True), \
+                missing('replica_a'), missing('replica_b'):
+            connections['replica_a'].close()
+            connections['replica_b'].close()
+            response = self.client.get(reverse('checkin:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            db_routers.replica_health.is_available('replica_a') and db_routers.replica_health.is_available('replica_b')
+        )
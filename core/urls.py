@@ -1,8 +1,11 @@
 from django.urls import path
-from .views import FaviconView
+from .views import FaviconView, MetricsView, SiteLogoView
 
 app_name = 'core'
 
 urlpatterns = [
     path('favicon.ico', FaviconView.as_view(), name='favicon'),
+    path('apple-touch-icon.png', SiteLogoView.as_view(variant='apple-touch-icon'), name='apple_touch_icon'),
+    path('site-logo/<str:variant>/', SiteLogoView.as_view(), name='site_logo'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
@@ -1,45 +1,68 @@
-from django.http import FileResponse, HttpResponse, Http404
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, Http404
+from django.utils.crypto import constant_time_compare
 from django.views import View
-from PIL import Image
-import io
 
+from . import metrics, site_assets
 from .models import SystemConfig
 
 
-class FaviconView(View):
+class SiteLogoView(View):
+    """Favicon / apple-touch icon / header logo rendered from the site logo (see core.site_assets).
+    Validated by a content-hash ETag; URLs carrying ?v= are cached as immutable."""
+
+    variant = None
+
+    def get(self, request, variant=None):
+        name = variant or self.variant
+        if name not in site_assets.VARIANTS:
+            raise Http404('Unknown logo variant')
+        try:
+            asset = site_assets.get_asset(SystemConfig.objects.first(), name)
+        except OSError as e:
+            raise Http404(f'Error generating {name}: {e}')
+        if asset is None:
+            raise Http404('No site logo')
+
+        if request.GET.get('v'):
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'public, max-age=86400, must-revalidate'
+        if_none_match = request.headers.get('If-None-Match', '')
+        if asset.etag in (tag.strip() for tag in if_none_match.split(',')):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(asset.path.open('rb'), content_type=asset.variant.content_type)
+            response.headers.pop('Content-Disposition', None)
+        response['Cache-Control'] = cache_control
+        response['ETag'] = asset.etag
+        return response
+
+
+class FaviconView(SiteLogoView):
     """动态生成favicon.ico"""
-    
+
+    variant = 'favicon'
+
+
+class MetricsView(View):
+    """Prometheus text exposition of the request metrics of all workers.
+    Open to logged-in admins, and to scrapers sending `Authorization: Bearer <METRICS_TOKEN>`.
+    """
+
+    def _allowed(self, request) -> bool:
+        user = request.user
+        if user.is_authenticated and (user.is_admin or user.is_superuser):
+            return True
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        header = request.headers.get('Authorization', '')
+        return bool(token) and header.startswith('Bearer ') and constant_time_compare(header[7:], token)
+
     def get(self, request):
-        try:
-            config = SystemConfig.objects.first()
-            if not config or not config.site_logo:
-                raise Http404("No favicon available")
-            
-            # 读取上传的logo
-            logo_path = config.site_logo.path
-            
-            # 打开图片并转换为favicon大小
-            with Image.open(logo_path) as img:
-                # 转换为RGBA以支持透明度
-                img = img.convert('RGBA')
-                # 调整大小为32x32（favicon标准大小）
-                img.thumbnail((32, 32), Image.Resampling.LANCZOS)
-                
-                # 创建一个新的32x32图片，居中放置缩略图
-                favicon = Image.new('RGBA', (32, 32), (0, 0, 0, 0))
-                offset = ((32 - img.size[0]) // 2, (32 - img.size[1]) // 2)
-                favicon.paste(img, offset)
-                
-                # 保存为ICO格式
-                buffer = io.BytesIO()
-                favicon.save(buffer, format='ICO', sizes=[(32, 32)])
-                buffer.seek(0)
-                
-                response = HttpResponse(buffer.getvalue(), content_type='image/x-icon')
-                # 设置缓存控制头：验证器驱动的缓存，确保更新时立即刷新
-                response['Cache-Control'] = 'public, max-age=86400, must-revalidate'
-                response['ETag'] = f'"{config.site_logo.name}:{hash(config.site_logo.name)}"'
-                return response
-                
-        except Exception as e:
-            raise Http404(f"Error generating favicon: {str(e)}")
+        if not self._allowed(request):
+            response = HttpResponse('Forbidden', status=403, content_type='text/plain')
+            response['WWW-Authenticate'] = 'Bearer'
+            return response
+        metrics.registry.flush()
+        body = metrics.render(*metrics.collect())
+        return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,134 @@
+"""Warm-up for preforking servers (gunicorn ``--preload``), run once in the master.
+
+Everything built here is inherited by the workers and shared copy-on-write:
+login keys, URL resolvers, compiled templates, translation catalogs and
+time zone data. Database connections opened along the way are closed before
+returning. A connection inherited by several processes shares a single socket,
+and the first worker to close it would break the others.
+
+See ``gunicorn.conf.py`` in the project root.
+"""
+import gc
+import logging
+import time
+import zoneinfo
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.utils import OperationalError, ProgrammingError
+from django.template import engines
+from django.urls import get_resolver
+from django.utils import translation
+
+logger = logging.getLogger('neosign.warmup')
+
+
+@dataclass
+class WarmupReport:
+    steps: dict[str, float] = field(default_factory=dict)
+    templates: int = 0
+
+    def __str__(self):
+        timings = ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in self.steps.items())
+        return f'warm-up: {timings}; {self.templates} templates'
+
+
+def load_login_keys() -> None:
+    """Create the login key pair if missing, parse it and check that both halves belong together."""
+    from cryptography.hazmat.primitives import serialization
+
+    from authentication import utils
+
+    paths = utils.login_key_paths()
+    utils._ensure_keys_exist(paths)
+    private_key = utils._load_private_key(paths.private, paths.private.stat().st_mtime_ns)
+    public_key = serialization.load_pem_public_key(paths.public.read_bytes())
+    if private_key.public_key().public_numbers() != public_key.public_numbers():
+        raise ImproperlyConfigured(f'Login keys {paths.private} and {paths.public} do not match.')
+
+
+def compile_url_resolvers() -> None:
+    resolver = get_resolver()
+    # Populates the reverse and namespace dictionaries of the root and included resolvers.
+    resolver.reverse_dict
+    for namespace, (_prefix, sub_resolver) in resolver.namespace_dict.items():
+        sub_resolver.reverse_dict
+
+
+def compile_templates() -> int:
+    """Load every template into the cached loader of each Django template engine."""
+    count = 0
+    for engine in engines.all():
+        if not hasattr(engine, 'engine'):
+            continue
+        for directory in engine.template_dirs:
+            root = Path(directory)
+            for path in sorted(root.rglob('*.html')):
+                engine.get_template(path.relative_to(root).as_posix())
+                count += 1
+    return count
+
+
+def prime_config() -> None:
+    """Load the configured time zone and the translation catalogs of every language."""
+    from .models import SystemConfig
+
+    try:
+        config = SystemConfig.objects.first()
+    except (OperationalError, ProgrammingError):
+        config = None  # not installed/migrated yet
+    zoneinfo.ZoneInfo(settings.TIME_ZONE)
+    if config and config.timezone_str:
+        try:
+            zoneinfo.ZoneInfo(config.timezone_str)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            logger.warning('Unknown time zone %r in the site settings', config.timezone_str)
+    for code, _name in settings.LANGUAGES:
+        with translation.override(code):
+            translation.gettext('')
+
+
+def import_optional_modules() -> None:
+    """Import the libraries the views load lazily, so workers share them instead of importing each."""
+    import openpyxl  # noqa: F401
+    import qrcode  # noqa: F401
+    from PIL import Image  # noqa: F401
+
+
+def close_connections() -> None:
+    from .db_routers import replica_health
+
+    for connection in connections.all(initialized_only=True):
+        connection.close()
+    replica_health.reset()
+
+
+def warm_up(import_optional: bool = True, freeze_gc: bool = False) -> WarmupReport:
+    """Run every warm-up step; DB connections are closed even if a step fails."""
+    report = WarmupReport()
+    steps = [
+        ('keys', load_login_keys),
+        ('urls', compile_url_resolvers),
+        ('templates', compile_templates),
+        ('config', prime_config),
+    ]
+    if import_optional:
+        steps.append(('imports', import_optional_modules))
+    try:
+        for name, step in steps:
+            start = time.perf_counter()
+            result = step()
+            report.steps[name] = time.perf_counter() - start
+            if name == 'templates':
+                report.templates = result
+    finally:
+        close_connections()
+    if freeze_gc:
+        # Move everything allocated so far out of the collector's reach, so GC
+        # passes in the workers do not touch (and un-share) these pages.
+        gc.collect()
+        gc.freeze()
+    return report
@@ -0,0 +1,71 @@
+"""gunicorn configuration for NeoSign.
+
+    gunicorn NeoSign.wsgi            # picks up ./gunicorn.conf.py
+    gunicorn -c gunicorn.conf.py NeoSign.wsgi
+
+The application is loaded once in the master (``preload_app``). core.warmup
+then loads the login keys, URL resolvers, templates, translations and lazily
+imported libraries, closes every database connection and freezes the garbage
+collector before the workers are forked. Workers start serving immediately and
+share that memory copy-on-write. Code changes need a full restart (not HUP).
+
+Every setting can be overridden with the GUNICORN_* environment variables below.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+threads = int(os.environ.get('GUNICORN_THREADS', '1'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+# Recycle workers now and then to bound memory growth; the jitter avoids restarting all at once.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True').lower() == 'true'
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.environ.get('GUNICORN_ERROR_LOG', '-')
+
+raw_env = ['DJANGO_SETTINGS_MODULE=NeoSign.settings']
+
+
+def when_ready(server):
+    """Runs in the master after the application is loaded and before the first fork."""
+    if not preload_app:
+        return
+    from checkin import ingest
+    from core.warmup import warm_up
+
+    if ingest.enabled():
+        # Check-ins journaled by workers that died with the previous master.
+        server.log.info('Replayed %d journaled check-ins', ingest.replay_orphans(ingest.journal_dir()))
+    server.log.info(str(warm_up(freeze_gc=True)))
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    # Connections were closed in the master; make sure none slipped through.
+    from django.db import connections
+
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is not None:
+            server.log.warning('Worker %s inherited an open %s connection', worker.pid, connection.alias)
+            # Drop it without closing: the socket still belongs to the master.
+            connection.connection = None
+
+
+def post_worker_init(worker):
+    # Load check-in data ahead of activity windows in every worker (CHECKIN_PREWARM).
+    from checkin import prewarm
+
+    prewarm.start()
+
+
+def worker_exit(server, worker):
+    # Write the check-ins still in the write-behind buffer (CHECKIN_WRITE_BEHIND).
+    from checkin import ingest
+
+    ingest.shutdown()
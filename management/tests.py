@@ -0,0 +1,205 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import identify_hasher
+from django.test import TestCase, tag
+from django.urls import reverse
+from django.utils import timezone
+
+from checkin.models import Activity, CheckInRecord
+from core.testing import LARGE, SMALL, QueryBudgetMixin, seed
+
+User = get_user_model()
+
+
+class ManagementViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Query budgets for every view in management.urls; they must not grow with the data."""
+
+    size = SMALL
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(cls.size)
+
+    def setUp(self):
+        self.client.force_login(self.data.admin)
+
+    def _activity_form(self, **overrides):
+        now = timezone.localtime()
+        data = {
+            'name': 'Budget activity',
+            'description': '',
+            'start_time': (now - timezone.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            'end_time': (now + timezone.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            'is_active': 'on',
+            'repeat_type': 'none',
+            'location_radius_m': '0',
+            'qr_refresh_interval_s': '30',
+            'checkin_mode': 'basic',
+            'participants': [str(user.pk) for user in self.data.members],
+        }
+        data.update(overrides)
+        return data
+
+    def test_dashboard(self):
+        self.assertQueryBudget(7, 'get', reverse('management:dashboard'))
+
+    def test_user_list(self):
+        self.assertQueryBudget(9, 'get', reverse('management:user_list'))
+
+    def test_user_list_search(self):
+        self.assertQueryBudget(9, 'get', reverse('management:user_list'), {'q': '2000'})
+
+    def test_user_bulk_create(self):
+        usernames = '\n'.join(f'{30000000 + i}' for i in range(self.size.users))
+        response = self.assertQueryBudget(
+            9, 'post', reverse('management:user_bulk_create'), {'usernames': usernames, 'format': 'csv'}
+        )
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(User.objects.filter(username__startswith='3').count(), self.size.users)
+
+    def test_user_bulk_reset(self):
+        ids = [user.pk for user in self.data.members[:20]]
+        response = self.assertQueryBudget(
+            10, 'post', reverse('management:user_bulk_reset'), {'user_ids': ids, 'format': 'csv'}
+        )
+        self.assertEqual(User.objects.filter(pk__in=ids, first_login=True).count(), len(ids))
+        # Reset passwords are hashed like any other password, not with the bulk import hasher.
+        username, password = response.content.decode('utf-8-sig').splitlines()[1].split(',')
+        user = User.objects.get(username=username)
+        self.assertTrue(user.check_password(password))
+        self.assertFalse(identify_hasher(user.password).must_update(user.password))
+
+    def test_user_bulk_delete(self):
+        ids = [user.pk for user in self.data.members]
+        self.assertQueryBudget(17, 'post', reverse('management:user_bulk_delete'), {'user_ids': ids}, status=302)
+        self.assertFalse(User.objects.filter(pk__in=ids).exists())
+
+    def test_user_bulk_role(self):
+        ids = [user.pk for user in self.data.members]
+        self.assertQueryBudget(
+            7, 'post', reverse('management:user_bulk_role'), {'user_ids': ids, 'role': 'staff'}, status=302
+        )
+        self.assertEqual(User.objects.filter(pk__in=ids, is_staff=True).count(), len(ids))
+
+    def test_user_reset(self):
+        self.assertQueryBudget(9, 'post', reverse('management:user_reset', args=[self.data.member.pk]), status=302)
+
+    def test_user_delete(self):
+        self.assertQueryBudget(14, 'post', reverse('management:user_delete', args=[self.data.member.pk]), status=302)
+        self.assertFalse(User.objects.filter(pk=self.data.member.pk).exists())
+
+    def test_activity_list(self):
+        self.assertQueryBudget(9, 'get', reverse('management:activity_list'))
+
+    def test_activity_create_form(self):
+        self.assertQueryBudget(8, 'get', reverse('management:activity_create'))
+
+    def test_activity_create(self):
+        response = self.assertQueryBudget(
+            8, 'post', reverse('management:activity_create'), self._activity_form(), status=302
+        )
+        self.assertRedirects(response, reverse('management:activity_list'), fetch_redirect_response=False)
+        activity = Activity.objects.get(name='Budget activity')
+        self.assertEqual(activity.activityparticipation_set.count(), self.size.users)
+
+    def test_activity_edit_form(self):
+        self.assertQueryBudget(11, 'get', reverse('management:activity_edit', args=[self.data.activity.pk]))
+
+    def test_activity_edit(self):
+        keep = self.data.members[: self.size.users // 2]
+        data = self._activity_form(participants=[str(user.pk) for user in keep])
+        response = self.assertQueryBudget(
+            11, 'post', reverse('management:activity_edit', args=[self.data.activity.pk]), data, status=302
+        )
+        self.assertRedirects(response, reverse('management:activity_list'), fetch_redirect_response=False)
+        self.assertEqual(self.data.activity.activityparticipation_set.count(), len(keep))
+
+    def test_activity_close(self):
+        url = reverse('management:activity_close', args=[self.data.activity.pk])
+        self.assertQueryBudget(8, 'post', url, status=302)
+
+    def test_activity_delete(self):
+        url = reverse('management:activity_delete', args=[self.data.activity.pk])
+        self.assertQueryBudget(10, 'post', url, status=302)
+        self.assertFalse(CheckInRecord.objects.filter(activity_id=self.data.activity.pk).exists())
+
+    def test_activity_stats(self):
+        response = self.assertQueryBudget(
+            15, 'get', reverse('management:activity_stats', args=[self.data.activity.pk])
+        )
+        self.assertEqual(response.context['total_participants'], self.size.users)
+
+    def test_activity_stats_export(self):
+        for kind in ('checked', 'unchecked'):
+            for fmt in ('csv', 'xlsx'):
+                with self.subTest(kind=kind, fmt=fmt):
+                    url = reverse('management:activity_stats_export', args=[self.data.activity.pk, kind, fmt])
+                    self.assertQueryBudget(9, 'get', url)
+
+    def test_activity_status_update(self):
+        url = reverse('management:activity_status_update', args=[self.data.activity.pk])
+        self.assertQueryBudget(14, 'post', url, {'user_id': self.data.member.pk, 'status': 'proxy'}, status=302)
+        self.assertTrue(self.data.activity.checkins.filter(user=self.data.member, status='proxy').exists())
+
+    def test_site_settings_form(self):
+        self.assertQueryBudget(8, 'get', reverse('management:site_settings'))
+
+
+class ManagementViewQueryBudgetLargeTests(ManagementViewQueryBudgetTests):
+    size = LARGE
+
+    @tag('timing')
+    def test_render_times(self):
+        pages = [
+            reverse('management:user_list'),
+            reverse('management:activity_list'),
+            reverse('management:activity_create'),
+            reverse('management:activity_edit', args=[self.data.activity.pk]),
+            reverse('management:activity_stats', args=[self.data.activity.pk]),
+        ]
+        for url in pages:
+            with self.subTest(url=url), self.assertFasterThan(1.0, url):
+                self.client.get(url)
+
+
+class ActivityFenceFormTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(SMALL)
+
+    def setUp(self):
+        self.client.force_login(self.data.admin)
+        self.location = self.data.activities[2]  # a 500 m circle at (31.23, 121.47)
+        self.url = reverse('management:activity_edit', args=[self.location.pk])
+
+    def _form(self, **overrides):
+        now = timezone.localtime()
+        data = {
+            'name': self.location.name,
+            'start_time': (now - timezone.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            'end_time': (now + timezone.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            'is_active': 'on',
+            'repeat_type': 'none',
+            'location_lat': '31.23',
+            'location_lng': '121.47',
+            'location_radius_m': '500',
+            'location_fences': '',
+            'qr_refresh_interval_s': '30',
+            'checkin_mode': 'location',
+            'participants': [str(user.pk) for user in self.data.members],
+        }
+        data.update(overrides)
+        return data
+
+    def test_invalid_fence(self):
+        response = self.client.post(self.url, self._form(location_fences='[{"lat": 31.2}]'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('location_fences', response.context['form'].errors)
+
+    def test_shrinking_the_fence_reports_checkins_outside(self):
+        record = self.location.checkin_records().first()
+        CheckInRecord.objects.filter(pk=record.pk).update(latitude=31.2330, longitude=121.47)
+        fences = '[{"polygon": [[31.3, 121.5], [31.3, 121.6], [31.4, 121.6]]}]'
+        response = self.client.post(self.url, self._form(location_radius_m='100', location_fences=fences), follow=True)
+        self.assertIn('1 条已有签到记录不在新的签到范围内', [str(m) for m in response.context['messages']])
+        self.location.refresh_from_db()
+        self.assertEqual(self.location.location_fences, [{'polygon': [[31.3, 121.5], [31.3, 121.6], [31.4, 121.6]]}])
@@ -9,9 +9,12 @@ from .views import (
     ActivityStatsView,
     ActivityStatusUpdateView,
     ActivityUpdateView,
+    CpuProfileDownloadView,
+    CpuProfileListView,
     UserBulkCreateView,
     UserBulkDeleteView,
     ManagementDashboardView,
+    QueryProfileView,
     SiteSettingsView,
     UserBulkResetView,
     UserBulkRoleUpdateView,
@@ -48,4 +51,7 @@ urlpatterns = [
         name='activity_status_update',
     ),
     path('site-settings/', SiteSettingsView.as_view(), name='site_settings'),
+    path('diagnostics/queries/', QueryProfileView.as_view(), name='query_profiles'),
+    path('diagnostics/cpu/', CpuProfileListView.as_view(), name='cpu_profiles'),
+    path('diagnostics/cpu/<str:name>/', CpuProfileDownloadView.as_view(), name='cpu_profile_download'),
 ]
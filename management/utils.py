@@ -5,17 +5,23 @@ import re
 import string
 from typing import Iterable, Sequence
 
-from openpyxl import Workbook
 from core.models import SystemConfig
 from django.http import HttpResponse
 
 
-def generate_random_password(length: int = 12) -> str:
-    # Load policy from SystemConfig
+def load_password_policy() -> SystemConfig | None:
+    """The site configuration holding the password policy, or None to use the defaults."""
     try:
         cfg, _ = SystemConfig.objects.get_or_create(pk=1)
     except Exception:
         cfg = None
+    return cfg
+
+
+def generate_random_password(length: int = 12, cfg: SystemConfig | None = None) -> str:
+    # Load policy from SystemConfig (bulk callers pass it in to avoid a query per password)
+    if cfg is None:
+        cfg = load_password_policy()
 
     length = max(6, (cfg.password_length if cfg else length))
     require_upper = (cfg.password_require_uppercase if cfg else True)
@@ -70,8 +76,9 @@ def export_table_to_csv(headers: Sequence[str], rows: Iterable[Sequence[str]], f
 
 
 def export_table_to_xlsx(headers: Sequence[str], rows: Iterable[Sequence[str]], filename: str, column_widths: Sequence[int] = None) -> HttpResponse:
+    from openpyxl import Workbook  # slow to import; only needed for exports
     from openpyxl.styles import Alignment
-    
+
     workbook = Workbook()
     sheet = workbook.active
     sheet.title = '导出'
@@ -4,7 +4,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.core.paginator import Paginator
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponse
 from django.db.models import Q
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse_lazy
@@ -15,13 +15,17 @@ from django.views.generic import CreateView, TemplateView, UpdateView
 from django.conf import settings
 from django.contrib.auth.hashers import PBKDF2PasswordHasher
 
-from checkin.models import Activity, ActivityParticipation, CheckInRecord
+from checkin.models import Activity, CheckInRecord
+from checkin import geofence, sharding
 from datetime import datetime, time, timedelta
+from core import cpu_profiler, query_profiler, site_assets
+from core.db_routers import ReplicaReadMixin
 from core.models import SystemConfig
 from .utils import (
     export_table_to_csv,
     export_table_to_xlsx,
     generate_random_password,
+    load_password_policy,
     parse_users_from_csv_upload,
     parse_users_from_text,
 )
@@ -52,7 +56,7 @@ class ManagementDashboardView(LoginRequiredMixin, AdminOnlyMixin, TemplateView):
     template_name = 'management/dashboard.html'
 
 
-class UserListView(LoginRequiredMixin, AdminOnlyMixin, TemplateView):
+class UserListView(LoginRequiredMixin, AdminOnlyMixin, ReplicaReadMixin, TemplateView):
     template_name = 'management/user_list.html'
     paginate_by = 10
 
@@ -114,12 +118,14 @@ class UserBulkResetView(LoginRequiredMixin, AdminOnlyMixin, View):
             return redirect('management:user_list')
 
         rows = []
+        users = list(users)
+        cfg = load_password_policy()
         for user in users:
-            password = generate_random_password()
-            user.set_password(password)
+            password = generate_random_password(cfg=cfg)
+            user.password = make_password(password)
             user.first_login = True
-            user.save(update_fields=['password', 'first_login'])
             rows.append([user.username, password])
+        User.objects.bulk_update(users, ['password', 'first_login'], batch_size=1000)
 
         headers = ['用户名', '新密码']
         filename = 'user_password_reset'
@@ -206,10 +212,11 @@ class UserBulkCreateView(LoginRequiredMixin, AdminOnlyMixin, View):
         )
 
         pending = []
+        cfg = load_password_policy()
         for username, name in user_map.items():
             if username in existing_ids:
                 continue
-            password = generate_random_password()
+            password = generate_random_password(cfg=cfg)
             pending.append((username, name or '', password))
 
         if not pending:
@@ -235,7 +242,7 @@ class UserBulkCreateView(LoginRequiredMixin, AdminOnlyMixin, View):
         return export_table_to_xlsx(headers, rows, filename)
 
 
-class ActivityListView(LoginRequiredMixin, AdminOnlyMixin, TemplateView):
+class ActivityListView(LoginRequiredMixin, AdminOnlyMixin, ReplicaReadMixin, TemplateView):
     template_name = 'management/activity_list.html'
     paginate_by = 10
 
@@ -248,13 +255,16 @@ class ActivityListView(LoginRequiredMixin, AdminOnlyMixin, TemplateView):
         return context
 
 
+FENCE_FIELDS = {'location_lat', 'location_lng', 'location_radius_m', 'location_fences'}
+
+
 class ActivityForm(forms.ModelForm):
     class Meta:
         model = Activity
         fields = [
             'name', 'description', 'start_time', 'end_time', 'is_active',
             'repeat_type', 'window_start_time', 'window_end_time',
-            'location_enabled', 'location_lat', 'location_lng', 'location_radius_m',
+            'location_enabled', 'location_lat', 'location_lng', 'location_radius_m', 'location_fences',
             'qr_enabled', 'qr_refresh_interval_s',
         ]
 
@@ -266,6 +276,12 @@ class ActivityForm(forms.ModelForm):
         if 'is_active' in self.fields:
             self.fields['is_active'].required = False
 
+    def clean_location_fences(self):
+        try:
+            return geofence.parse_shapes(self.cleaned_data.get('location_fences'))
+        except ValueError as exc:
+            raise forms.ValidationError(_('附加签到区域无效：%(error)s') % {'error': exc})
+
     def clean(self):
         data = super().clean()
         repeat_type = data.get('repeat_type') or 'none'
@@ -330,10 +346,7 @@ class ActivityCreateView(LoginRequiredMixin, AdminOnlyMixin, CreateView):
         apply_checkin_mode(self.request, form)
         response = super().form_valid(form)
         participant_ids = [int(uid) for uid in self.request.POST.getlist('participants') if uid]
-        for user_id in participant_ids:
-            ActivityParticipation.objects.get_or_create(
-                activity=self.object, user_id=user_id, defaults={'can_participate': True}
-            )
+        sharding.add_participants(self.object, participant_ids)
         messages.success(self.request, _('活动创建成功'))
         return response
 
@@ -346,15 +359,14 @@ class ActivityUpdateView(LoginRequiredMixin, AdminOnlyMixin, UpdateView):
 
     def get_initial(self):
         initial = super().get_initial()
-        participants = self.object.participants.values_list('username', flat=True)
-        initial['participants'] = ' '.join(participants)
+        usernames = sharding.participants(self.object).values_list('username', flat=True)
+        initial['participants'] = ' '.join(usernames)
         return initial
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        participants = self.object.participants.values_list('id', flat=True)
         context['users'] = User.objects.all().order_by('username')
-        context['selected_user_ids'] = list(participants)
+        context['selected_user_ids'] = list(sharding.participant_ids(self.object))
         context['is_edit'] = True
         context['weekday_selected'] = self.object.repeat_weekdays or []
         return context
@@ -374,14 +386,17 @@ class ActivityUpdateView(LoginRequiredMixin, AdminOnlyMixin, UpdateView):
         user_ids = set(participant_ids)
 
         # remove old participants not in new set
-        ActivityParticipation.objects.filter(activity=self.object).exclude(user_id__in=user_ids).delete()
-        # add new participants
-        for uid in user_ids:
-            ActivityParticipation.objects.get_or_create(
-                activity=self.object, user_id=uid, defaults={'can_participate': True}
-            )
+        self.object.activityparticipation_set.exclude(user_id__in=user_ids).delete()
+        # add new participants; this also invalidates the check-in membership cache
+        sharding.add_participants(self.object, user_ids)
 
         messages.success(self.request, _('活动已更新'))
+        if FENCE_FIELDS.intersection(form.changed_data):
+            outside = geofence.outside_checkins(self.object)
+            if outside:
+                messages.warning(
+                    self.request, _('%(count)d 条已有签到记录不在新的签到范围内') % {'count': len(outside)}
+                )
         return response
 
 
@@ -390,7 +405,7 @@ class ActivityCloseView(LoginRequiredMixin, AdminOnlyMixin, View):
         activity = get_object_or_404(Activity, pk=pk)
         activity.is_active = False
         activity.end_time = timezone.now()
-        activity.save(update_fields=['is_active', 'end_time'])
+        activity.save(update_fields=['is_active', 'end_time', 'updated_at'])
         messages.success(request, _('活动已提前结束'))
         return redirect('management:activity_list')
 
@@ -404,7 +419,7 @@ class ActivityDeleteView(LoginRequiredMixin, AdminOnlyMixin, View):
         return redirect('management:activity_list')
 
 
-class ActivityStatsView(LoginRequiredMixin, AdminOnlyMixin, TemplateView):
+class ActivityStatsView(LoginRequiredMixin, AdminOnlyMixin, ReplicaReadMixin, TemplateView):
     template_name = 'management/activity_stats.html'
     paginate_by = 10
 
@@ -413,9 +428,9 @@ class ActivityStatsView(LoginRequiredMixin, AdminOnlyMixin, TemplateView):
         activity = get_object_or_404(Activity, id=self.kwargs['activity_id'])
         
         # Exclude test users from stats
-        checked_qs = CheckInRecord.objects.filter(activity=activity).select_related('user').exclude(user__is_test=True)
+        checked_qs = sharding.checkins_with_users(activity)
         checked_users = set(checked_qs.values_list('user_id', flat=True))
-        participants_qs = activity.participants.exclude(is_test=True)
+        participants_qs = sharding.participants(activity).exclude(is_test=True)
         unchecked_qs = participants_qs.exclude(id__in=checked_users)
 
         checked_paginator = Paginator(checked_qs, self.paginate_by)
@@ -443,12 +458,12 @@ class ActivityStatusUpdateView(LoginRequiredMixin, AdminOnlyMixin, View):
             return redirect('management:activity_stats', activity_id=activity_id)
 
         user = get_object_or_404(User, id=user_id)
-        if not activity.participants.filter(id=user_id).exists():
+        if not activity.activityparticipation_set.filter(user_id=user_id).exists():
             messages.warning(request, _('该用户不在活动参与名单中'))
             return redirect('management:activity_stats', activity_id=activity_id)
 
         if action == 'clear':
-            CheckInRecord.objects.filter(activity=activity, user=user).delete()
+            activity.checkin_records(until=timezone.now()).filter(user=user).delete()
             messages.success(request, _('已清除此用户的签到记录，可重新测试或签到。'))
             return redirect('management:activity_stats', activity_id=activity_id)
 
@@ -458,12 +473,11 @@ class ActivityStatusUpdateView(LoginRequiredMixin, AdminOnlyMixin, View):
 
         # If status is ABSENT, delete the record (same as clear)
         if status == CheckInRecord.CheckInStatus.ABSENT:
-            CheckInRecord.objects.filter(activity=activity, user=user).delete()
+            activity.checkin_records(until=timezone.now()).filter(user=user).delete()
             messages.success(request, _('已设为未签到状态'))
             return redirect('management:activity_stats', activity_id=activity_id)
 
-        record, created = CheckInRecord.objects.get_or_create(
-            activity=activity,
+        record, created = activity.checkins.get_or_create(
             user=user,
             defaults={'status': status, 'status_note': note},
         )
@@ -476,15 +490,15 @@ class ActivityStatusUpdateView(LoginRequiredMixin, AdminOnlyMixin, View):
         return redirect('management:activity_stats', activity_id=activity_id)
 
 
-class ActivityStatsExportView(LoginRequiredMixin, AdminOnlyMixin, View):
+class ActivityStatsExportView(LoginRequiredMixin, AdminOnlyMixin, ReplicaReadMixin, View):
     def get(self, request, activity_id, kind, fmt):
         activity = get_object_or_404(Activity, id=activity_id)
         headers = ['用户名', '姓名', '签到时间', 'IP地址', '状态']
 
         # Exclude test users from export
-        checked_qs = CheckInRecord.objects.filter(activity=activity).select_related('user').exclude(user__is_test=True)
+        checked_qs = sharding.checkins_with_users(activity)
         checked_ids = set(checked_qs.values_list('user_id', flat=True))
-        participants_qs = activity.participants.exclude(is_test=True)
+        participants_qs = sharding.participants(activity).exclude(is_test=True)
 
         if kind == 'checked':
             rows = [
@@ -595,7 +609,10 @@ class SiteSettingsView(LoginRequiredMixin, AdminOnlyMixin, UpdateView):
 
     def form_valid(self, form):
         messages.success(self.request, _('网站设置已更新'))
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        if 'site_logo' in form.changed_data:
+            site_assets.invalidate(self.object)
+        return response
 
 
 def apply_repeat_and_time(request, form):
@@ -650,3 +667,49 @@ def apply_checkin_mode(request, form):
     mode = request.POST.get('checkin_mode', 'basic')
     form.instance.location_enabled = mode in ['location', 'both']
     form.instance.qr_enabled = mode in ['qr', 'both']
+
+
+class QueryProfileView(LoginRequiredMixin, AdminOnlyMixin, TemplateView):
+    """Recent slow-query / N+1 findings recorded by core.query_profiler."""
+    template_name = 'management/query_profiles.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(
+            reports=query_profiler.recent_reports(),
+            header=query_profiler.PROFILE_HEADER,
+            cookie=query_profiler.PROFILE_COOKIE,
+            sample_rate=settings.QUERY_PROFILER_SAMPLE_RATE,
+            slow_ms=settings.QUERY_PROFILER_SLOW_MS,
+            repeat_threshold=settings.QUERY_PROFILER_REPEAT_THRESHOLD,
+        )
+        return context
+
+
+class CpuProfileListView(LoginRequiredMixin, AdminOnlyMixin, TemplateView):
+    """Collapsed-stack profiles recorded by core.cpu_profiler."""
+    template_name = 'management/cpu_profiles.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(
+            profiles=cpu_profiler.list_profiles(),
+            paths=settings.CPU_PROFILER_PATHS,
+            sample_rate=settings.CPU_PROFILER_SAMPLE_RATE,
+        )
+        return context
+
+
+class CpuProfileDownloadView(LoginRequiredMixin, AdminOnlyMixin, View):
+    """Download a profile as collapsed stacks, or as an SVG flame graph with ?format=svg."""
+
+    def get(self, request, name):
+        path = cpu_profiler.profile_path(name)
+        if path is None:
+            raise Http404
+        if request.GET.get('format') == 'svg':
+            svg = cpu_profiler.render_svg(path.read_text(encoding='utf-8'), title=name)
+            response = HttpResponse(svg, content_type='image/svg+xml')
+            response['Content-Disposition'] = f'attachment; filename="{path.stem}.svg"'
+            return response
+        return FileResponse(path.open('rb'), as_attachment=True, filename=name, content_type='text/plain')